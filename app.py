@@ -1,46 +1,149 @@
+import hashlib
 import os
-
-from flask import Flask, render_template, request, flash, redirect, session, g
-from flask_debugtoolbar import DebugToolbarExtension
+import weakref
+
+import click
+from flask import (
+    Blueprint, Flask, render_template, request, flash, redirect, session, g,
+    abort, current_app, jsonify, make_response,
+)
+from flask_migrate import Migrate
+from markupsafe import Markup
 from sqlalchemy.exc import IntegrityError
 
-from forms import UserAddForm, LoginForm, MessageForm
-from models import db, connect_db, User, Message
+import assets
+from cache import LRUCache
+from config import PROFILES
+from identity import load_current_user
+from passwords import hasher, PoolBusy
+from models import (
+    db, connect_db, User, Message, Follows, Likes, TimelineEntry, live_authors,
+    who_to_follow,
+)
+import counters
+import deletion
+import instrumentation
+import jobs
+import metrics
+import query_plans
+import replicas
+from replicas import replica_reads
+import search
+import timelines
+from pagination import paginate
 
 CURR_USER_KEY = "curr_user"
 
-app = Flask(__name__)
+# Every route, hook and command below; create_app() registers them.
+bp = Blueprint('warbler', __name__, cli_group=None)
+
+# Logged-in users' identity records, per worker process (see identity.py)
+identity_cache = LRUCache(10000)
+
+# Rendered message <li>s, per worker process (see message_item below)
+fragment_cache = LRUCache(100000)
+
+# Engines of the apps created in this process, without keeping them alive.
+# A forked worker must not reuse connections opened before the fork
+# (they'd be shared with its siblings), so it lets every engine open its
+# own; the hook is registered once, however many apps are created.
+_engines = weakref.WeakSet()
+
 
-# Get DB_URI from environ variable (useful for production/testing) or,
-# if not set there, use development local db.
-app.config['SQLALCHEMY_DATABASE_URI'] = (
-    os.environ.get('DATABASE_URL', 'postgresql:///warbler'))
+def _dispose_engines_after_fork():
+    for engine in list(_engines):
+        engine.dispose(close=False)
 
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = False
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-toolbar = DebugToolbarExtension(app)
-app.app_context().push()
-connect_db(app)
+
+os.register_at_fork(after_in_child=_dispose_engines_after_fork)
+
+
+##############################################################################
+# Application factory
+
+
+def create_app(config=None):
+    """Create the Warbler app with the named configuration profile.
+
+    `config` is a name from config.PROFILES (by default the WARBLER_CONFIG
+    environment variable, or 'development'), or a config object. Nothing
+    connects to the database until the first request, so the app can be
+    created in a gunicorn master and forked (--preload); each worker then
+    opens its own connections.
+    """
+
+    if config is None:
+        config = os.environ.get('WARBLER_CONFIG', 'development')
+    if isinstance(config, str):
+        config = PROFILES[config]
+
+    app = Flask(__name__)
+    app.config.from_object(config)
+    app.config['SQLALCHEMY_BINDS'] = replicas.binds(
+        app.config['DATABASE_REPLICA_URLS'])
+    if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql'):
+        # Times pool checkouts for /metrics
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            'poolclass': metrics.TimedQueuePool,
+        }
+
+    if app.config['DEBUG_TOOLBAR']:
+        # Imported here: production never pays for loading it.
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
+
+    connect_db(app)
+    Migrate(app, db)
+
+    with app.app_context():
+        engines = list(db.engines.values())
+        replicas.init_app(app, db)
+        hasher.init_app(app)
+        instrumentation.init_app(app, engines)
+        metrics.init_app(app, db.engines, hasher)
+    _engines.update(engines)
+
+    identity_cache.configure(app.config['IDENTITY_CACHE_SIZE'],
+                             ttl=app.config['IDENTITY_CACHE_TTL'])
+    fragment_cache.configure(app.config['FRAGMENT_CACHE_SIZE'],
+                             maxbytes=app.config['FRAGMENT_CACHE_BYTES'])
+
+    app.add_template_global(assets.asset_url)
+    app.add_template_global(assets.static_url)
+    app.add_url_rule('/assets/<path:filename>', 'assets', assets.send_asset)
+    app.register_blueprint(bp)
+
+    return app
 
 
 ##############################################################################
 # User signup/login/logout
 
 
-@app.before_request
+@bp.before_app_request
 def add_user_to_g():
     """If we're logged in, add curr user to Flask global."""
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = load_current_user(session[CURR_USER_KEY], identity_cache)
 
     else:
         g.user = None
 
 
+@bp.after_app_request
+def forget_changed_user(response):
+    """Drop the cached identity of a logged-in user who just wrote.
+
+    Posting, following and liking all change the user's own counters.
+    """
+
+    if g.get('user') and request.method not in ('GET', 'HEAD'):
+        identity_cache.invalidate(g.user.id)
+
+    return response
+
+
 def do_login(user):
     """Log in user."""
 
@@ -54,7 +157,7 @@ def do_logout():
         del session[CURR_USER_KEY]
 
 
-@app.route('/signup', methods=["GET", "POST"])
+@bp.route('/signup', methods=["GET", "POST"])
 def signup():
     """Handle user signup.
 
@@ -66,6 +169,7 @@ def signup():
     and re-present form.
     """
 
+    from forms import UserAddForm
     form = UserAddForm()
 
     if form.validate_on_submit():
@@ -82,6 +186,8 @@ def signup():
             flash("Username already taken", 'danger')
             return render_template('users/signup.html', form=form)
 
+        search.index_user(user)
+
         do_login(user)
 
         return redirect("/")
@@ -90,10 +196,11 @@ def signup():
         return render_template('users/signup.html', form=form)
 
 
-@app.route('/login', methods=["GET", "POST"])
+@bp.route('/login', methods=["GET", "POST"])
 def login():
     """Handle user login."""
 
+    from forms import LoginForm
     form = LoginForm()
 
     if form.validate_on_submit():
@@ -101,6 +208,7 @@ def login():
                                  form.password.data)
 
         if user:
+            db.session.commit()   # keep a rehashed password, if any
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -110,7 +218,7 @@ def login():
     return render_template('users/login.html', form=form)
 
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     """Handle logout of user."""
 
@@ -120,45 +228,96 @@ def logout():
 
 
 
+def paginated(query, timestamp_col, id_col):
+    """Page `query` using the `before`/`after` cursors in the querystring."""
+
+    try:
+        return paginate(query, timestamp_col, id_col,
+                        before=request.args.get('before'),
+                        after=request.args.get('after'),
+                        per_page=current_app.config['MESSAGES_PER_PAGE'])
+    except ValueError:
+        abort(400)
+
+
+def live_user_or_404(user_id):
+    """The user with `user_id`, or 404 if there's none or it was deleted."""
+
+    user = User.query.get_or_404(user_id)
+    if user.deleted_at is not None:
+        abort(404)
+    return user
+
+
+def liked_ids(messages):
+    """Ids of `messages` the logged-in user has liked, as a set."""
+
+    if not g.user:
+        return set()
+
+    return g.user.liked_message_ids([msg.id for msg in messages])
+
+
+def followed_ids(users):
+    """Ids of `users` the logged-in user follows, as a set."""
+
+    if not g.user:
+        return set()
+
+    return g.user.following_ids([user.id for user in users])
+
+
 ##############################################################################
 # General user routes:
 
-@app.route('/users')
+@bp.route('/users')
+@replica_reads
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search usernames, bios and
+    locations (see search.py), and an 'after' cursor for the next page.
     """
 
-    search = request.args.get('q')
+    q = request.args.get('q')
+    after = request.args.get('after')
 
-    if not search:
-        users = User.query.all()
-    else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+    try:
+        if not q:
+            page = search.list_users(after=after)
+        else:
+            page = search.search_users(q, after=after)
+    except ValueError:
+        abort(400)
 
-    return render_template('users/index.html', users=users)
+    return render_template('users/index.html', users=page.users, page=page,
+                           followed_ids=followed_ids(page.users))
 
 
-@app.route('/users/<int:user_id>')
+@bp.route('/users/<int:user_id>')
+@replica_reads
 def users_show(user_id):
     """Show user profile."""
 
-    user = User.query.get_or_404(user_id)
-    
+    user = live_user_or_404(user_id)
 
     # snagging messages in order from the database;
     # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    return render_template('users/show.html', user=user, messages=messages)
+    page = paginated(Message.query.filter(Message.user_id == user_id),
+                     Message.timestamp, Message.id)
+    liked = liked_ids(page.items)
+    followed = followed_ids([user])
 
+    return conditional(
+        lambda: render_template('users/show.html', user=user,
+                                messages=page.items, page=page,
+                                liked_ids=liked, followed_ids=followed),
+        user_version(user), [msg.id for msg in page.items],
+        page.older, page.newer, liked, followed)
 
-@app.route('/users/<int:user_id>/following')
+
+@bp.route('/users/<int:user_id>/following')
+@replica_reads
 def show_following(user_id):
     """Show list of people this user is following."""
 
@@ -166,11 +325,24 @@ def show_following(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    user = live_user_or_404(user_id)
+    following = (User
+                 .query
+                 .join(Follows, Follows.user_being_followed_id == User.id)
+                 .filter(Follows.user_following_id == user_id)
+                 .filter(User.deleted_at.is_(None))
+                 .all())
 
+    followed = followed_ids([user, *following])
 
-@app.route('/users/<int:user_id>/followers')
+    return conditional(
+        lambda: render_template('users/following.html', user=user,
+                                following=following, followed_ids=followed),
+        user_version(user), [user_version(u) for u in following], followed)
+
+
+@bp.route('/users/<int:user_id>/followers')
+@replica_reads
 def users_followers(user_id):
     """Show list of followers of this user."""
 
@@ -178,23 +350,42 @@ def users_followers(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    user = live_user_or_404(user_id)
+    followers = (User
+                 .query
+                 .join(Follows, Follows.user_following_id == User.id)
+                 .filter(Follows.user_being_followed_id == user_id)
+                 .filter(User.deleted_at.is_(None))
+                 .all())
+
+    followed = followed_ids([user, *followers])
 
-@app.route('/users/<int:user_id>/likes')
+    return conditional(
+        lambda: render_template('users/followers.html', user=user,
+                                followers=followers, followed_ids=followed),
+        user_version(user), [user_version(u) for u in followers], followed)
+
+@bp.route('/users/<int:user_id>/likes')
+@replica_reads
 def users_likes(user_id):
     """Show list of liked messages"""
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
-    user = User.query.get_or_404(user_id)
+    user = live_user_or_404(user_id)
 
-    liked_msgs = user.likes
-    return render_template('users/likes.html', messages = liked_msgs)
+    liked_msgs = live_authors(Message
+                              .query
+                              .join(Likes, Likes.message_id == Message.id)
+                              .filter(Likes.user_id == user.id))
+    page = paginated(liked_msgs, Message.timestamp, Message.id)
 
+    return render_template('users/likes.html', messages=page.items,
+                           page=page, liked_ids=liked_ids(page.items))
 
-@app.route('/users/follow/<int:follow_id>', methods=['POST'])
+
+@bp.route('/users/follow/<int:follow_id>', methods=['POST'])
 def add_follow(follow_id):
     """Add a follow for the currently-logged-in user."""
 
@@ -202,14 +393,16 @@ def add_follow(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
+    followed_user = live_user_or_404(follow_id)
+    db.session.add(Follows(user_being_followed_id=followed_user.id,
+                           user_following_id=g.user.id))
+    timelines.add_follow(g.user.id, followed_user.id)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
 
 
-@app.route('/users/stop-following/<int:follow_id>', methods=['POST'])
+@bp.route('/users/stop-following/<int:follow_id>', methods=['POST'])
 def stop_following(follow_id):
     """Have currently-logged-in-user stop following this user."""
 
@@ -217,29 +410,34 @@ def stop_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get_or_404(follow_id)
-    g.user.following.remove(followed_user)
+    follow = Follows.query.get_or_404((follow_id, g.user.id))
+    db.session.delete(follow)
+    timelines.remove_follow(g.user.id, follow_id)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
 
 
-@app.route('/users/profile', methods=["GET", "POST"])
+@bp.route('/users/profile', methods=["GET", "POST"])
 def profile():
     """Update profile for current user."""
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
-    user = g.user
+    user = g.user.load()
     # raise
+    from forms import UserAddForm
     form =  UserAddForm(obj = user)
     if form.validate_on_submit():
         if User.authenticate(user.username, form.password.data):
             user.username = form.username.data
             user.email = form.email.data
             user.image_url = form.image_url.data
+            user.profile_version += 1   # retires cached message fragments
 
             db.session.commit()   
+            identity_cache.invalidate(user.id)
+            search.index_user(user)
             flash(f"{user.username}'s profile has been updated.", "success")
             return redirect(f"/users/{user.id}")
         else: 
@@ -248,7 +446,7 @@ def profile():
     return render_template('users/edit.html', form=form)
 
 
-@app.route('/users/delete', methods=["POST"])
+@bp.route('/users/delete', methods=["POST"])
 def delete_user():
     """Delete user."""
 
@@ -258,8 +456,13 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    # The account disappears now; a job worker deletes its rows in chunks.
+    deletion.tombstone(g.user.id)
+    jobs.enqueue('delete_user', {'user_id': g.user.id},
+                 key=f'delete-user:{g.user.id}')
     db.session.commit()
+    identity_cache.invalidate(g.user.id)
+    search.unindex_user(g.user.id)
 
     return redirect("/signup")
 
@@ -267,7 +470,7 @@ def delete_user():
 ##############################################################################
 # Messages routes:
 
-@app.route('/messages/new', methods=["GET", "POST"])
+@bp.route('/messages/new', methods=["GET", "POST"])
 def messages_add():
     """Add a message:
 
@@ -278,11 +481,17 @@ def messages_add():
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
+    from forms import MessageForm
     form = MessageForm()
 
     if form.validate_on_submit():
-        msg = Message(text=form.text.data)
-        g.user.messages.append(msg)
+        msg = Message(text=form.text.data, user_id=g.user.id)
+        db.session.add(msg)
+        db.session.flush()
+        timelines.fan_out_to_author(msg)
+        jobs.enqueue('fan_out', {'message_id': msg.id},
+                     key=f'fan-out:{msg.id}')
+        search.index_message(msg)
         db.session.commit()
 
         return redirect(f"/users/{g.user.id}")
@@ -290,15 +499,44 @@ def messages_add():
     return render_template('messages/new.html', form=form)
 
 
-@app.route('/messages/<int:message_id>', methods=["GET"])
+@bp.route('/messages/search')
+@replica_reads
+def messages_search():
+    """Search messages for every word in the 'q' param, newest first."""
+
+    q = request.args.get('q', '')
+
+    try:
+        page = search.search_messages(
+            q,
+            before=request.args.get('before'),
+            after=request.args.get('after'),
+            per_page=current_app.config['MESSAGES_PER_PAGE'])
+    except ValueError:
+        abort(400)
+
+    return render_template('messages/search.html', q=q, messages=page.items,
+                           page=page, liked_ids=liked_ids(page.items))
+
+
+@bp.route('/messages/<int:message_id>', methods=["GET"])
+@replica_reads
 def messages_show(message_id):
     """Show a message."""
 
     msg = Message.query.get_or_404(message_id)
-    return render_template('messages/show.html', message=msg)
+    if msg.user.deleted_at is not None:
+        abort(404)
+    following = bool(g.user) and g.user.is_following(msg.user)
+
+    # Messages can't be edited, so only the author and viewer can change.
+    return conditional(
+        lambda: render_template('messages/show.html', message=msg,
+                                following=following),
+        msg.id, user_version(msg.user), following)
 
 
-@app.route('/messages/<int:message_id>/delete', methods=["POST"])
+@bp.route('/messages/<int:message_id>/delete', methods=["POST"])
 def messages_destroy(message_id):
     """Delete a message."""
 
@@ -307,78 +545,273 @@ def messages_destroy(message_id):
         return redirect("/")
 
     msg = Message.query.get_or_404(message_id)
+    profile_version = msg.user.profile_version
+    timelines.remove_message(msg.id)
+    search.unindex_message(msg.id)
     db.session.delete(msg)
     db.session.commit()
+    forget_message_items(msg, profile_version)
 
     return redirect(f"/users/{g.user.id}")
 
-@app.route('/messages/<int:message_id>/add-like', methods=['POST'])
+@bp.route('/messages/<int:message_id>/add-like', methods=['POST'])
 def messages_add_like(message_id):
     """Adds like to followed users' messages"""
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
-    msg = Message.query.get_or_404(message_id)
-    user_likes = g.user.likes
-    if msg in user_likes:
-        g.user.likes.remove(msg)
-        db.session.commit()
-        return redirect("/")
-    else:
-        g.user.likes.append(msg)
-        db.session.commit()
-        return redirect("/")
+    if Likes.toggle(g.user.id, message_id) is None:
+        abort(404)
+    db.session.commit()
+
+    return redirect("/")
 
     
 
 
+##############################################################################
+# Conditional GET
+
+
+def user_version(user):
+    """Values that change whenever `user`'s profile or counts do."""
+
+    return (user.id, user.profile_version, user.messages_count,
+            user.following_count, user.followers_count, user.likes_count)
+
+
+def conditional(render, *validators):
+    """Return a response from `render()`, or 304 if the client's is current.
+
+    The ETag is a hash of `validators`, which must change whenever the page
+    would, and of who is viewing it. Pages shown to a logged-in user are
+    private to them; browsers and caches must revalidate either way.
+    """
+
+    viewer = (g.user.id, g.user.username, g.user.image_url) if g.user else None
+    etag = hashlib.sha1(repr((viewer, validators)).encode('UTF-8')).hexdigest()
+
+    # A pending flash message has to be rendered, not served from cache.
+    if request.if_none_match.contains(etag) and '_flashes' not in session:
+        response = make_response('', 304)
+    else:
+        response = make_response(render())
+
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    if g.user:
+        response.cache_control.private = True
+    else:
+        response.cache_control.public = True
+    response.vary.add('Cookie')
+
+    return response
+
+
+##############################################################################
+# Message fragments
+
+
+@bp.app_template_global()
+def message_item(msg, author, liked=None):
+    """Render one message's <li>, from the fragment cache when possible.
+
+    `liked` is None if the viewer can't like the message, else whether they
+    have. Fragments are keyed by the author's profile version, so editing a
+    profile retires every fragment showing the old name or avatar, and by
+    the message's timestamp as well as its id: other workers' caches keep a
+    deleted message's fragments, and a new message reusing its id (as on
+    SQLite) must not be shown as the old one.
+    """
+
+    key = (msg.id, msg.timestamp, author.profile_version, liked)
+    html = fragment_cache.get(key)
+
+    if html is None:
+        html = Markup(render_template('messages/item.html', msg=msg,
+                                      author=author, liked=liked))
+        fragment_cache.set(key, html)
+
+    return html
+
+
+def forget_message_items(msg, profile_version):
+    """Drop every cached fragment of a message from this worker's cache."""
+
+    for liked in (None, True, False):
+        fragment_cache.invalidate(
+            (msg.id, msg.timestamp, profile_version, liked))
+
+
 ##############################################################################
 # Homepage and error pages
 
 
-@app.route('/')
+@bp.route('/')
+@replica_reads
 def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: 100 most recent messages of followed_users, with
+      cursors to page through older ones
+
+    Messages come from the user's materialized timeline (see timelines.py),
+    which is filled when messages are posted.
     """
 
     if g.user:
-        user = g.user
-        user_ids = [user.id] + [followed_user.id for followed_user in user.following]
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(user_ids))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
-
-        return render_template('home.html', messages=messages)
+        timeline = live_authors(Message
+                                .query
+                                .join(TimelineEntry,
+                                      TimelineEntry.message_id == Message.id)
+                                .filter(TimelineEntry.user_id == g.user.id))
+        page = paginated(timeline,
+                         TimelineEntry.timestamp, TimelineEntry.message_id)
+
+        return render_template(
+            'home.html', messages=page.items, page=page,
+            liked_ids=liked_ids(page.items),
+            suggestions=db.session.scalars(who_to_follow(g.user.id)).all())
 
     else:
         return render_template('home-anon.html')
 
-@app.errorhandler(404)
+@bp.app_errorhandler(404)
 def page_not_found(e):
     """Show 404 NOT FOUND page."""
 
     return render_template('404.html'), 404
 
+
+@bp.app_errorhandler(PoolBusy)
+def password_pool_busy(e):
+    """Ask the client to retry a login/signup when hashing is backed up."""
+
+    return ("Too many sign-ins right now; please try again shortly.", 503,
+            {'Retry-After': '1'})
+
+
+@bp.route('/_stats')
+def worker_stats():
+    """Show this worker process's cache and hashing statistics as JSON."""
+
+    return jsonify(identity_cache=identity_cache.stats(),
+                   fragment_cache=fragment_cache.stats(),
+                   password_pool=hasher.stats(),
+                   jobs=jobs.stats())
+
+
+##############################################################################
+# Maintenance commands
+
+
+@bp.cli.command('backfill-timelines')
+def backfill_timelines_command():
+    """Rebuild every user's home timeline from messages and follows."""
+
+    written = timelines.backfill()
+    click.echo(f"Wrote {written} timeline entries.")
+
+
+@bp.cli.command('reindex-messages')
+def reindex_messages_command():
+    """Rebuild the message search index from the messages table."""
+
+    indexed = search.reindex_messages()
+    click.echo(f"Indexed {indexed} messages.")
+
+
+@bp.cli.command('build-assets')
+def build_assets_command():
+    """Fingerprint and precompress static files into static/dist."""
+
+    manifest = assets.build(current_app.static_folder)
+    click.echo(f"Built {len(manifest)} assets.")
+
+
+@bp.cli.command('reconcile-counters')
+def reconcile_counters_command():
+    """Recompute users' message/follow/like counters from the tables."""
+
+    corrected = counters.reconcile()
+    click.echo(f"Corrected counters for {corrected} users.")
+
+
+@bp.cli.command('run-jobs')
+@click.option('--once', is_flag=True,
+              help="Exit when no jobs are due, instead of waiting for more.")
+def run_jobs_command(once):
+    """Run queued background jobs as they fall due."""
+
+    config = current_app.config
+    jobs.run_worker(batch_size=config['JOBS_BATCH_SIZE'],
+                    poll_seconds=config['JOBS_POLL_SECONDS'],
+                    max_attempts=config['JOBS_MAX_ATTEMPTS'],
+                    retry_seconds=config['JOBS_RETRY_SECONDS'],
+                    once=once, report=click.echo)
+
+
+@bp.cli.command('job-stats')
+def job_stats_command():
+    """Show how many background jobs are waiting, and for how long."""
+
+    stats = jobs.stats()
+    click.echo(f"{stats['due']} due, {stats['scheduled']} scheduled, "
+               f"{stats['failed']} failed; lag {stats['lag_seconds']:.1f}s")
+
+
+@bp.cli.command('delete-user')
+@click.argument('user_id', type=int)
+def delete_user_command(user_id):
+    """Delete an account now, in chunks, printing progress."""
+
+    deletion.tombstone(user_id)
+    db.session.commit()
+    totals = deletion.delete_account(
+        user_id, current_app.config['DELETION_CHUNK_SIZE'], report=click.echo)
+    click.echo(f"Deleted {sum(totals.values())} rows.")
+
+
+@bp.cli.command('recommend-follows')
+def recommend_follows_command():
+    """Recompute every user's "who to follow" recommendations."""
+
+    # Imported here so web workers don't load NumPy and SciPy.
+    import recommendations
+
+    written = recommendations.recommend(report=click.echo)
+    click.echo(f"Wrote {written} recommendations.")
+
+
+@bp.cli.command('check-query-plans')
+def check_query_plans_command():
+    """EXPLAIN the hot routes' queries; fail if any scans a whole table."""
+
+    try:
+        problems = query_plans.check(current_app, CURR_USER_KEY, report=click.echo)
+    except RuntimeError as exc:
+        raise click.ClickException(str(exc))
+
+    if problems:
+        raise click.ClickException(
+            f"{len(problems)} queries scan a whole table.")
+    click.echo("Every query uses an index.")
+
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
+# Caching policy
 #
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
+# Views that can be revalidated cheaply set their own headers through
+# conditional(); static files get Flask's ETag/Last-Modified handling. Every
+# other page is rendered for the current session and must not be stored.
+
+@bp.after_app_request
+def add_header(response):
+    """Mark responses without a caching policy as private and uncacheable."""
 
-@app.after_request
-def add_header(req):
-    """Add non-caching headers on every request."""
+    if request.endpoint != 'static' and not response.cache_control:
+        response.cache_control.private = True
+        response.cache_control.no_store = True
 
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
+    return response
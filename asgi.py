@@ -0,0 +1,389 @@
+"""Serve the busiest read-only pages from SQLAlchemy's asyncio engine.
+
+Every view in app.py is synchronous, so a worker is tied up for each
+database round trip it makes. This ASGI app serves the timeline, profiles,
+follower and following lists and single messages with asyncpg instead, so
+one process can keep hundreds of slow reads in flight. Every other request
+(and anything but GET or HEAD) goes to the ordinary Flask app, run in a
+thread.
+
+Pages are still rendered by the Flask app, inside a request context built
+from the ASGI request: the same templates, models.py mappings, session
+cookie, ETags, fragment cache and error pages as the sync views. Only the
+queries differ. An AsyncSession can't lazy load, so each view loads up
+front everything its template reads.
+
+    uvicorn --factory asgi:create_asgi_app --workers 4
+
+Configuration:
+
+  ASYNC_POOL_SIZE   connections per process to the primary, and to each
+                    replica (default 20)
+"""
+
+import random
+import sys
+import time
+from io import BytesIO
+
+from asgiref.wsgi import WsgiToAsgi
+from flask import (
+    abort, current_app, flash, g, redirect, render_template, request, session,
+)
+from sqlalchemy import exists, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import joinedload
+from werkzeug.exceptions import HTTPException
+
+from app import (
+    create_app, conditional, user_version, CURR_USER_KEY, identity_cache,
+)
+from identity import CurrentUser, record_select
+from models import (
+    User, Message, Follows, Likes, TimelineEntry, live_authors, who_to_follow,
+)
+from pagination import paginate_async
+from replicas import STICKY_KEY
+
+# Async views, by the endpoint of the sync view they replace
+VIEWS = {}
+
+
+def serves(endpoint):
+    """Register an async view for app.py's `endpoint`."""
+
+    def register(view):
+        VIEWS[f'warbler.{endpoint}'] = view
+        return view
+
+    return register
+
+
+def create_asgi_app(config=None):
+    """Create the Warbler app (see app.create_app), served over ASGI."""
+
+    return AsyncReads(create_app(config))
+
+
+class AsyncReads:
+    """An ASGI app serving VIEWS itself and everything else from `app`."""
+
+    def __init__(self, app):
+        self.app = app
+        self.wsgi = WsgiToAsgi(app)
+
+        if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql'):
+            raise RuntimeError("The async read path needs PostgreSQL")
+
+        urls = {None: app.config['SQLALCHEMY_DATABASE_URI']}
+        urls.update((name, url)
+                    for name, url in app.config['SQLALCHEMY_BINDS'].items()
+                    if name.startswith('replica'))
+
+        # Engines connect on first use, in whichever worker process that is.
+        self.engines = {
+            name: create_async_engine(
+                make_url(url).set(drivername='postgresql+asyncpg'),
+                pool_size=app.config['ASYNC_POOL_SIZE'])
+            for name, url in urls.items()
+        }
+        self.sessions = {
+            name: async_sessionmaker(engine, expire_on_commit=False)
+            for name, engine in self.engines.items()
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+
+        if scope['type'] == 'http' and scope['method'] in ('GET', 'HEAD'):
+            environ = wsgi_environ(scope)
+            try:
+                endpoint, _ = self.app.url_map.bind_to_environ(environ).match()
+            except HTTPException:
+                endpoint = None
+
+            if endpoint in VIEWS:
+                response = await self.serve(VIEWS[endpoint], environ)
+                return await send_response(response, scope, send)
+
+        await self.wsgi(scope, receive, send)
+
+    async def serve(self, view, environ):
+        """Return the Flask response of async `view` for `environ`."""
+
+        app = self.app
+
+        with app.request_context(environ):
+            g.request_started = time.perf_counter()   # for metrics.py
+
+            try:
+                async with self.sessions[self.choose_database()]() as db:
+                    g.user = await load_viewer(db)
+                    rv = await view(db, **request.view_args)
+            except HTTPException as exc:
+                rv = app.handle_http_exception(exc)
+            except Exception as exc:
+                rv = app.handle_exception(exc)
+
+            return app.process_response(app.make_response(rv))
+
+    def choose_database(self):
+        """A random replica, as in replicas.py, or None for the primary."""
+
+        replicas = [name for name in self.engines if name is not None]
+
+        if replicas and session.get(STICKY_KEY, 0) < time.time():
+            return random.choice(replicas)
+        return None
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def dispose(self):
+        """Close every pooled connection."""
+
+        for engine in self.engines.values():
+            await engine.dispose()
+
+
+##############################################################################
+# Helpers, as in app.py
+
+
+async def load_viewer(db):
+    """The logged-in user's CurrentUser (see identity.py), or None."""
+
+    user_id = session.get(CURR_USER_KEY)
+    if user_id is None:
+        return None
+
+    record = identity_cache.get(user_id)
+
+    if record is None:
+        row = (await db.execute(record_select(user_id))).first()
+        if row is None:
+            return None
+
+        record = row._asdict()
+        identity_cache.set(user_id, record)
+
+    return CurrentUser(record)
+
+
+async def live_user_or_404(db, user_id):
+    user = await db.get(User, user_id)
+    if user is None or user.deleted_at is not None:
+        abort(404)
+    return user
+
+
+async def paginated(db, query, timestamp_col, id_col):
+    """Page `query` using the `before`/`after` cursors in the querystring."""
+
+    try:
+        return await paginate_async(
+            db, query, timestamp_col, id_col,
+            before=request.args.get('before'),
+            after=request.args.get('after'),
+            per_page=current_app.config['MESSAGES_PER_PAGE'])
+    except ValueError:
+        abort(400)
+
+
+async def liked_ids(db, messages):
+    """Ids of `messages` the logged-in user has liked, as a set."""
+
+    if not g.user or not messages:
+        return set()
+
+    return set(await db.scalars(
+        select(Likes.message_id)
+        .where(Likes.user_id == g.user.id)
+        .where(Likes.message_id.in_([msg.id for msg in messages]))))
+
+
+async def followed_ids(db, users):
+    """Ids of `users` the logged-in user follows, as a set."""
+
+    if not g.user or not users:
+        return set()
+
+    return set(await db.scalars(
+        select(Follows.user_being_followed_id)
+        .where(Follows.user_following_id == g.user.id)
+        .where(Follows.user_being_followed_id.in_([u.id for u in users]))))
+
+
+##############################################################################
+# Views
+
+
+@serves('homepage')
+async def homepage(db):
+    """Show the logged-in user's timeline, or the anonymous homepage."""
+
+    if not g.user:
+        return render_template('home-anon.html')
+
+    timeline = live_authors(
+        select(Message)
+        .join(TimelineEntry, TimelineEntry.message_id == Message.id)
+        .filter(TimelineEntry.user_id == g.user.id))
+    page = await paginated(db, timeline,
+                           TimelineEntry.timestamp, TimelineEntry.message_id)
+
+    return render_template(
+        'home.html', messages=page.items, page=page,
+        liked_ids=await liked_ids(db, page.items),
+        suggestions=(await db.scalars(who_to_follow(g.user.id))).all())
+
+
+@serves('users_show')
+async def users_show(db, user_id):
+    """Show user profile."""
+
+    user = await live_user_or_404(db, user_id)
+    page = await paginated(db,
+                           select(Message).filter(Message.user_id == user_id),
+                           Message.timestamp, Message.id)
+    liked = await liked_ids(db, page.items)
+    followed = await followed_ids(db, [user])
+
+    return conditional(
+        lambda: render_template('users/show.html', user=user,
+                                messages=page.items, page=page,
+                                liked_ids=liked, followed_ids=followed),
+        user_version(user), [msg.id for msg in page.items],
+        page.older, page.newer, liked, followed)
+
+
+@serves('show_following')
+async def show_following(db, user_id):
+    """Show list of people this user is following."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    user = await live_user_or_404(db, user_id)
+    following = (await db.scalars(
+        select(User)
+        .join(Follows, Follows.user_being_followed_id == User.id)
+        .filter(Follows.user_following_id == user_id)
+        .filter(User.deleted_at.is_(None)))).all()
+
+    followed = await followed_ids(db, [user, *following])
+
+    return conditional(
+        lambda: render_template('users/following.html', user=user,
+                                following=following, followed_ids=followed),
+        user_version(user), [user_version(u) for u in following], followed)
+
+
+@serves('users_followers')
+async def users_followers(db, user_id):
+    """Show list of followers of this user."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    user = await live_user_or_404(db, user_id)
+    followers = (await db.scalars(
+        select(User)
+        .join(Follows, Follows.user_following_id == User.id)
+        .filter(Follows.user_being_followed_id == user_id)
+        .filter(User.deleted_at.is_(None)))).all()
+
+    followed = await followed_ids(db, [user, *followers])
+
+    return conditional(
+        lambda: render_template('users/followers.html', user=user,
+                                followers=followers, followed_ids=followed),
+        user_version(user), [user_version(u) for u in followers], followed)
+
+
+@serves('messages_show')
+async def messages_show(db, message_id):
+    """Show a message."""
+
+    msg = await db.get(Message, message_id, options=[joinedload(Message.user)])
+    if msg is None or msg.user.deleted_at is not None:
+        abort(404)
+    following = bool(g.user) and await db.scalar(select(exists().where(
+        Follows.user_following_id == g.user.id,
+        Follows.user_being_followed_id == msg.user_id,
+    )))
+
+    return conditional(
+        lambda: render_template('messages/show.html', message=msg,
+                                following=following),
+        msg.id, user_version(msg.user), following)
+
+
+##############################################################################
+# ASGI <-> WSGI
+
+
+def wsgi_environ(scope):
+    """A WSGI environ for the ASGI HTTP request `scope`, without a body."""
+
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': _latin1(scope.get('root_path', '')),
+        'PATH_INFO': _latin1(scope['path']),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f'HTTP_{name}'
+        value = value.decode('latin-1')
+        if name in environ:
+            value = f'{environ[name]},{value}'
+        environ[name] = value
+
+    return environ
+
+
+async def send_response(response, scope, send):
+    """Send Flask `response` over ASGI."""
+
+    body = b'' if scope['method'] == 'HEAD' else response.get_data()
+
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                    for name, value in response.headers.items()],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def _latin1(path):
+    # WSGI carries paths as bytes decoded as latin-1; ASGI as real text.
+    return path.encode('UTF-8').decode('latin-1')
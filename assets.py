@@ -0,0 +1,167 @@
+"""Fingerprinted, precompressed static assets.
+
+`flask build-assets` copies each file under static/ to static/dist/ with a
+hash of its contents in the name (style.css -> style.3f2a9c01d4e7.css),
+writes gzip (and, if the `brotli` package is installed, brotli) variants
+of the compressible ones, and records the mapping in
+static/dist/manifest.json. References to /static/... inside stylesheets
+are rewritten to the fingerprinted URLs.
+
+Templates link assets with `asset_url('stylesheets/style.css')`. Once a
+manifest exists, that returns the fingerprinted /assets/ URL, which
+`send_asset` serves with a year-long immutable Cache-Control. Without a
+manifest it returns the plain /static/ URL, so development needs no build.
+URLs stored in the database, like the default profile images, go through
+`static_url`, which does the same for those under /static/ and leaves
+others (a user's own image elsewhere) alone.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+
+from flask import abort, current_app, request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:   # optional; gzip alone is still served
+    brotli = None
+
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+
+COMPRESSIBLE = {'.css', '.js', '.svg', '.ico', '.json', '.txt'}
+
+# Compressed variants, best first: (Content-Encoding, file suffix)
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+ONE_YEAR = 365 * 24 * 60 * 60
+
+CSS_URL_RE = re.compile(r'''url\(\s*(['"]?)/static/([^'")]+)\1\s*\)''')
+
+_manifests = {}
+
+
+def build(static_dir):
+    """Fingerprint and compress every file in `static_dir`.
+
+    Replaces `static_dir`/dist and returns the new manifest, a dict of
+    static path -> fingerprinted filename.
+    """
+
+    dist = os.path.join(static_dir, DIST_DIR)
+    shutil.rmtree(dist, ignore_errors=True)
+    os.makedirs(dist)
+
+    paths = sorted(
+        os.path.relpath(os.path.join(root, name), static_dir).replace(os.sep, '/')
+        for root, dirs, names in os.walk(static_dir)
+        if os.path.relpath(root, static_dir).split(os.sep)[0] != DIST_DIR
+        for name in names)
+
+    # Stylesheets last, so the images they refer to are already named.
+    paths.sort(key=lambda path: path.endswith('.css'))
+
+    manifest = {}
+    for path in paths:
+        with open(os.path.join(static_dir, path), 'rb') as f:
+            content = f.read()
+
+        if path.endswith('.css'):
+            content = CSS_URL_RE.sub(
+                lambda m: (f'url("/assets/{manifest[m.group(2)]}")'
+                           if m.group(2) in manifest else m.group(0)),
+                content.decode('UTF-8')).encode('UTF-8')
+
+        stem, ext = os.path.splitext(path)
+        digest = hashlib.sha256(content).hexdigest()[:12]
+        name = f"{stem}.{digest}{ext}"
+        _write(os.path.join(dist, name), content)
+
+        if ext in COMPRESSIBLE:
+            _write(os.path.join(dist, name + '.gz'),
+                   gzip.compress(content, compresslevel=9, mtime=0))
+            if brotli is not None:
+                _write(os.path.join(dist, name + '.br'),
+                       brotli.compress(content))
+
+        manifest[path] = name
+
+    with open(os.path.join(dist, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    _manifests.clear()
+    return manifest
+
+
+def asset_url(path):
+    """Return the URL for static file `path`, fingerprinted if built."""
+
+    name = _manifest().get(path)
+    if name is None:
+        return url_for('static', filename=path)
+
+    return url_for('assets', filename=name)
+
+
+def static_url(url):
+    """Return `url`, fingerprinted if it is a /static/ path."""
+
+    if url and url.startswith('/static/'):
+        return asset_url(url[len('/static/'):])
+
+    return url
+
+
+def send_asset(filename):
+    """Serve a fingerprinted file, precompressed if the client accepts it."""
+
+    dist = os.path.join(current_app.static_folder, DIST_DIR)
+    if filename == MANIFEST or os.path.splitext(filename)[1] in ('.gz', '.br'):
+        abort(404)
+
+    encoding = None
+    served = filename
+    for name, suffix in ENCODINGS:
+        if (name in request.accept_encodings
+                and os.path.isfile(os.path.join(dist, filename + suffix))):
+            encoding, served = name, filename + suffix
+            break
+
+    response = send_from_directory(dist, served, conditional=True,
+                                   max_age=ONE_YEAR)
+    if encoding:
+        response.content_encoding = encoding
+        # send_from_directory named and typed it after the .gz/.br file
+        response.headers.pop('Content-Disposition', None)
+        response.mimetype = (mimetypes.guess_type(filename)[0]
+                             or 'application/octet-stream')
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+
+    return response
+
+
+def _manifest():
+    """Return the built manifest for this app, or {} if there isn't one."""
+
+    static = current_app.static_folder
+    if static not in _manifests:
+        try:
+            with open(os.path.join(static, DIST_DIR, MANIFEST)) as f:
+                _manifests[static] = json.load(f)
+        except FileNotFoundError:
+            _manifests[static] = {}
+
+    return _manifests[static]
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
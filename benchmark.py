@@ -0,0 +1,513 @@
+"""Benchmark Warbler's routes against a generated dataset.
+
+    python benchmark.py --users 10000 --messages 100000 --follows 500000 \\
+        --output results.json
+    python benchmark.py --skip-seed --compare results.json
+
+Generates CSVs with generator/create_csvs.py, loads them with the seed
+loader into a separate database (postgresql:///warbler-bench by default,
+or --database), then drives each route through the Flask test client as a
+logged-in user. For every route it records p50/p95/p99 latency, and the
+SQL statements run and rows they returned per request, and writes them as
+JSON, along with how long a fresh process takes to import the app, create
+it and serve its first page.
+
+With --load, it also starts the app under gunicorn's sync workers and
+under uvicorn with the async read path (asgi.py), the same number of
+worker processes each, and has --concurrency clients fetch the timeline,
+profile, follower/following and message pages from each for
+--load-seconds, recording throughput and latency.
+
+With --compare, the run is checked against an earlier results file: a
+route whose p95 grew by more than --tolerance, or that runs more
+statements than before, is reported and the exit status is 1; so is
+startup that slowed, or a server whose throughput under load fell, by
+more than --tolerance.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark Warbler's routes against generated data.")
+    parser.add_argument('--database', default='postgresql:///warbler-bench')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--follows', type=int, default=20000)
+    parser.add_argument('--seed', default='warbler')
+    parser.add_argument('--skip-seed', action='store_true',
+                        help="reuse the data already in --database")
+    parser.add_argument('--requests', type=int, default=50,
+                        help="timed requests per route")
+    parser.add_argument('--warmup', type=int, default=5,
+                        help="untimed requests per route first")
+    parser.add_argument('--startup-runs', type=int, default=5,
+                        help="fresh processes to time startup over")
+    parser.add_argument('--load', action='store_true',
+                        help="compare sync and async servers under load")
+    parser.add_argument('--concurrency', type=int, default=200,
+                        help="clients in flight at once, with --load")
+    parser.add_argument('--load-seconds', type=float, default=10,
+                        help="how long to load each server")
+    parser.add_argument('--load-workers', type=int, default=2,
+                        help="worker processes per server")
+    parser.add_argument('--output', help="write results JSON here")
+    parser.add_argument('--compare', help="earlier results JSON to check")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="allowed p95 growth over --compare (0.2 = 20%%)")
+    return parser.parse_args(argv)
+
+
+##############################################################################
+# Dataset
+
+
+def seed(options):
+    """Generate CSVs of the requested size and load them."""
+
+    from loader import load
+
+    with tempfile.TemporaryDirectory() as directory:
+        subprocess.run([
+            sys.executable, os.path.join(HERE, 'generator', 'create_csvs.py'),
+            '--users', str(options.users),
+            '--messages', str(options.messages),
+            '--follows', str(options.follows),
+            '--seed', options.seed,
+            '--out', directory,
+        ], check=True)
+
+        started = time.perf_counter()
+        load(directory, report=lambda line: None)
+        print(f"Loaded dataset in {time.perf_counter() - started:.1f}s")
+
+
+##############################################################################
+# Measurement
+
+
+class QueryCounter:
+    """Counts statements, and rows they returned, on an engine."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = 0
+        self.rows = 0
+
+    def __enter__(self):
+        from sqlalchemy import event
+        event.listen(self.engine, 'after_cursor_execute', self.record)
+        return self
+
+    def __exit__(self, *exc):
+        from sqlalchemy import event
+        event.remove(self.engine, 'after_cursor_execute', self.record)
+
+    def record(self, conn, cursor, statement, parameters, context,
+               executemany):
+        self.statements += 1
+        if cursor.description is not None and cursor.rowcount > 0:
+            self.rows += cursor.rowcount
+
+
+def percentile(samples, fraction):
+    """Return the `fraction` percentile of `samples` (nearest rank)."""
+
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def measure(client, engine, name, request, options):
+    """Time `request(client, i)` and return the route's results dict."""
+
+    for i in range(options.warmup):
+        request(client, i)
+
+    timings = []
+    statements = []
+    rows = []
+    statuses = set()
+    for i in range(options.warmup, options.warmup + options.requests):
+        with QueryCounter(engine) as counter:
+            started = time.perf_counter()
+            response = request(client, i)
+            timings.append((time.perf_counter() - started) * 1000)
+        statements.append(counter.statements)
+        rows.append(counter.rows)
+        statuses.add(response.status_code)
+
+    result = {
+        'p50_ms': round(percentile(timings, 0.50), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'p99_ms': round(percentile(timings, 0.99), 3),
+        'mean_ms': round(statistics.fmean(timings), 3),
+        'statements': max(statements),
+        'rows': max(rows),
+        'statuses': sorted(statuses),
+    }
+    print(f"{name:<24} p50 {result['p50_ms']:>8.2f}ms  "
+          f"p95 {result['p95_ms']:>8.2f}ms  p99 {result['p99_ms']:>8.2f}ms  "
+          f"{result['statements']:>3} statements  {result['rows']:>6} rows")
+    return result
+
+
+def routes(viewer, popular, typical):
+    """Return (name, request, undo) for every benchmarked route.
+
+    `undo(client, calls)` puts back whatever `calls` requests changed, so
+    later routes and later runs see the same data.
+    """
+
+    def get(path):
+        return lambda client, i: client.get(path)
+
+    def post_message(client, i):
+        return client.post('/messages/new', data={'text': f"benchmark {i}"})
+
+    def follow_toggle(client, i):
+        action = 'follow' if i % 2 == 0 else 'stop-following'
+        return client.post(f'/users/{action}/{typical}')
+
+    def like_toggle(client, i):
+        return client.post(f'/messages/{popular_message}/add-like')
+
+    def delete_posted(client, calls):
+        posted = (Message.query
+                  .filter(Message.user_id == viewer)
+                  .filter(Message.text.like('benchmark %'))
+                  .with_entities(Message.id)
+                  .all())
+        for (id,) in posted:
+            client.post(f'/messages/{id}/delete')
+
+    def toggle_back(request):
+        def undo(client, calls):
+            if calls % 2:
+                request(client, calls)
+        return undo
+
+    def nothing(client, calls):
+        pass
+
+    from models import Message
+    popular_message = (Message.query.filter_by(user_id=popular)
+                       .order_by(Message.id).first().id)
+
+    return [
+        ('homepage', get('/'), nothing),
+        ('users_show', get(f'/users/{popular}'), nothing),
+        ('list_users', get('/users'), nothing),
+        ('list_users_search', get('/users?q=wor'), nothing),
+        ('users_followers', get(f'/users/{popular}/followers'), nothing),
+        ('show_following', get(f'/users/{viewer}/following'), nothing),
+        ('users_likes', get(f'/users/{viewer}/likes'), nothing),
+        ('messages_search', get('/messages/search?q=people'), nothing),
+        ('messages_add', post_message, delete_posted),
+        ('follow_toggle', follow_toggle, toggle_back(follow_toggle)),
+        ('like_toggle', like_toggle, toggle_back(like_toggle)),
+    ]
+
+
+def run(app, options):
+    from sqlalchemy import func, select
+    from app import CURR_USER_KEY
+    from models import db, User, Message
+
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    # The most-followed author, an ordinary user to follow, and a viewer
+    # who follows many people (so has a full timeline).
+    popular = db.session.scalar(
+        select(User.id)
+        .where(User.id.in_(select(Message.user_id)))
+        .order_by(User.followers_count.desc()).limit(1))
+    typical = db.session.scalar(
+        select(User.id).order_by(User.followers_count, User.id).limit(1))
+    viewer = db.session.scalar(
+        select(User.id)
+        .where(User.id.notin_([popular, typical]))
+        .order_by(User.following_count.desc(), User.id).limit(1))
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = viewer
+
+    results = {}
+    for name, request, undo in routes(viewer, popular, typical):
+        results[name] = measure(client, db.engine, name, request, options)
+        undo(client, options.warmup + options.requests)
+
+    load = None
+    if options.load:
+        message = db.session.scalar(
+            select(Message.id).where(Message.user_id == popular).limit(1))
+        cookie = app.session_interface.get_signing_serializer(app).dumps(
+            {CURR_USER_KEY: viewer})
+        load = load_test([
+            '/',
+            f'/users/{popular}',
+            f'/users/{popular}/followers',
+            f'/users/{viewer}/following',
+            f'/messages/{message}',
+        ], cookie, options)
+
+    return {
+        'meta': {
+            'started': datetime.now(timezone.utc).isoformat(),
+            'commit': _git_commit(),
+            'database': db.engine.dialect.name,
+            'users': db.session.scalar(select(func.count(User.id))),
+            'messages': db.session.scalar(select(func.count(Message.id))),
+            'requests': options.requests,
+        },
+        'routes': results,
+        'startup': cold_start(options),
+        'load': load,
+    }
+
+
+# Run in a fresh interpreter: how long a new worker takes to import the
+# app, create it and serve its first page (compiling templates on the way).
+STARTUP_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app('production')
+created = time.perf_counter()
+app.test_client().get('/')
+served = time.perf_counter()
+json.dump({'import_ms': (imported - started) * 1000,
+           'create_ms': (created - imported) * 1000,
+           'first_request_ms': (served - created) * 1000}, sys.stdout)
+"""
+
+
+def cold_start(options):
+    """Return median worker startup times over --startup-runs processes."""
+
+    runs = []
+    for _ in range(options.startup_runs):
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT],
+                                cwd=HERE, capture_output=True, text=True,
+                                check=True).stdout
+        run = json.loads(output)
+        run['process_ms'] = (time.perf_counter() - started) * 1000
+        runs.append(run)
+
+    result = {key: round(statistics.median(run[key] for run in runs), 1)
+              for key in runs[0]}
+    print(f"{'startup':<24} import {result['import_ms']:.1f}ms  "
+          f"create {result['create_ms']:.1f}ms  "
+          f"first request {result['first_request_ms']:.1f}ms  "
+          f"process {result['process_ms']:.1f}ms")
+    return result
+
+
+##############################################################################
+# Concurrent load
+
+
+SERVERS = {
+    'sync': ['gunicorn', '--workers', '{workers}',
+             '--bind', '127.0.0.1:{port}'],
+    'async': ['uvicorn', '--factory', 'asgi:create_asgi_app',
+              '--workers', '{workers}', '--host', '127.0.0.1',
+              '--port', '{port}', '--no-access-log'],
+}
+
+LOAD_PORT = 8765
+
+
+def load_test(paths, cookie, options):
+    """Load each of SERVERS with requests for `paths`; return its results."""
+
+    results = {}
+    for name, command in SERVERS.items():
+        args = [arg.format(workers=options.load_workers, port=LOAD_PORT)
+                for arg in command]
+        server = subprocess.Popen(
+            [sys.executable, '-m', *args], cwd=HERE,
+            env={**os.environ, 'WARBLER_CONFIG': 'production'},
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            results[name] = asyncio.run(
+                _load(LOAD_PORT, paths, cookie, options))
+        finally:
+            server.terminate()
+            server.wait()
+
+        result = results[name]
+        print(f"{'load ' + name:<24} "
+              f"{result['requests_per_second']:>8.1f}/s  "
+              f"p50 {result['p50_ms']:>8.2f}ms  "
+              f"p95 {result['p95_ms']:>8.2f}ms  "
+              f"p99 {result['p99_ms']:>8.2f}ms  {result['errors']} errors")
+
+    return results
+
+
+async def _load(port, paths, cookie, options):
+    await _wait_for_server(port)
+
+    # Warm each worker's caches and connection pools first.
+    await _drive(port, paths, cookie, options.concurrency,
+                 min(2, options.load_seconds))
+    timings, statuses, errors = await _drive(
+        port, paths, cookie, options.concurrency, options.load_seconds)
+
+    return {
+        'concurrency': options.concurrency,
+        'workers': options.load_workers,
+        'requests_per_second': round(len(timings) / options.load_seconds, 1),
+        'p50_ms': round(percentile(timings, 0.50), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'p99_ms': round(percentile(timings, 0.99), 3),
+        'statuses': sorted(statuses),
+        'errors': errors,
+    }
+
+
+async def _drive(port, paths, cookie, concurrency, seconds):
+    """Have `concurrency` clients cycle through `paths` for `seconds`."""
+
+    deadline = time.perf_counter() + seconds
+    timings = []
+    statuses = Counter()
+    errors = 0
+
+    async def client(i):
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            started = time.perf_counter()
+            try:
+                status = await _get(port, path, cookie)
+            except OSError:
+                errors += 1
+                continue
+            timings.append((time.perf_counter() - started) * 1000)
+            statuses[status] += 1
+
+    await asyncio.gather(*(client(i) for i in range(concurrency)))
+    return timings, statuses, errors
+
+
+async def _get(port, path, cookie):
+    """GET `path` over a new connection; return the response status."""
+
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write(f"GET {path} HTTP/1.1\r\n"
+                     f"Host: 127.0.0.1:{port}\r\n"
+                     f"Cookie: session={cookie}\r\n"
+                     f"Connection: close\r\n\r\n".encode('latin-1'))
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+
+    if not response:
+        raise ConnectionResetError(f"No response for {path}")
+    return int(response.split(b' ', 2)[1])
+
+
+async def _wait_for_server(port, timeout=30):
+    started = time.perf_counter()
+    while True:
+        try:
+            return await _get(port, '/', '')
+        except OSError:
+            if time.perf_counter() - started > timeout:
+                raise
+            await asyncio.sleep(0.2)
+
+
+def compare(results, baseline, tolerance):
+    """Return lines describing routes that regressed against `baseline`."""
+
+    regressions = []
+    for name, old in baseline['routes'].items():
+        new = results['routes'].get(name)
+        if new is None:
+            continue
+        if new['p95_ms'] > old['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {old['p95_ms']}ms -> "
+                               f"{new['p95_ms']}ms")
+        if new['statements'] > old['statements']:
+            regressions.append(f"{name}: {old['statements']} -> "
+                               f"{new['statements']} statements")
+
+    old, new = baseline.get('startup'), results.get('startup')
+    if old and new and new['process_ms'] > old['process_ms'] * (1 + tolerance):
+        regressions.append(f"startup: {old['process_ms']}ms -> "
+                           f"{new['process_ms']}ms")
+
+    for name, old in (baseline.get('load') or {}).items():
+        new = (results.get('load') or {}).get(name)
+        if new and (new['requests_per_second']
+                    < old['requests_per_second'] * (1 - tolerance)):
+            regressions.append(
+                f"load {name}: {old['requests_per_second']}/s -> "
+                f"{new['requests_per_second']}/s")
+
+    return regressions
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=HERE,
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    options = parse_args(argv)
+
+    # Must be set before app is imported, as config reads it on import.
+    # The startup processes inherit it too.
+    os.environ['DATABASE_URL'] = options.database
+
+    from app import create_app
+    app = create_app('production')
+
+    with app.app_context():
+        if not options.skip_seed:
+            seed(options)
+
+        results = run(app, options)
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if options.compare:
+        with open(options.compare) as f:
+            regressions = compare(results, json.load(f), options.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
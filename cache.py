@@ -0,0 +1,113 @@
+"""Small in-process caches shared by a worker's threads."""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Thread-safe least-recently-used cache with an optional time-to-live.
+
+    Holds at most `maxsize` entries, and if `maxbytes` is given, values
+    whose `sizeof` adds up to at most that many bytes; adding more evicts
+    the least recently used. Entries older than `ttl` seconds are treated as
+    missing. Hit, miss and eviction counts are kept for `stats()` so the
+    cache can be sized.
+    """
+
+    def __init__(self, maxsize, ttl=None, maxbytes=None, sizeof=len):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()   # key -> (expires_at, value)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def configure(self, maxsize, ttl=None, maxbytes=None):
+        """Change the cache's limits, emptying it."""
+
+        with self.lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            self.maxbytes = maxbytes
+            self.entries.clear()
+            self.bytes = 0
+
+    def get(self, key, default=None):
+        """Return the cached value for `key`, or `default`."""
+
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._pop(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Cache `value` under `key`, evicting old entries if full."""
+
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+
+        with self.lock:
+            self._pop(key)
+            self.entries[key] = (expires_at, value)
+            if self.maxbytes is not None:
+                self.bytes += self.sizeof(value)
+
+            while self.entries and (
+                    len(self.entries) > self.maxsize
+                    or (self.maxbytes is not None
+                        and self.bytes > self.maxbytes)):
+                self._pop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """Forget `key` if it is cached."""
+
+        with self.lock:
+            self._pop(key)
+
+    def clear(self):
+        """Forget every entry (statistics are kept)."""
+
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def _pop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None and self.maxbytes is not None:
+            self.bytes -= self.sizeof(entry[1])
+
+    def stats(self):
+        """Return a dict of size and hit/miss counts."""
+
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+                'bytes': self.bytes if self.maxbytes is not None else None,
+                'maxbytes': self.maxbytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else None,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
@@ -0,0 +1,75 @@
+"""Configuration profiles for create_app().
+
+Settings come from environment variables where a deployment needs to
+change them. `create_app()` picks a profile by name, defaulting to the
+WARBLER_CONFIG environment variable, or 'development'.
+"""
+
+import os
+
+
+class Config:
+    """Settings shared by every profile."""
+
+    # Get DB_URI from environ variable (useful for production/testing) or,
+    # if not set there, use development local db.
+    SQLALCHEMY_DATABASE_URI = os.environ.get(
+        'DATABASE_URL', 'postgresql:///warbler')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+    SECRET_KEY = os.environ.get('SECRET_KEY', "it's a secret")
+
+    MESSAGES_PER_PAGE = 100
+    IDENTITY_CACHE_SIZE = int(os.environ.get('IDENTITY_CACHE_SIZE', 10000))
+    IDENTITY_CACHE_TTL = float(os.environ.get('IDENTITY_CACHE_TTL', 30))
+    USER_INDEX_TTL = float(os.environ.get('USER_INDEX_TTL', 60))
+    FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE', 100000))
+    FRAGMENT_CACHE_BYTES = int(
+        os.environ.get('FRAGMENT_CACHE_BYTES', 16 * 1024 * 1024))
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    PASSWORD_POOL_SIZE = int(os.environ.get('PASSWORD_POOL_SIZE', 2))
+    PASSWORD_POOL_QUEUE = int(os.environ.get('PASSWORD_POOL_QUEUE', 32))
+
+    # Comma-separated URLs of read replicas for replica_reads views
+    # (see replicas.py)
+    DATABASE_REPLICA_URLS = os.environ.get('DATABASE_REPLICA_URLS', '')
+    REPLICA_STICKY_SECONDS = float(
+        os.environ.get('REPLICA_STICKY_SECONDS', 5))
+
+    # Connections per process for the async read path (see asgi.py)
+    ASYNC_POOL_SIZE = int(os.environ.get('ASYNC_POOL_SIZE', 20))
+
+    # Background jobs (see jobs.py)
+    JOBS_BATCH_SIZE = int(os.environ.get('JOBS_BATCH_SIZE', 100))
+    JOBS_POLL_SECONDS = float(os.environ.get('JOBS_POLL_SECONDS', 1))
+    JOBS_MAX_ATTEMPTS = int(os.environ.get('JOBS_MAX_ATTEMPTS', 5))
+    JOBS_RETRY_SECONDS = float(os.environ.get('JOBS_RETRY_SECONDS', 10))
+
+    # Followers a new message is copied to per fan_out job (see jobs.py)
+    FAN_OUT_CHUNK_SIZE = int(os.environ.get('FAN_OUT_CHUNK_SIZE', 1000))
+
+    # Rows removed per transaction when deleting an account (see deletion.py)
+    DELETION_CHUNK_SIZE = int(os.environ.get('DELETION_CHUNK_SIZE', 1000))
+
+    # Install Flask-DebugToolbar (it only shows itself when debugging)
+    DEBUG_TOOLBAR = False
+    DEBUG_TB_INTERCEPT_REDIRECTS = False
+
+
+class DevelopmentConfig(Config):
+    """For `flask run` on a developer's machine."""
+
+    DEBUG_TOOLBAR = True
+    TEMPLATES_AUTO_RELOAD = True
+
+
+class ProductionConfig(Config):
+    """For gunicorn, and the tests."""
+
+    TEMPLATES_AUTO_RELOAD = False
+
+
+PROFILES = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+}
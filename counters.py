@@ -0,0 +1,56 @@
+"""Bulk maintenance of the denormalized counters on User.
+
+Day-to-day updates happen in the flush listeners in models.py, and when an
+account is deleted, in deletion.py. This module recomputes every counter
+from the `messages`, `follows` and `likes` tables.
+"""
+
+from sqlalchemy import func, or_, select, update
+
+from models import db, User, Message, Follows, Likes
+
+RECONCILE_CHUNK_SIZE = 1000
+
+
+def reconcile(chunk_size=RECONCILE_CHUNK_SIZE):
+    """Recompute every user's counters from the underlying tables.
+
+    Works through users in id ranges of `chunk_size`, committing after each
+    range. Returns the number of users whose counters were corrected.
+    """
+
+    actual = {
+        'messages_count': (select(func.count())
+                           .select_from(Message)
+                           .where(Message.user_id == User.id)
+                           .scalar_subquery()),
+        'following_count': (select(func.count())
+                            .select_from(Follows)
+                            .where(Follows.user_following_id == User.id)
+                            .scalar_subquery()),
+        'followers_count': (select(func.count())
+                            .select_from(Follows)
+                            .where(Follows.user_being_followed_id == User.id)
+                            .scalar_subquery()),
+        'likes_count': (select(func.count())
+                        .select_from(Likes)
+                        .where(Likes.user_id == User.id)
+                        .scalar_subquery()),
+    }
+    out_of_step = or_(*(getattr(User, name) != count
+                        for name, count in actual.items()))
+
+    last_id = db.session.scalar(select(func.max(User.id))) or 0
+
+    corrected = 0
+    for start in range(1, last_id + 1, chunk_size):
+        result = db.session.execute(
+            update(User)
+            .where(User.id.between(start, start + chunk_size - 1))
+            .where(out_of_step)
+            .values(actual),
+            execution_options={'synchronize_session': False})
+        db.session.commit()
+        corrected += max(result.rowcount, 0)
+
+    return corrected
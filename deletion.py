@@ -0,0 +1,178 @@
+"""Delete accounts a chunk at a time.
+
+Deleting a User through the ORM loads all of its relationships and removes
+everything in one transaction, which for a big account means holding
+hundreds of thousands of rows in memory and locks for seconds. Instead:
+
+1. `tombstone` sets users.deleted_at, in the request. From then on the
+   account can't log in, and its profile, messages and follows are hidden
+   from other users' pages.
+2. `delete_chunk` then removes the account's rows in STEPS order, at most
+   `chunk_size` rows per call, keeping other users' counters in step, and
+   finally the user row itself. Each call is a couple of short statements,
+   so the caller can commit after each one and memory use does not depend
+   on the account's size.
+
+Every step works out what is left from the tables themselves, so deletion
+can stop and resume at any point. The `delete_user` job (see jobs.py) runs
+one chunk per job; `flask delete-user` runs them all in the foreground,
+printing progress.
+"""
+
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from sqlalchemy import delete, or_, select, tuple_, update
+
+from models import (
+    db, User, Message, Follows, Likes, TimelineEntry, Recommendation,
+)
+
+CHUNK_SIZE = 1000
+
+
+def tombstone(user_id):
+    """Hide a user at once; their rows are deleted later. Does not commit."""
+
+    db.session.execute(
+        update(User)
+        .where(User.id == user_id)
+        .where(User.deleted_at.is_(None))
+        .values(deleted_at=datetime.utcnow()),
+        execution_options={'synchronize_session': False})
+
+
+def delete_chunk(user_id, chunk_size=CHUNK_SIZE):
+    """Delete the next chunk of a tombstoned account. Does not commit.
+
+    Returns (step, rows deleted), or None once the account is gone.
+    """
+
+    for name, step in STEPS:
+        deleted = step(user_id, chunk_size)
+        if deleted:
+            return name, deleted
+
+    return None
+
+
+def delete_account(user_id, chunk_size=CHUNK_SIZE, report=print):
+    """Delete a tombstoned account, committing after every chunk.
+
+    Calls `report` with each step's running total. Returns the number of
+    rows deleted per step.
+    """
+
+    totals = defaultdict(int)
+
+    while (chunk := delete_chunk(user_id, chunk_size)) is not None:
+        db.session.commit()
+        name, deleted = chunk
+        totals[name] += deleted
+        report(f"{name}: {totals[name]} deleted")
+
+    db.session.commit()
+    return dict(totals)
+
+
+##############################################################################
+# Steps
+#
+# Likes and follows go first, so other users' counters can be adjusted for
+# the rows as they go. Timelines go before messages: deleting a message
+# would otherwise cascade to a row in every follower's timeline at once.
+# Likewise, a popular account may be recommended to many users.
+
+
+def _likes_given(user_id, chunk_size):
+    return len(_delete_some(Likes, Likes.user_id == user_id, chunk_size))
+
+
+def _likes_received(user_id, chunk_size):
+    own_messages = select(Message.id).where(Message.user_id == user_id)
+    rows = _delete_some(Likes, Likes.message_id.in_(own_messages),
+                        chunk_size, Likes.user_id)
+    _uncount(User.likes_count, [liker for liker, in rows])
+    return len(rows)
+
+
+def _following(user_id, chunk_size):
+    rows = _delete_some(Follows, Follows.user_following_id == user_id,
+                        chunk_size, Follows.user_being_followed_id)
+    _uncount(User.followers_count, [followed for followed, in rows])
+    return len(rows)
+
+
+def _followers(user_id, chunk_size):
+    rows = _delete_some(Follows, Follows.user_being_followed_id == user_id,
+                        chunk_size, Follows.user_following_id)
+    _uncount(User.following_count, [follower for follower, in rows])
+    return len(rows)
+
+
+def _timelines(user_id, chunk_size):
+    return len(_delete_some(TimelineEntry, or_(
+        TimelineEntry.author_id == user_id,
+        TimelineEntry.user_id == user_id,
+    ), chunk_size))
+
+
+def _messages(user_id, chunk_size):
+    # Their search terms go with them (ON DELETE CASCADE).
+    return len(_delete_some(Message, Message.user_id == user_id, chunk_size))
+
+
+def _recommendations(user_id, chunk_size):
+    return len(_delete_some(Recommendation, or_(
+        Recommendation.user_id == user_id,
+        Recommendation.recommended_id == user_id,
+    ), chunk_size))
+
+
+def _user(user_id, chunk_size):
+    return len(_delete_some(User, User.id == user_id, chunk_size))
+
+
+STEPS = [
+    ('likes_given', _likes_given),
+    ('likes_received', _likes_received),
+    ('following', _following),
+    ('followers', _followers),
+    ('timelines', _timelines),
+    ('messages', _messages),
+    ('recommendations', _recommendations),
+    ('user', _user),
+]
+
+
+def _delete_some(model, condition, limit, *returning):
+    """Delete up to `limit` rows of `model` matching `condition`.
+
+    Returns a row of the `returning` columns for each deleted row. Runs
+    as Core statements, so the ORM's counter listeners don't fire; the
+    steps adjust counters themselves.
+    """
+
+    table = model.__table__
+    key = list(table.primary_key.columns)
+    chunk = select(*key).where(condition).limit(limit)
+    where = (key[0].in_(chunk) if len(key) == 1
+             else tuple_(*key).in_(chunk))
+
+    return db.session.execute(
+        delete(table).where(where).returning(*(returning or key))).all()
+
+
+def _uncount(column, user_ids):
+    """Take one off `column` for each time a user appears in `user_ids`."""
+
+    by_count = defaultdict(list)
+    for user_id, count in Counter(user_ids).items():
+        by_count[count].append(user_id)
+
+    for count, ids in by_count.items():
+        db.session.execute(
+            update(User)
+            .where(User.id.in_(ids))
+            .values({column: column - count}),
+            execution_options={'synchronize_session': False})
@@ -2,15 +2,34 @@
 
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
-tweak the CSV formats or generate fewer/more rows.
+tweak the CSV formats or generate fewer/more rows, e.g. for benchmarks:
+
+    python generator/create_csvs.py --users 1000000 --messages 5000000 \\
+        --follows 200000000 --processes 8
+
+Rows are generated in fixed-size parts, each from its own random stream
+derived from --seed, by a pool of worker processes. The parts are then
+joined in order, so the output depends only on the seed and sizes, not on
+the number of processes. Nothing is fetched over the network, and memory
+use doesn't grow with the size of the data.
+
+Who follows whom is drawn from a power law: a user's popularity rank r
+makes them about 1 / r**zipf as likely to be followed, and to post, as the
+most popular user. Everyone follows about the same number of people.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
-from faker import Faker
-from helpers import get_random_datetime
+import os
+import shutil
+from datetime import datetime
+from multiprocessing import Pool
+from random import Random
+
+from helpers import (
+    HEADER_IMAGE_URLS, IMAGE_URLS, PASSWORD_HASH, WORDS, get_random_datetime,
+    place, power_law_rank, rank_to_user, sentence,
+)
 
 MAX_WARBLER_LENGTH = 140
 
@@ -22,56 +41,151 @@ NUM_USERS = 300
 NUM_MESSAGES = 1000
 NUM_FOLLWERS = 5000
 
-fake = Faker()
+# Rows (or, for follows, following users) per part
+PART_SIZE = 100000
+
+# Power-law draws per follow wanted before the rest are drawn uniformly
+MAX_DRAWS_PER_FOLLOW = 10
+
+
+def write_users(out, seed, part, start, end, options):
+    """Write users start..end-1 (1-based ids) to `out`."""
+
+    rng = Random(f"{seed}-users-{part}")
+    writer = csv.writer(out)
+
+    for id in range(start, end):
+        username = f"{rng.choice(WORDS)}{id}"
+        writer.writerow([
+            f"{username}@example.com",
+            username,
+            rng.choice(IMAGE_URLS),
+            PASSWORD_HASH,
+            sentence(rng, MAX_WARBLER_LENGTH, max_words=10),
+            rng.choice(HEADER_IMAGE_URLS),
+            place(rng),
+        ])
+
+
+def write_messages(out, seed, part, start, end, options):
+    """Write messages start..end-1 to `out`."""
+
+    rng = Random(f"{seed}-messages-{part}")
+    writer = csv.writer(out)
+
+    for _ in range(start, end):
+        author = rank_to_user(
+            power_law_rank(rng, options.users, options.zipf), options.users)
+        writer.writerow([
+            sentence(rng, MAX_WARBLER_LENGTH),
+            get_random_datetime(rng, options.end),
+            author,
+        ])
+
+
+def write_follows(out, seed, part, start, end, options):
+    """Write the follows made by users start..end-1 to `out`."""
+
+    rng = Random(f"{seed}-follows-{part}")
+    writer = csv.writer(out)
+    users = options.users
+    per_user, extra = divmod(options.follows, users)
+
+    for follower in range(start, end):
+        count = per_user + (follower <= extra)
+
+        if count > (users - 1) // 4:
+            # Dense: rejection sampling would mostly hit repeats.
+            followed = rng.sample(range(1, users + 1), min(count + 1, users))
+            followed = [id for id in followed if id != follower][:count]
+        else:
+            followed = set()
+            draws = count * MAX_DRAWS_PER_FOLLOW
+            while len(followed) < count and draws:
+                draws -= 1
+                id = rank_to_user(
+                    power_law_rank(rng, users, options.zipf), users)
+                if id != follower:
+                    followed.add(id)
+
+            # A steep power law keeps drawing the same few popular users;
+            # fill up uniformly, which rarely repeats at this density.
+            while len(followed) < count:
+                id = rng.randint(1, users)
+                if id != follower:
+                    followed.add(id)
+            followed = sorted(followed)
+
+        writer.writerows([id, follower] for id in followed)
+
+
+TABLES = [
+    ('users', USERS_CSV_HEADERS, write_users, lambda options: options.users),
+    ('messages', MESSAGES_CSV_HEADERS, write_messages,
+     lambda options: options.messages),
+    ('follows', FOLLOWS_CSV_HEADERS, write_follows,
+     lambda options: options.users),
+]
 
-# Generate random profile image URLs to use for users
 
-image_urls = [
-    f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
-    for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
-    for i in range(count)
-]
+def write_part(job):
+    """Write one part of one table to its own file; return the file name."""
 
-# Generate random header image URLs to use for users
+    name, part, start, end, options = job
+    writer = next(fn for table, _, fn, _ in TABLES if table == name)
+    path = os.path.join(options.out, f"{name}.part{part:06d}.csv")
+
+    with open(path, 'w', newline='') as out:
+        writer(out, options.seed, part, start, end, options)
+
+    return path
+
+
+def generate(options):
+    """Write users.csv, messages.csv and follows.csv into options.out."""
+
+    if options.follows > options.users * (options.users - 1):
+        raise SystemExit("More follows requested than there are user pairs.")
+
+    jobs = []
+    for name, _, _, size in TABLES:
+        rows = size(options)
+        for part, start in enumerate(range(1, rows + 1, PART_SIZE)):
+            jobs.append((name, part, start, min(start + PART_SIZE, rows + 1),
+                         options))
+
+    with Pool(options.processes) as pool:
+        paths = pool.map(write_part, jobs, chunksize=1)
+
+    for name, headers, _, _ in TABLES:
+        with open(os.path.join(options.out, f"{name}.csv"), 'w',
+                  newline='') as out:
+            csv.writer(out).writerow(headers)
+            for (table, *_), path in zip(jobs, paths):
+                if table == name:
+                    with open(path, newline='') as part:
+                        shutil.copyfileobj(part, out)
+                    os.remove(path)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Generate Warbler seed CSVs.")
+    parser.add_argument('--users', type=int, default=NUM_USERS)
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES)
+    parser.add_argument('--follows', type=int, default=NUM_FOLLWERS)
+    parser.add_argument('--zipf', type=float, default=1.0,
+                        help="power-law exponent for popularity (default 1)")
+    parser.add_argument('--seed', default='warbler',
+                        help="random seed; the same seed gives the same data")
+    parser.add_argument('--end', type=datetime.fromisoformat,
+                        default=datetime(2023, 6, 1),
+                        help="latest message time (messages span 2 years)")
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--out', default='generator',
+                        help="directory to write the CSVs to")
+    return parser.parse_args(argv)
 
-header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
-]
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+if __name__ == '__main__':
+    generate(parse_args())
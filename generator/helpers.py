@@ -1,14 +1,168 @@
-"""Support functions for CSV generation."""
+"""Support functions for CSV generation.
 
-from datetime import datetime
-from random import uniform
+Everything here is offline and takes an explicit `random.Random`, so a
+given seed always produces the same data.
+"""
 
+import math
+from datetime import timedelta
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
+# Profile images; these are only URLs, nothing is downloaded.
+IMAGE_URLS = [
+    f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
+    for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
+    for i in range(count)
+]
 
-    now = datetime.now()
-    then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
+HEADER_IMAGE_URLS = [
+    f"https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_{name}_1280.jpg"
+    for name in [
+        "mnh0n9pHJW1st5lhmo1", "mnh0uemhCk1st5lhmo1", "mnh121HEWa1st5lhmo1",
+        "mnh17lfd9R1st5lhmo1", "mnh1d7s3UD1st5lhmo1", "mnh1jdFvHR1st5lhmo1",
+        "mnh1uhYnog1st5lhmo1", "mnh25vNOvI1st5lhmo1", "mnh29fxz111st5lhmo1",
+        "mnh2m1hnS81st5lhmo1", "mo1h6tGOZf1st5lhmo1", "mo2wz2LTCs1st5lhmo1",
+        "mo2x3aAnRH1st5lhmo1", "mo2x80NkDu1st5lhmo1", "mo2x9xqeef1st5lhmo1",
+        "mo2xbk8JUK1st5lhmo1", "mo2xdqmle51st5lhmo1", "mo2xfarCvW1st5lhmo1",
+        "mo2xgqdEFn1st5lhmo1", "mo2xijE2nr1st5lhmo1", "mopq4kHmAg1st5lhmo1",
+        "mopq69jlcS1st5lhmo1", "mopq8fyQwI1st5lhmo1", "mopqamedKu1st5lhmo1",
+        "mopqc3ZZcz1st5lhmo1", "mopqdfx05t1st5lhmo1", "mopqfpSTPN1st5lhmo1",
+        "mopqhxFulr1st5lhmo1", "mopqj9QUeq1st5lhmo1", "mopqkkwK2M1st5lhmo1",
+        "mp6rzyNlAN1st5lhmo1", "mp6s1hAudo1st5lhmo1", "mp6s32zb6l1st5lhmo1",
+        "mp6s4dzqHA1st5lhmo1", "mp6s661UgK1st5lhmo1", "mp6s7lR1lS1st5lhmo1",
+        "mp6s995bvI1st5lhmo1", "mp6sasSvPZ1st5lhmo1", "mp6scv2xrZ1st5lhmo1",
+        "mpp6f50W261st5lhmo1", "mpp6gwrYvm1st5lhmo1", "mpp6l06zXi1st5lhmo1",
+        "mpp6poZxE51st5lhmo1", "mpp6tjdFhf1st5lhmo1", "mpp6w0dxAm1st5lhmo1",
+    ]
+]
 
-    return datetime.fromtimestamp(random_timestamp)
+WORDS = """
+    able about above across act action add after again against age agent ago
+    agree air all allow almost alone along already also always among amount
+    and animal answer any appear apply area argue arm around art artist ask
+    attack author away baby back bad bag ball bank bar base beat beautiful
+    because become bed before begin behind believe best better between beyond
+    big bill bird bit black blood blue board boat body book born both box boy
+    break bring brother budget build building business buy call camera campaign
+    car card care career carry case cat catch cause cell center central century
+    chair chance change charge check child choice choose church citizen city
+    civil claim class clear close coach cold college color come common
+    computer concern condition consider contain continue control cost could
+    country couple course court cover create crime cultural culture cup current
+    customer cut dark data daughter day dead deal debate decade decide deep
+    defense degree describe design detail develop die difference dinner
+    direction discover discuss disease doctor dog door down draw dream drive
+    drop during each early east easy eat economy edge effect effort eight
+    either election else employee end energy enjoy enough enter entire
+    environment evening event ever every evidence exactly example expert
+    explain eye face fact factor fail fall family far fast father fear federal
+    feel field fight figure fill film final find fine finger finish fire firm
+    first fish five floor fly focus follow food foot force forget form forward
+    four free friend front full fund future game garden gas general get girl
+    give glass goal good government great green ground group grow growth guess
+    gun guy hair half hand hang happen happy hard have head health hear heart
+    heat heavy help here herself high history hit hold home hope hospital hot
+    hotel hour house huge human hundred idea image imagine impact important
+    improve include increase indeed industry inside instead interest interview
+    into issue item itself job join just keep key kid kind kitchen know land
+    language large last late later laugh law lawyer lay lead leader learn leave
+    left leg legal less letter level lie life light like likely line list
+    listen little live local long look lose loss lot love low machine magazine
+    main maintain major make manage manager many market marriage material matter
+    may maybe mean measure media medical meet meeting member memory mention
+    message method middle might military million mind minute miss mission model
+    modern moment money month more morning most mother mouth move movement movie
+    much music must myself name nation natural nature near nearly necessary need
+    network never news newspaper next nice night none north note nothing notice
+    now number occur off offer office officer official often oil old once only
+    open operation option order organization other others outside over own
+    owner page pain painting paper parent part participant particular partner
+    party pass past patient pattern pay peace people per perform perhaps period
+    person phone physical pick picture piece place plan plant play player point
+    police policy political poor popular population position positive possible
+    power practice prepare present president pressure pretty prevent price
+    private probably problem process produce product professional program
+    project property protect prove provide public pull purpose push put quality
+    question quickly quite race radio raise range rate rather reach read ready
+    real reality realize really reason receive recent recently recognize record
+    red reduce reflect region relate remain remember remove report represent
+    require research resource respond response rest result return reveal rich
+    right rise risk road rock role room rule run safe same save say scene school
+    science score sea season seat second section security see seek seem sell
+    send senior sense series serious serve service set seven several shake
+    share she shoot short shot should shoulder show side sign significant
+    similar simple simply since sing single sister sit site situation six size
+    skill skin small smile social society soldier some somebody someone
+    something sometimes son song soon sort sound source south southern space
+    speak special specific speech spend sport spring staff stage stand standard
+    star start state statement station stay step still stock stop store story
+    strategy street strong structure student study stuff style subject success
+    suddenly suffer suggest summer support sure surface system table take talk
+    task tax teach teacher team technology television tell ten tend term test
+    than thank that their them theory there these they thing think third this
+    those though thought thousand threat three through throughout throw thus
+    time today together tonight too top total tough toward town trade
+    traditional training travel treat treatment tree trial trip trouble true
+    truth try turn two type under understand unit until upon use usually value
+    various very victim view violence visit voice vote wait walk wall want war
+    watch water way weapon wear week weight well west western what whatever
+    wheel when where whether which while white whole whom whose why wide wife
+    will win wind window wish with within without woman wonder word work worker
+    world worry would write writer wrong yard yeah year yes yet young yourself
+""".split()
+
+PLACE_SUFFIXES = ["ville", "burgh", "port", "field", "ton", " City", "mouth"]
+
+# Every user gets the hash of the password "password".
+PASSWORD_HASH = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
+
+# Primes for scrambling popularity ranks into user ids.
+SCRAMBLE_PRIMES = [1000003, 1000033, 1000037, 1000039]
+
+
+def get_random_datetime(rng, end, year_gap=2):
+    """Get a random datetime within `year_gap` years before `end`."""
+
+    span = timedelta(days=365 * year_gap).total_seconds()
+    return end - timedelta(seconds=rng.uniform(0, span))
+
+
+def sentence(rng, max_length, min_words=4, max_words=20):
+    """Return a random sentence of pool words, at most `max_length` long."""
+
+    words = rng.choices(WORDS, k=rng.randint(min_words, max_words))
+    text = ' '.join(words).capitalize()[:max_length - 1].rstrip()
+    return text + '.'
+
+
+def place(rng):
+    """Return a made-up town name."""
+
+    return rng.choice(WORDS).capitalize() + rng.choice(PLACE_SUFFIXES)
+
+
+def power_law_rank(rng, n, exponent):
+    """Return a rank from 1..n, where rank r has weight about 1 / r**exponent.
+
+    Uses the inverse CDF of the continuous distribution, so it needs no
+    tables and runs in constant time and memory however large `n` is.
+    """
+
+    u = rng.random()
+    if exponent == 1:
+        x = math.exp(u * math.log(n + 1))
+    else:
+        a = 1 - exponent
+        x = (u * (n + 1) ** a + (1 - u)) ** (1 / a)
+
+    return min(int(x), n)
+
+
+def rank_to_user(rank, n):
+    """Map popularity rank 1..n onto user ids 1..n, one to one.
+
+    Spreads the popular users across the id range rather than making them
+    users 1, 2, 3...; a permutation table would cost O(n) memory.
+    """
+
+    prime = next(p for p in SCRAMBLE_PRIMES if n % p)
+    return (rank * prime) % n + 1
@@ -0,0 +1,41 @@
+"""gunicorn settings: serve the production app, and share Prometheus
+metrics between worker processes.
+
+gunicorn loads this file (from the directory it's started in) before any
+worker imports the app, so the directory is in place for them all.
+
+    gunicorn --preload --workers 4
+
+--preload creates the app once, in the master, and forks workers from it,
+so new workers start almost instantly; create_app() makes sure each one
+opens its own database connections.
+"""
+
+import os
+import shutil
+import tempfile
+
+# prometheus_client picks its storage when first imported, so this must
+# come before the import below.
+if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(
+        prefix='warbler-metrics-')
+
+from prometheus_client import multiprocess  # noqa: E402
+
+os.environ.setdefault('WARBLER_CONFIG', 'production')
+wsgi_app = 'app:create_app()'
+
+
+def on_starting(server):
+    """Start from empty metrics, not the last run's."""
+
+    directory = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+
+def child_exit(server, worker):
+    """Stop reporting live gauges for a worker that has exited."""
+
+    multiprocess.mark_process_dead(worker.pid)
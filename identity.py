@@ -0,0 +1,94 @@
+"""Lightweight, cached current-user records for `g.user`.
+
+Every request needs to know who is logged in, but few need the full ORM
+User. `load_current_user` returns a CurrentUser built from a small cached
+record of the user's display fields and counters, so most requests never
+query `users` for the viewer at all. Anything not in the record (such as
+relationships, or the password hash) loads the ORM object on first use.
+
+The cache is per worker process and entries expire after a short TTL, so
+changes made through another worker show up within that window. Views
+that change the logged-in user invalidate that user's entry.
+"""
+
+from types import MethodType
+
+from sqlalchemy import select
+
+from models import db, User
+
+# Columns copied into a cached record.
+RECORD_FIELDS = (
+    'id', 'username', 'email', 'image_url', 'header_image_url', 'bio',
+    'location', 'messages_count', 'following_count', 'followers_count',
+    'likes_count',
+)
+
+# User methods that only read `self.id`, so can run without the ORM row.
+ID_ONLY_METHODS = frozenset({
+    'liked_message_ids', 'following_ids', 'is_following', 'is_followed_by',
+})
+
+
+class CurrentUser:
+    """The logged-in user, backed by a cached record.
+
+    Reads of record fields are served from the cache. Anything else
+    (`messages`, `password`, ...) loads the User row once per request;
+    call `load()` directly before mutating the user.
+    """
+
+    def __init__(self, record):
+        self._record = record
+        self._user = None
+
+    def __getattr__(self, name):
+        if name in self._record:
+            return self._record[name]
+
+        if name in ID_ONLY_METHODS:
+            return MethodType(getattr(User, name), self)
+
+        return getattr(self.load(), name)
+
+    def __eq__(self, other):
+        return isinstance(other, (User, CurrentUser)) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return f"<CurrentUser #{self.id}: {self.username}>"
+
+    def load(self):
+        """Return the ORM User for this record, loading it if needed."""
+
+        if self._user is None:
+            self._user = db.session.get(User, self.id)
+        return self._user
+
+
+def load_current_user(user_id, cache):
+    """Return a CurrentUser for `user_id`, or None if there is no such user."""
+
+    record = cache.get(user_id)
+
+    if record is None:
+        row = db.session.execute(record_select(user_id)).first()
+        if row is None:
+            return None
+
+        record = row._asdict()
+        cache.set(user_id, record)
+
+    return CurrentUser(record)
+
+
+def record_select(user_id):
+    """The query for `user_id`'s record: one row of RECORD_FIELDS, or none
+    if the user has been deleted."""
+
+    columns = [getattr(User, field) for field in RECORD_FIELDS]
+    return (select(*columns)
+            .where(User.id == user_id)
+            .where(User.deleted_at.is_(None)))
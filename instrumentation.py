@@ -0,0 +1,134 @@
+"""Per-request SQL statistics and N+1 detection.
+
+Engine event hooks count the statements each request runs, the time spent
+in the database and the rows fetched. After the request they are added to
+the response as a `Server-Timing` header (visible in browser dev tools)
+and logged as one JSON line on the `warbler.sql` logger.
+
+Statements are normalized (literals and IN-lists collapsed) and counted; a
+request that runs the same one more than SQL_REPEAT_THRESHOLD times is
+logged as a warning, since that's almost always a template or loop loading
+rows one at a time (the N+1 pattern).
+
+Configuration:
+
+  SQL_INSTRUMENTATION    turn the hooks on (default True)
+  SQL_REPEAT_THRESHOLD   repeats of one statement that count as N+1 (5)
+"""
+
+import json
+import logging
+import re
+import time
+from collections import Counter
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+logger = logging.getLogger('warbler.sql')
+
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\bIN \((?:[^()]*)\)", re.IGNORECASE)
+_SPACE_RE = re.compile(r"\s+")
+
+
+class RequestStats:
+    """SQL activity during one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+        self.shapes = Counter()
+
+    def repeated(self, threshold):
+        """Return [(statement, count)] run more than `threshold` times."""
+
+        return [(statement, count)
+                for statement, count in self.shapes.most_common()
+                if count > threshold]
+
+
+def normalize(statement):
+    """Reduce `statement` to its shape, ignoring literal values."""
+
+    statement = _LITERAL_RE.sub('?', statement)
+    statement = _IN_LIST_RE.sub('IN (...)', statement)
+    return _SPACE_RE.sub(' ', statement).strip()
+
+
+def init_app(app, engines):
+    """Record SQL statistics for `app`'s requests made through any of
+    `engines` (the primary's and every replica's)."""
+
+    app.config.setdefault('SQL_INSTRUMENTATION', True)
+    app.config.setdefault('SQL_REPEAT_THRESHOLD', 5)
+
+    if not app.config['SQL_INSTRUMENTATION']:
+        return
+
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', _before_execute)
+        event.listen(engine, 'after_cursor_execute', _after_execute)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+
+
+def _start_request():
+    g.sql_stats = RequestStats()
+
+
+def _before_execute(conn, cursor, statement, parameters, context,
+                    executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_execute(conn, cursor, statement, parameters, context,
+                   executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+
+    stats = g.get('sql_stats') if has_request_context() else None
+    if stats is None:
+        return
+
+    stats.statements += 1
+    stats.db_seconds += elapsed
+    if cursor.description is not None and cursor.rowcount > 0:
+        stats.rows += cursor.rowcount
+    stats.shapes[normalize(statement)] += 1
+
+
+def _finish_request(response):
+    stats = g.pop('sql_stats', None)
+    if stats is None:
+        return response
+
+    total_ms = (time.perf_counter() - stats.started) * 1000
+    db_ms = stats.db_seconds * 1000
+
+    response.headers.add(
+        'Server-Timing',
+        f'db;dur={db_ms:.1f};desc="{stats.statements} statements, '
+        f'{stats.rows} rows", app;dur={total_ms:.1f}')
+
+    threshold = current_app.config['SQL_REPEAT_THRESHOLD']
+    repeated = stats.repeated(threshold)
+
+    logger.info(json.dumps({
+        'method': request.method,
+        'path': request.path,
+        'endpoint': request.endpoint,
+        'status': response.status_code,
+        'statements': stats.statements,
+        'db_ms': round(db_ms, 1),
+        'rows': stats.rows,
+        'total_ms': round(total_ms, 1),
+        'repeated': len(repeated),
+    }))
+
+    for statement, count in repeated:
+        logger.warning("Possible N+1 in %s: statement ran %d times: %s",
+                       request.endpoint, count, statement)
+
+    return response
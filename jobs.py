@@ -0,0 +1,220 @@
+"""A job queue in the database, for side effects too slow for a request.
+
+Views queue a job with `enqueue` in the same transaction as the change that
+needs it, so the job exists exactly when the change commits, and return
+straight away. `flask run-jobs` works through due jobs in batches:
+
+- Each job is claimed with SELECT .. FOR UPDATE SKIP LOCKED, so several
+  workers can run side by side without taking the same job.
+- Each job runs in a savepoint and is deleted in its own transaction, so
+  its changes and its removal from the queue commit together, and no job
+  holds its locks while the rest of the batch runs.
+- A job that raises is retried after JOBS_RETRY_SECONDS, doubling with
+  each attempt; after JOBS_MAX_ATTEMPTS it stays in the table, marked
+  failed, with its last error.
+
+Jobs can carry an idempotency key: while a job with that key is waiting,
+queueing another with the same key does nothing, so a double-submitted
+form deletes an account once. A job marked failed gives its key up, so
+the work can be queued again.
+
+`stats` (also at /_stats and `flask job-stats`) reports how many jobs are
+due and the lag: how long the oldest due job has been waiting.
+
+Configuration:
+
+  JOBS_BATCH_SIZE      jobs run, one transaction each, between
+                       reports (default 100)
+  JOBS_POLL_SECONDS    how long an idle worker waits between looks
+                       (default 1)
+  JOBS_MAX_ATTEMPTS    runs before a job is marked failed (default 5)
+  JOBS_RETRY_SECONDS   wait before the first retry (default 10)
+"""
+
+import logging
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, select
+from sqlalchemy.dialects import postgresql
+
+from models import db, Job
+import deletion
+import timelines
+
+logger = logging.getLogger('warbler.jobs')
+
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 5
+RETRY_SECONDS = 10
+
+# Job functions, by kind
+HANDLERS = {}
+
+
+def handler(kind):
+    """Register a function to run jobs of `kind` with their payload."""
+
+    def register(function):
+        HANDLERS[kind] = function
+        return function
+
+    return register
+
+
+def enqueue(kind, payload, key=None, delay=0):
+    """Queue a `kind` job to run with `payload` (a dict of JSON values).
+
+    The job can run once the current transaction commits, and `delay`
+    seconds have passed. With `key`, does nothing if a job with that key is
+    already waiting. Does not commit.
+    """
+
+    values = dict(kind=kind, payload=payload, idempotency_key=key,
+                  run_at=datetime.utcnow() + timedelta(seconds=delay),
+                  attempts=0)
+
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(
+            postgresql.insert(Job).values(values)
+            .on_conflict_do_nothing(index_elements=['idempotency_key']))
+
+    elif key is None or not db.session.scalar(
+            select(Job.id).where(Job.idempotency_key == key)):
+        db.session.add(Job(**values))
+
+
+def work(batch_size=BATCH_SIZE, max_attempts=MAX_ATTEMPTS,
+         retry_seconds=RETRY_SECONDS):
+    """Run up to `batch_size` due jobs, committing after each.
+
+    Jobs queued or rescheduled meanwhile wait for the next call. Returns
+    (ran, failed): how many jobs were attempted, and how many of those
+    raised.
+    """
+
+    now = datetime.utcnow()
+    claimed = []
+    failed = 0
+
+    while len(claimed) < batch_size:
+        job = db.session.scalar(
+            select(Job)
+            .where(Job.failed_at.is_(None))
+            .where(Job.run_at <= now)
+            .where(Job.id.not_in(claimed))
+            .order_by(Job.run_at, Job.id)
+            .limit(1)
+            .with_for_update(skip_locked=True))
+        if job is None:
+            break
+        claimed.append(job.id)
+
+        try:
+            with db.session.begin_nested():
+                HANDLERS[job.kind](**job.payload)
+        except Exception as exc:
+            failed += 1
+            job.attempts += 1
+            job.last_error = f"{type(exc).__name__}: {exc}"
+            if job.attempts >= max_attempts:
+                job.failed_at = now
+                job.idempotency_key = None
+            else:
+                job.run_at = now + timedelta(
+                    seconds=retry_seconds * 2 ** (job.attempts - 1))
+        else:
+            db.session.delete(job)
+
+        db.session.commit()
+
+    return len(claimed), failed
+
+
+def run_worker(batch_size=BATCH_SIZE, poll_seconds=1,
+               max_attempts=MAX_ATTEMPTS, retry_seconds=RETRY_SECONDS,
+               once=False, report=print):
+    """Run jobs as they fall due, until interrupted.
+
+    With `once`, stops when no jobs are due instead of waiting for more.
+    Calls `report` with a line after each batch that ran anything.
+    """
+
+    while True:
+        started = time.perf_counter()
+        ran, failed = work(batch_size, max_attempts, retry_seconds)
+
+        if ran:
+            report(f"Ran {ran} jobs ({failed} failed) in "
+                   f"{time.perf_counter() - started:.2f}s; "
+                   f"lag {stats()['lag_seconds']:.1f}s")
+        elif once:
+            return
+        else:
+            time.sleep(poll_seconds)
+
+
+def stats():
+    """Return counts of due, scheduled and failed jobs, and the lag."""
+
+    now = datetime.utcnow()
+    waiting = Job.failed_at.is_(None)
+    due = waiting & (Job.run_at <= now)
+
+    row = db.session.execute(select(
+        func.count().filter(due),
+        func.count().filter(waiting & (Job.run_at > now)),
+        func.count().filter(Job.failed_at.is_not(None)),
+        func.min(Job.run_at).filter(due),
+    )).one()
+
+    due_count, scheduled, failed, oldest = row
+    return {
+        'due': due_count,
+        'scheduled': scheduled,
+        'failed': failed,
+        'lag_seconds': (now - oldest).total_seconds() if oldest else 0.0,
+    }
+
+
+##############################################################################
+# Jobs
+
+
+@handler('fan_out')
+def fan_out(message_id, after=0):
+    """Copy a new message into the next chunk of its author's followers'
+    timelines.
+
+    Queues itself again, from the last follower covered, until every
+    follower has it, so a popular author's message is copied in many short
+    transactions rather than one long one.
+    """
+
+    last = timelines.fan_out_to_followers(
+        message_id, after, current_app.config['FAN_OUT_CHUNK_SIZE'])
+    if last is not None:
+        enqueue('fan_out', {'message_id': message_id, 'after': last})
+
+
+@handler('delete_user')
+def delete_user(user_id, deleted=None):
+    """Delete the next chunk of a tombstoned account (see deletion.py).
+
+    Queues itself again until the account is gone, so each chunk commits
+    in its own transaction. `deleted` counts the rows removed so far, per
+    step.
+    """
+
+    chunk = deletion.delete_chunk(
+        user_id, current_app.config['DELETION_CHUNK_SIZE'])
+    if chunk is None:
+        return
+
+    name, rows = chunk
+    deleted = dict(deleted or {})
+    deleted[name] = deleted.get(name, 0) + rows
+    logger.info("Deleting user %s: %s", user_id, deleted)
+
+    enqueue('delete_user', {'user_id': user_id, 'deleted': deleted})
@@ -0,0 +1,247 @@
+"""Stream the generator/ CSVs into the database.
+
+Rows are loaded in chunks, each in its own transaction: with PostgreSQL
+`COPY ... FROM STDIN`, elsewhere (SQLite) with an executemany INSERT. Only
+the tables and their primary keys exist during the load; secondary
+indexes and foreign keys are added once every row is in, then sequences
+are reset and the denormalized tables (timelines, counters, message search
+index) are built. Finally the database is marked as being at the latest
+migration, so `flask db upgrade` has nothing to do.
+
+Progress is recorded in a `load_progress` table in the same transaction as
+each chunk, so `load(..., resume=True)` picks up an interrupted load where
+it stopped. Users and messages get ids from their row number in the CSV
+(which is what the foreign keys in the other files refer to), so a resumed
+load assigns the same ids a clean one would.
+"""
+
+import csv
+import io
+import os
+import time
+from datetime import datetime
+
+import flask_migrate
+from sqlalchemy import (
+    Boolean, Column, BigInteger, MetaData, Table, Text, inspect, insert,
+    select, text, update,
+)
+from sqlalchemy.schema import AddConstraint, CreateTable
+
+from models import db, User, Message, Follows
+from timelines import backfill as backfill_timelines
+from counters import reconcile as reconcile_counters
+from search import reindex_messages
+
+CHUNK_SIZE = 50000
+
+# (table, CSV file, whether rows get their row number as id), in load order
+SOURCES = [
+    (User.__table__, 'users.csv', True),
+    (Message.__table__, 'messages.csv', True),
+    (Follows.__table__, 'follows.csv', False),
+]
+
+progress_metadata = MetaData()
+
+load_progress = Table(
+    'load_progress', progress_metadata,
+    Column('step', Text, primary_key=True),
+    Column('rows', BigInteger, nullable=False, default=0),
+    Column('done', Boolean, nullable=False, default=False),
+)
+
+
+class LoadError(Exception):
+    """Raised when a load can't start or resume."""
+
+
+def load(directory='generator', resume=False, chunk_size=CHUNK_SIZE,
+         report=print):
+    """Load every CSV in `directory`, replacing the database's contents.
+
+    With `resume`, continue an interrupted load instead of starting over.
+    `report` is called with a line of progress text now and then.
+    """
+
+    if resume:
+        if not inspect(db.engine).has_table('load_progress'):
+            raise LoadError("There is no interrupted load to resume.")
+    else:
+        _create_schema()
+
+    for table, filename, numbered in SOURCES:
+        _run_step(table.name, report, lambda rows: _load_table(
+            table, os.path.join(directory, filename), numbered, rows,
+            chunk_size, report))
+
+    _run_step('indexes', report, lambda rows: _create_indexes())
+    _run_step('foreign_keys', report, lambda rows: _add_foreign_keys())
+    _run_step('sequences', report, lambda rows: _reset_sequences())
+    _run_step('timelines', report, lambda rows: backfill_timelines())
+    _run_step('counters', report, lambda rows: reconcile_counters())
+    _run_step('search', report, lambda rows: reindex_messages())
+
+    _stamp_migrations()
+    load_progress.drop(db.engine)
+    report("Load complete.")
+
+
+##############################################################################
+# Steps
+
+
+def _run_step(step, report, run):
+    """Run `run(rows_already_done)` unless `step` is already finished."""
+
+    row = db.session.execute(
+        select(load_progress).where(load_progress.c.step == step)).first()
+    if row is None:
+        db.session.execute(insert(load_progress).values(step=step))
+        db.session.commit()
+    elif row.done:
+        return
+
+    report(f"{step}: starting")
+    run(row.rows if row else 0)
+
+    db.session.execute(update(load_progress)
+                       .where(load_progress.c.step == step)
+                       .values(done=True))
+    db.session.commit()
+
+
+def _create_schema():
+    """Create empty tables with primary keys, but no indexes or FKs."""
+
+    db.drop_all()
+    progress_metadata.drop_all(db.engine)
+    db.session.execute(text("DROP TABLE IF EXISTS alembic_version"))
+
+    # SQLite can't add foreign keys later, so create them up front there
+    # (it doesn't enforce them by default, so they cost nothing).
+    deferred = db.engine.dialect.name != 'sqlite'
+
+    connection = db.session.connection()
+    for table in db.metadata.sorted_tables:
+        connection.execute(CreateTable(
+            table, include_foreign_key_constraints=[] if deferred else None))
+    progress_metadata.create_all(connection)
+    db.session.commit()
+
+
+def _load_table(table, path, numbered, done, chunk_size, report):
+    """Load the rows of CSV `path` after the first `done` into `table`."""
+
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        columns = (['id'] if numbered else []) + header
+
+        for _ in range(done):
+            next(reader)
+
+        started = time.monotonic()
+        loaded = 0
+        while True:
+            chunk = []
+            for row in reader:
+                if numbered:
+                    row = [done + loaded + len(chunk) + 1] + row
+                chunk.append(row)
+                if len(chunk) == chunk_size:
+                    break
+            if not chunk:
+                break
+
+            if db.engine.dialect.name == 'postgresql':
+                _copy_rows(table, columns, chunk)
+            else:
+                _insert_rows(table, columns, chunk)
+
+            loaded += len(chunk)
+            db.session.execute(update(load_progress)
+                               .where(load_progress.c.step == table.name)
+                               .values(rows=done + loaded))
+            db.session.commit()
+
+            elapsed = time.monotonic() - started
+            report(f"{table.name}: {done + loaded} rows "
+                   f"({loaded / elapsed if elapsed else 0:.0f} rows/s)")
+
+
+def _copy_rows(table, columns, rows):
+    """Send `rows` to PostgreSQL with COPY, in the session's transaction."""
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+
+    cursor = db.session.connection().connection.dbapi_connection.cursor()
+    cursor.copy_expert(
+        f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+        buffer)
+
+
+def _insert_rows(table, columns, rows):
+    """Insert `rows` with one executemany, converting CSV text to types."""
+
+    convert = [_converter(table.c[column]) for column in columns]
+    db.session.execute(insert(table), [
+        {column: fn(value) for column, fn, value in zip(columns, convert, row)}
+        for row in rows
+    ])
+
+
+def _converter(column):
+    """Return a function turning CSV text into `column`'s Python type."""
+
+    python_type = column.type.python_type
+    if python_type is datetime:
+        parse = datetime.fromisoformat
+    elif python_type is int:
+        parse = int
+    else:
+        parse = str
+
+    # An empty unquoted field is NULL, as in COPY's csv format.
+    return lambda value: parse(value) if value != '' else None
+
+
+def _create_indexes():
+    connection = db.session.connection()
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+    db.session.commit()
+
+
+def _add_foreign_keys():
+    if db.engine.dialect.name == 'sqlite':
+        return
+
+    connection = db.session.connection()
+    for table in db.metadata.sorted_tables:
+        for constraint in table.foreign_key_constraints:
+            connection.execute(AddConstraint(constraint))
+    db.session.commit()
+
+
+def _stamp_migrations():
+    """Record the schema, made from the models, as the latest migration's."""
+
+    flask_migrate.stamp()
+
+
+def _reset_sequences():
+    """Point each id sequence past the ids the load assigned itself."""
+
+    if db.engine.dialect.name != 'postgresql':
+        return
+
+    for table, _, numbered in SOURCES:
+        if numbered:
+            db.session.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                f"coalesce(max(id), 0) + 1, false) FROM {table.name}"))
+    db.session.commit()
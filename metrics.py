@@ -0,0 +1,139 @@
+"""Prometheus metrics, served at /metrics.
+
+Exports, per Flask endpoint, a request latency histogram and response
+counts by status code; the database connection pools' checkout wait,
+and connections in use and overflow per database (primary, replica0, ...);
+and time spent hashing and checking passwords.
+
+Under gunicorn each worker is its own process, so metrics are shared
+through files in PROMETHEUS_MULTIPROC_DIR (gunicorn.conf.py sets this up);
+/metrics then reports the sum over every worker, whichever one answers.
+Without that variable, as under `flask run`, it reports this process only.
+Recording a request is a couple of in-memory increments, so it can stay on.
+"""
+
+import os
+import time
+
+from flask import Response, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram,
+    REGISTRY, generate_latest, multiprocess,
+)
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+REQUEST_SECONDS = Histogram(
+    'warbler_request_duration_seconds',
+    "Time to handle a request, by Flask endpoint.",
+    ['endpoint', 'method'],
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10),
+)
+
+RESPONSES = Counter(
+    'warbler_responses_total',
+    "Responses sent, by Flask endpoint and status code.",
+    ['endpoint', 'status'],
+)
+
+POOL_WAIT_SECONDS = Histogram(
+    'warbler_db_pool_checkout_wait_seconds',
+    "Time spent waiting for a database connection from the pool.",
+    buckets=(.0001, .0005, .001, .005, .01, .05, .1, .5, 1, 5),
+)
+
+POOL_IN_USE = Gauge(
+    'warbler_db_pool_connections_in_use',
+    "Database connections checked out of the pool, by database.",
+    ['database'],
+    multiprocess_mode='livesum',
+)
+
+POOL_OVERFLOW = Gauge(
+    'warbler_db_pool_overflow',
+    "Connections open beyond the pool's size, by database.",
+    ['database'],
+    multiprocess_mode='livesum',
+)
+
+PASSWORD_SECONDS = Histogram(
+    'warbler_password_seconds',
+    "Time to hash or check a password, including queueing.",
+    ['operation'],
+    buckets=(.05, .1, .25, .5, 1, 2.5, 5, 10),
+)
+
+
+class TimedQueuePool(QueuePool):
+    """A QueuePool that records how long each checkout waited."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_WAIT_SECONDS.observe(time.perf_counter() - started)
+
+
+def init_app(app, engines, hasher):
+    """Record metrics for `app`, the pools of `engines` and `hasher`.
+
+    `engines` maps bind keys to engines, like db.engines; the primary's
+    key is None.
+    """
+
+    app.before_request(_start_timer)
+    app.after_request(_record_response)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+
+    for key, engine in engines.items():
+        _watch_pool(engine.pool, key or 'primary')
+
+    # The hasher is shared by every app in the process; time it once.
+    if _time_password not in hasher.timers:
+        hasher.timers.append(_time_password)
+
+
+def metrics_view():
+    """Serve every worker's metrics in Prometheus' text format."""
+
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def _time_password(operation, seconds):
+    PASSWORD_SECONDS.labels(operation).observe(seconds)
+
+
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+
+def _record_response(response):
+    started = g.pop('request_started', None)
+    endpoint = request.endpoint or 'unmatched'
+
+    if started is not None:
+        REQUEST_SECONDS.labels(endpoint, request.method).observe(
+            time.perf_counter() - started)
+    RESPONSES.labels(endpoint, str(response.status_code)).inc()
+
+    return response
+
+
+def _watch_pool(pool, database):
+    event.listen(pool, 'checkout',
+                 lambda *args: _pool_changed(pool, database, 1))
+    event.listen(pool, 'checkin',
+                 lambda *args: _pool_changed(pool, database, -1))
+
+
+def _pool_changed(pool, database, change):
+    POOL_IN_USE.labels(database).inc(change)
+    if isinstance(pool, QueuePool):
+        POOL_OVERFLOW.labels(database).set(max(pool.overflow(), 0))
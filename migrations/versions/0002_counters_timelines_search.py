@@ -0,0 +1,125 @@
+"""Add counters, timelines and search, and key likes by user and message
+
+Brings a database at the initial schema up to the models as they were when
+migrations were introduced. Only the schema changes: afterwards, fill the
+new tables and columns from the existing rows with
+
+    flask reconcile-counters
+    flask backfill-timelines
+    flask reindex-messages
+
+Likes lose their surrogate id, and with it the unique constraint that
+allowed one like per message; each is keyed by (user, message) instead.
+Indexes on the existing tables are built CONCURRENTLY, outside the
+transaction, so a live database keeps taking writes meanwhile; the likes
+primary key is built that way too, then attached to the table.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 05:07:25.294438
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+COUNTERS = ['messages_count', 'following_count', 'followers_count',
+            'likes_count', 'profile_version']
+
+USER_SEARCH_VECTOR = ("to_tsvector('simple', coalesce(username, '') || ' ' "
+                      "|| coalesce(bio, '') || ' ' || coalesce(location, ''))")
+
+USERNAME_SORT_KEY = 'lower(username) COLLATE "C"'
+
+
+def upgrade():
+    postgresql = op.get_bind().dialect.name == 'postgresql'
+
+    for name in COUNTERS:
+        op.add_column('users', sa.Column(name, sa.Integer(), server_default='0', nullable=False))
+
+    op.create_table('message_terms',
+    sa.Column('term', sa.Text(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=False),
+    sa.Column('message_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['message_id'], ['messages.id'], ondelete='cascade'),
+    sa.PrimaryKeyConstraint('term', 'timestamp', 'message_id')
+    )
+    op.create_index('ix_message_terms_message_id', 'message_terms', ['message_id'], unique=False)
+
+    op.create_table('timelines',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('message_id', sa.Integer(), nullable=False),
+    sa.Column('author_id', sa.Integer(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['author_id'], ['users.id'], ondelete='cascade'),
+    sa.ForeignKeyConstraint(['message_id'], ['messages.id'], ondelete='cascade'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='cascade'),
+    sa.PrimaryKeyConstraint('user_id', 'message_id')
+    )
+    op.create_index('ix_timelines_author_id_user_id', 'timelines', ['author_id', 'user_id'], unique=False)
+    op.create_index('ix_timelines_message_id', 'timelines', ['message_id'], unique=False)
+    op.create_index('ix_timelines_user_id_timestamp', 'timelines', ['user_id', 'timestamp', 'message_id'], unique=False)
+
+    op.execute("DELETE FROM likes WHERE user_id IS NULL OR message_id IS NULL")
+    with op.batch_alter_table('likes', naming_convention={
+            'uq': 'likes_%(column_0_name)s_key'}) as batch_op:
+        batch_op.add_column(sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=False))
+        batch_op.alter_column('user_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.alter_column('message_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.drop_constraint('likes_message_id_key', type_='unique')
+        batch_op.drop_column('id')
+        if not postgresql:
+            batch_op.create_primary_key('likes_pkey', ['user_id', 'message_id'])
+    with op.batch_alter_table('likes') as batch_op:
+        batch_op.alter_column('created_at', existing_type=sa.DateTime(), server_default=None)
+
+    with op.get_context().autocommit_block():
+        if postgresql:
+            op.create_index('likes_pkey', 'likes', ['user_id', 'message_id'], unique=True, postgresql_concurrently=True)
+            op.execute("ALTER TABLE likes ADD CONSTRAINT likes_pkey PRIMARY KEY USING INDEX likes_pkey")
+            op.create_index('ix_users_search_vector', 'users', [sa.text(USER_SEARCH_VECTOR)], unique=False, postgresql_using='gin', postgresql_concurrently=True)
+            op.create_index('ix_users_username_sort', 'users', [sa.text(USERNAME_SORT_KEY)], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_likes_message_id', 'likes', ['message_id'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_messages_user_id_timestamp', 'messages', ['user_id', 'timestamp', 'id'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    postgresql = op.get_bind().dialect.name == 'postgresql'
+
+    op.drop_index('ix_messages_user_id_timestamp', table_name='messages')
+    op.drop_index('ix_likes_message_id', table_name='likes')
+    if postgresql:
+        op.drop_index('ix_users_username_sort', table_name='users')
+        op.drop_index('ix_users_search_vector', table_name='users')
+
+    # The initial schema allowed one like per message; keep the first.
+    op.execute("DELETE FROM likes WHERE EXISTS ("
+               "SELECT 1 FROM likes AS earlier"
+               " WHERE earlier.message_id = likes.message_id"
+               " AND earlier.created_at < likes.created_at"
+               " OR earlier.message_id = likes.message_id"
+               " AND earlier.created_at = likes.created_at"
+               " AND earlier.user_id < likes.user_id)")
+    with op.batch_alter_table('likes') as batch_op:
+        batch_op.drop_constraint('likes_pkey', type_='primary')
+        batch_op.drop_column('created_at')
+        if not postgresql:
+            batch_op.add_column(sa.Column('id', sa.Integer(), primary_key=True))
+        batch_op.alter_column('user_id', existing_type=sa.Integer(), nullable=True)
+        batch_op.alter_column('message_id', existing_type=sa.Integer(), nullable=True)
+        batch_op.create_unique_constraint('likes_message_id_key', ['message_id'])
+    if postgresql:
+        op.execute("ALTER TABLE likes ADD COLUMN id SERIAL PRIMARY KEY")
+
+    op.drop_table('timelines')
+    op.drop_table('message_terms')
+
+    for name in reversed(COUNTERS):
+        op.drop_column('users', name)
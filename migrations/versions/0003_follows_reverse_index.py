@@ -0,0 +1,33 @@
+"""Index follows by follower
+
+Listing whom a user follows filters on follows.user_following_id, the
+second column of the primary key, so PostgreSQL read the whole key for it.
+Built CONCURRENTLY so a live database keeps taking follows meanwhile; that
+can't run inside a transaction, hence the autocommit block.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 05:30:12.815227
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index('ix_follows_user_following_id', 'follows',
+                        ['user_following_id', 'user_being_followed_id'],
+                        unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_follows_user_following_id', table_name='follows',
+                      postgresql_concurrently=True)
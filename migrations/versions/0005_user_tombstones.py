@@ -0,0 +1,27 @@
+"""Mark deleted users
+
+Deleting an account sets users.deleted_at at once, hiding it, and removes
+its rows afterwards in chunks (see deletion.py).
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 06:21:09.551870
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('users', 'deleted_at')
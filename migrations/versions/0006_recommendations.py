@@ -0,0 +1,34 @@
+"""Add precomputed follow recommendations
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17 06:48:12.307415
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('recommendations',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('rank', sa.Integer(), nullable=False),
+    sa.Column('recommended_id', sa.Integer(), nullable=False),
+    sa.Column('mutuals', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['recommended_id'], ['users.id'], ondelete='cascade'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='cascade'),
+    sa.PrimaryKeyConstraint('user_id', 'rank')
+    )
+    op.create_index('ix_recommendations_recommended_id', 'recommendations', ['recommended_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_recommendations_recommended_id', table_name='recommendations')
+    op.drop_table('recommendations')
@@ -2,11 +2,16 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+# Also registers the typed PostgreSQL full-text functions used in
+# func.to_tsvector()
+from sqlalchemy.dialects import postgresql
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+from passwords import hasher
+from replicas import RoutingSession
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 
 class Follows(db.Model):
@@ -26,28 +31,135 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    __table_args__ = (
+        # For whom a user follows; the primary key covers their followers.
+        db.Index('ix_follows_user_following_id',
+                 'user_following_id', 'user_being_followed_id'),
+    )
+
 
 class Likes(db.Model):
     """Mapping user likes to warbles."""
 
     __tablename__ = 'likes' 
 
-    id = db.Column(
-        db.Integer,
-        primary_key=True
-    )
-
     user_id = db.Column(
         db.Integer,
-        db.ForeignKey('users.id', ondelete='cascade')
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
     )
 
     message_id = db.Column(
         db.Integer,
         db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
+        primary_key=True,
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
     )
 
+    __table_args__ = (
+        # For a message's likes; the primary key covers a user's.
+        db.Index('ix_likes_message_id', 'message_id'),
+    )
+
+    @classmethod
+    def toggle(cls, user_id, message_id):
+        """Like the message if the user hasn't, otherwise unlike it.
+
+        Returns True if the user now likes the message, False if they no
+        longer do, or None if there is no such message (or its author has
+        been deleted; the like would escape deletion.py's counting). On
+        PostgreSQL the like, unlike and the user's likes_count are one
+        statement.
+        """
+
+        if db.engine.dialect.name != 'postgresql':
+            return cls._toggle_orm(user_id, message_id)
+
+        likes = cls.__table__
+        messages = Message.__table__
+        users = User.__table__
+        authors = users.alias('authors')
+
+        live = db.exists().where(
+            messages.c.id == message_id,
+            authors.c.id == messages.c.user_id,
+            authors.c.deleted_at.is_(None))
+
+        removed = (
+            likes.delete()
+            .where(likes.c.user_id == user_id,
+                   likes.c.message_id == message_id,
+                   live)
+            .returning(likes.c.message_id)
+            .cte('removed'))
+
+        added = (
+            postgresql.insert(likes)
+            .from_select(
+                ['user_id', 'message_id', 'created_at'],
+                db.select(db.literal(user_id), messages.c.id,
+                          db.literal(datetime.utcnow()))
+                .where(messages.c.id == message_id)
+                .where(live)
+                .where(~db.exists(removed.select())))
+            .on_conflict_do_nothing()
+            .returning(likes.c.message_id)
+            .cte('added'))
+
+        change = (db.select(db.func.count()).select_from(added)
+                  .scalar_subquery()
+                  - db.select(db.func.count()).select_from(removed)
+                  .scalar_subquery())
+
+        counted = (
+            users.update()
+            .where(users.c.id == user_id, change != 0)
+            .values(likes_count=users.c.likes_count + change)
+            .cte('counted'))
+
+        found, liked = db.session.execute(
+            db.select(live, db.exists(added.select()))
+            .add_cte(counted)).one()
+
+        return liked if found else None
+
+    @classmethod
+    def _toggle_orm(cls, user_id, message_id):
+        msg = db.session.get(Message, message_id)
+        if msg is None or msg.user.deleted_at is not None:
+            return None
+
+        like = db.session.get(cls, (user_id, message_id))
+        if like:
+            db.session.delete(like)
+        else:
+            db.session.add(cls(user_id=user_id, message_id=message_id))
+        db.session.flush()
+
+        return like is None
+
+
+def username_sort_key(username):
+    """Lowercased `username` in byte order, as user search sorts it."""
+
+    return db.func.lower(username).collate('C')
+
+
+def user_search_vector(username, bio, location):
+    """PostgreSQL full-text vector over a user's searchable fields."""
+
+    def field(column):
+        return db.func.coalesce(column, '')
+
+    return db.func.to_tsvector(
+        db.literal_column("'simple'"),
+        field(username) + ' ' + field(bio) + ' ' + field(location))
+
 
 class User(db.Model):
     """User in the system."""
@@ -94,6 +206,52 @@ class User(db.Model):
         nullable=False,
     )
 
+    # Denormalized counts, kept in step by the flush listeners at the bottom
+    # of this module so profile stats never load the related rows.
+
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # Bumped whenever the username or avatar changes, so cached message
+    # fragments showing the old ones are no longer used.
+    profile_version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # Set when the account is deleted; it is hidden from then on, while
+    # deletion.py removes its rows a chunk at a time.
+    deleted_at = db.Column(
+        db.DateTime,
+    )
+
     messages = db.relationship('Message')
 
     followers = db.relationship(
@@ -115,20 +273,64 @@ class User(db.Model):
         secondary="likes"
     )
 
+    # User search indexes (see search.py). Both use PostgreSQL-only
+    # expressions; other databases fall back to an in-process index.
+    __table_args__ = (
+        db.Index('ix_users_username_sort',
+                 username_sort_key(username)).ddl_if(dialect='postgresql'),
+        db.Index('ix_users_search_vector',
+                 user_search_vector(username, bio, location),
+                 postgresql_using='gin').ddl_if(dialect='postgresql'),
+    )
+
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
+    def liked_message_ids(self, message_ids):
+        """Which of `message_ids` has this user liked?
+
+        Answers for a whole page of messages with one query and returns a
+        set, so templates can test membership without loading `likes`.
+        """
+
+        if not message_ids:
+            return set()
+
+        return set(db.session.scalars(
+            db.select(Likes.message_id)
+            .where(Likes.user_id == self.id)
+            .where(Likes.message_id.in_(message_ids))))
+
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return db.session.scalar(db.select(db.exists().where(
+            Follows.user_being_followed_id == self.id,
+            Follows.user_following_id == other_user.id,
+        )))
 
     def is_following(self, other_user):
-        """Is this user following `other_use`?"""
+        """Is this user following `other_user`?"""
+
+        return db.session.scalar(db.select(db.exists().where(
+            Follows.user_following_id == self.id,
+            Follows.user_being_followed_id == other_user.id,
+        )))
+
+    def following_ids(self, user_ids):
+        """Which of `user_ids` is this user following?
+
+        Answers for a whole page of users with one primary-key lookup and
+        returns a set, so templates can test membership per card.
+        """
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        if not user_ids:
+            return set()
+
+        return set(db.session.scalars(
+            db.select(Follows.user_being_followed_id)
+            .where(Follows.user_following_id == self.id)
+            .where(Follows.user_being_followed_id.in_(user_ids))))
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -137,7 +339,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.hash(password)
 
         user = User(
             username=username,
@@ -158,13 +360,18 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        If the user's hash was made with an old work factor, it is replaced
+        with a fresh one (the caller commits).
         """
 
-        user = cls.query.filter_by(username=username).first()
+        user = cls.query.filter_by(username=username, deleted_at=None).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = hasher.check(user.password, password)
             if is_auth:
+                if hasher.needs_rehash(user.password):
+                    user.password = hasher.hash(password)
                 return user
 
         return False
@@ -188,7 +395,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     user_id = db.Column(
@@ -199,6 +406,270 @@ class Message(db.Model):
 
     user = db.relationship('User')
 
+    __table_args__ = (
+        db.Index('ix_messages_user_id_timestamp', 'user_id', 'timestamp', 'id'),
+    )
+
+
+def live_authors(query):
+    """Load the author of each message in `query` (a Query or select()),
+    leaving out messages whose author has been deleted."""
+
+    return (query
+            .join(Message.user)
+            .filter(User.deleted_at.is_(None))
+            .options(db.contains_eager(Message.user)))
+
+
+class TimelineEntry(db.Model):
+    """A message materialized into one user's home timeline.
+
+    Rows are written when a message is posted (fan-out on write), so the
+    homepage reads a single user's slice of this table instead of joining
+    messages against everyone they follow.
+    """
+
+    __tablename__ = 'timelines'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    author_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_timelines_user_id_timestamp',
+                 'user_id', 'timestamp', 'message_id'),
+        db.Index('ix_timelines_author_id_user_id', 'author_id', 'user_id'),
+        db.Index('ix_timelines_message_id', 'message_id'),
+    )
+
+
+class MessageTerm(db.Model):
+    """One distinct word of a message, for full-text message search.
+
+    The primary key lets a search walk one word's messages newest first
+    with an index range scan; see search.py.
+    """
+
+    __tablename__ = 'message_terms'
+
+    term = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    __table_args__ = (
+        db.Index('ix_message_terms_message_id', 'message_id'),
+    )
+
+
+class Job(db.Model):
+    """A side effect queued to run outside the request; see jobs.py.
+
+    Rows are deleted once the job has run. A job that keeps failing is
+    kept, with `failed_at` set, for someone to look at.
+    """
+
+    __tablename__ = 'jobs'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    kind = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    payload = db.Column(
+        db.JSON,
+        nullable=False,
+    )
+
+    # At most one pending job per key; see jobs.enqueue.
+    idempotency_key = db.Column(
+        db.Text,
+        unique=True,
+    )
+
+    run_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    last_error = db.Column(
+        db.Text,
+    )
+
+    failed_at = db.Column(
+        db.DateTime,
+    )
+
+    __table_args__ = (
+        db.Index('ix_jobs_run_at', 'run_at', 'id'),
+    )
+
+
+class Recommendation(db.Model):
+    """An account suggested for a user to follow.
+
+    Written in bulk by `flask recommend-follows` (see recommendations.py);
+    `rank` 0 is the best suggestion. The primary key lets the homepage
+    read one user's suggestions with an index range scan.
+    """
+
+    __tablename__ = 'recommendations'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    rank = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    recommended_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    # How many of the accounts the user follows follow this one
+    mutuals = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_recommendations_recommended_id', 'recommended_id'),
+    )
+
+
+def who_to_follow(user_id, limit=5):
+    """Select the users recommended to `user_id`, best first.
+
+    Leaves out accounts deleted, or followed, since the recommendations
+    were computed.
+    """
+
+    return (db.select(User)
+            .join(Recommendation, Recommendation.recommended_id == User.id)
+            .where(Recommendation.user_id == user_id)
+            .where(User.deleted_at.is_(None))
+            .where(~db.exists().where(
+                Follows.user_following_id == user_id,
+                Follows.user_being_followed_id == User.id))
+            .order_by(Recommendation.rank)
+            .limit(limit))
+
+
+##############################################################################
+# Counter maintenance
+#
+# Inserting or deleting Message, Follows and Likes rows through the ORM
+# adjusts the owning users' counters with an UPDATE on the flush's own
+# connection, so the counts commit (or roll back) with the rows themselves.
+# Bulk/core statements bypass these hooks; `flask reconcile-counters`
+# recomputes everything from the underlying tables.
+
+
+def adjust_counters(connection, user_id, **deltas):
+    """Add `deltas` (e.g. followers_count=1) to a user's counters."""
+
+    users = User.__table__
+    connection.execute(
+        users.update()
+        .where(users.c.id == user_id)
+        .values({users.c[name]: users.c[name] + delta
+                 for name, delta in deltas.items()}))
+
+
+@event.listens_for(Message, 'after_insert')
+def count_new_message(mapper, connection, target):
+    adjust_counters(connection, target.user_id, messages_count=1)
+
+
+@event.listens_for(Message, 'before_delete')
+def count_cascaded_likes(mapper, connection, target):
+    # The database cascades the message's likes away; uncount them first.
+    users = User.__table__
+    likes = Likes.__table__
+    connection.execute(
+        users.update()
+        .where(users.c.id.in_(
+            db.select(likes.c.user_id)
+            .where(likes.c.message_id == target.id)))
+        .values({users.c.likes_count: users.c.likes_count - 1}))
+
+
+@event.listens_for(Message, 'after_delete')
+def count_deleted_message(mapper, connection, target):
+    adjust_counters(connection, target.user_id, messages_count=-1)
+
+
+@event.listens_for(Follows, 'after_insert')
+def count_new_follow(mapper, connection, target):
+    adjust_counters(connection, target.user_following_id, following_count=1)
+    adjust_counters(connection, target.user_being_followed_id,
+                    followers_count=1)
+
+
+@event.listens_for(Follows, 'after_delete')
+def count_deleted_follow(mapper, connection, target):
+    adjust_counters(connection, target.user_following_id, following_count=-1)
+    adjust_counters(connection, target.user_being_followed_id,
+                    followers_count=-1)
+
+
+@event.listens_for(Likes, 'after_insert')
+def count_new_like(mapper, connection, target):
+    adjust_counters(connection, target.user_id, likes_count=1)
+
+
+@event.listens_for(Likes, 'after_delete')
+def count_deleted_like(mapper, connection, target):
+    adjust_counters(connection, target.user_id, likes_count=-1)
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
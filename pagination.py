@@ -0,0 +1,135 @@
+"""Keyset (cursor) pagination for message lists.
+
+Pages are keyed on `(timestamp, id)` instead of using OFFSET, so fetching a
+page deep in someone's history costs the same index range scan as fetching
+the first one. Cursors are opaque to clients: a URL-safe base64 encoding of
+the key of the first or last message on a page.
+"""
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as Base64Error
+from datetime import datetime
+
+from models import db
+
+PER_PAGE = 100
+
+
+class Page:
+    """One page of results plus cursors for the neighbouring pages.
+
+    `older` / `newer` are None when there is nothing further in that
+    direction.
+    """
+
+    def __init__(self, items, older=None, newer=None):
+        self.items = items
+        self.older = older
+        self.newer = newer
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(timestamp, id):
+    """Turn a `(timestamp, id)` key into an opaque cursor string."""
+
+    raw = f"{timestamp.isoformat()}|{id}".encode('UTF-8')
+    return urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Turn a cursor string back into a `(timestamp, id)` key.
+
+    Raises ValueError if the cursor is malformed.
+    """
+
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        raw = urlsafe_b64decode(padded.encode('ascii')).decode('UTF-8')
+        timestamp, id = raw.split('|')
+        return datetime.fromisoformat(timestamp), int(id)
+    except (Base64Error, UnicodeError, ValueError) as exc:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from exc
+
+
+def paginate(query, timestamp_col, id_col, before=None, after=None,
+             per_page=PER_PAGE):
+    """Return a Page of `query`, newest first, keyed on the given columns.
+
+    `before` returns the page of items older than that cursor and `after`
+    the page of items newer than it; with neither, returns the newest page.
+    Items must expose `.timestamp` and `.id` matching the key columns.
+    """
+
+    if after:
+        rows = _newer(query, timestamp_col, id_col, after, per_page).all()
+        if rows:
+            return _newer_page(rows, per_page)
+
+        # Nothing newer than the cursor any more; show the newest page.
+        before = None
+
+    rows = _older(query, timestamp_col, id_col, before, per_page).all()
+    return _older_page(rows, before, per_page)
+
+
+async def paginate_async(session, select, timestamp_col, id_col, before=None,
+                         after=None, per_page=PER_PAGE):
+    """Like `paginate`, for a `select()` run on an AsyncSession."""
+
+    if after:
+        rows = (await session.scalars(
+            _newer(select, timestamp_col, id_col, after, per_page))).all()
+        if rows:
+            return _newer_page(rows, per_page)
+
+        before = None
+
+    rows = (await session.scalars(
+        _older(select, timestamp_col, id_col, before, per_page))).all()
+    return _older_page(rows, before, per_page)
+
+
+# Queries and selects both have filter/order_by/limit, so the two
+# paginate functions share these and differ only in running them.
+
+def _newer(query, timestamp_col, id_col, after, per_page):
+    key = db.tuple_(timestamp_col, id_col)
+    return (query
+            .filter(key > decode_cursor(after))
+            .order_by(timestamp_col.asc(), id_col.asc())
+            .limit(per_page + 1))
+
+
+def _older(query, timestamp_col, id_col, before, per_page):
+    if before:
+        key = db.tuple_(timestamp_col, id_col)
+        query = query.filter(key < decode_cursor(before))
+
+    return (query
+            .order_by(timestamp_col.desc(), id_col.desc())
+            .limit(per_page + 1))
+
+
+def _newer_page(rows, per_page):
+    has_newer = len(rows) > per_page
+    items = list(reversed(rows[:per_page]))
+    return Page(items,
+                older=_cursor_for(items[-1]),
+                newer=_cursor_for(items[0]) if has_newer else None)
+
+
+def _older_page(rows, before, per_page):
+    items = rows[:per_page]
+    has_older = len(rows) > per_page
+    return Page(items,
+                older=_cursor_for(items[-1]) if has_older else None,
+                newer=_cursor_for(items[0]) if before and items else None)
+
+
+def _cursor_for(item):
+    return encode_cursor(item.timestamp, item.id)
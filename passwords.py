@@ -0,0 +1,170 @@
+"""Password hashing off the request thread.
+
+bcrypt is deliberately slow, so hashing and checking passwords inline lets
+a burst of logins occupy every web worker. `hasher` runs that work in a
+small process pool instead, and refuses new work (raising PoolBusy) once
+`PASSWORD_POOL_QUEUE` jobs are already waiting, rather than letting
+requests pile up behind it. If a pool process dies (say, to the OOM
+killer), the pool is replaced and the work retried once.
+
+Configuration (read by `hasher.init_app`):
+
+  BCRYPT_LOG_ROUNDS    work factor for new hashes (default 12)
+  PASSWORD_POOL_SIZE   worker processes; 0 hashes inline (default 2)
+  PASSWORD_POOL_QUEUE  jobs allowed in flight before PoolBusy (default 32)
+  PASSWORD_POOL_WAIT   seconds to wait for a queue slot (default 1)
+
+Hashes made with a different work factor still verify; `needs_rehash`
+tells the caller to replace them after a successful login.
+"""
+
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+
+
+class PoolBusy(Exception):
+    """Raised when the hashing queue is full."""
+
+
+def hash_password(password, rounds):
+    """Return a bcrypt hash of `password` (runs in a pool process)."""
+
+    return bcrypt.hashpw(password.encode('UTF-8'),
+                         bcrypt.gensalt(rounds)).decode('UTF-8')
+
+
+def check_password(hashed, password):
+    """Does `password` match `hashed`? (runs in a pool process)"""
+
+    return bcrypt.checkpw(password.encode('UTF-8'), hashed.encode('UTF-8'))
+
+
+def hash_rounds(hashed):
+    """Return the work factor a bcrypt hash was made with."""
+
+    return int(hashed.split('$')[2])
+
+
+class PasswordHasher:
+    """Hashes and checks passwords in a bounded process pool."""
+
+    def __init__(self, rounds=12, pool_size=2, max_queue=32, wait=1.0):
+        self.rounds = rounds
+        self.pool_size = pool_size
+        self.max_queue = max_queue
+        self.wait = wait
+
+        self.executor = None
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(max_queue)
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+        # Called with (operation name, seconds) after each hash or check.
+        self.timers = []
+
+    def init_app(self, app):
+        """Read settings from `app.config`."""
+
+        self.rounds = app.config.setdefault('BCRYPT_LOG_ROUNDS', 12)
+        self.pool_size = app.config.setdefault('PASSWORD_POOL_SIZE', 2)
+        self.max_queue = app.config.setdefault('PASSWORD_POOL_QUEUE', 32)
+        self.wait = app.config.setdefault('PASSWORD_POOL_WAIT', 1.0)
+        self.slots = threading.BoundedSemaphore(self.max_queue)
+
+    def hash(self, password):
+        """Return a hash of `password` at the configured work factor."""
+
+        if not password:
+            raise ValueError("Password must be non-empty.")
+
+        return self._run(hash_password, password, self.rounds)
+
+    def check(self, hashed, password):
+        """Does `password` match `hashed`?"""
+
+        if not password:
+            return False
+
+        return self._run(check_password, hashed, password)
+
+    def needs_rehash(self, hashed):
+        """Was `hashed` made with a different work factor than configured?"""
+
+        return hash_rounds(hashed) != self.rounds
+
+    def stats(self):
+        """Return a dict of queue depth and latency figures."""
+
+        with self.lock:
+            return {
+                'pool_size': self.pool_size,
+                'max_queue': self.max_queue,
+                'in_flight': self.in_flight,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'mean_seconds': (self.total_seconds / self.completed
+                                 if self.completed else None),
+                'max_seconds': self.max_seconds,
+            }
+
+    def _run(self, fn, *args):
+        if not self.slots.acquire(timeout=self.wait):
+            with self.lock:
+                self.rejected += 1
+            raise PoolBusy("Too many password checks in progress.")
+
+        with self.lock:
+            self.in_flight += 1
+        started = time.perf_counter()
+
+        try:
+            if self.pool_size:
+                return self._submit(fn, *args)
+            return fn(*args)
+
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.in_flight -= 1
+                self.completed += 1
+                self.total_seconds += elapsed
+                self.max_seconds = max(self.max_seconds, elapsed)
+            self.slots.release()
+
+            for timer in self.timers:
+                timer(fn.__name__, elapsed)
+
+    def _submit(self, fn, *args):
+        for attempt in range(2):
+            executor = self._executor()
+            try:
+                return executor.submit(fn, *args).result()
+            except BrokenProcessPool as exc:
+                # One dead process breaks the whole pool, for good; start
+                # another for this and later calls.
+                with self.lock:
+                    if self.executor is executor:
+                        self.executor = None
+                executor.shutdown(wait=False)
+                error = exc
+
+        raise PoolBusy("Password hashing processes keep dying.") from error
+
+    def _executor(self):
+        # Started on first use, so each web worker process gets its own
+        # pool after the server has forked.
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(self.pool_size)
+            return self.executor
+
+
+hasher = PasswordHasher()
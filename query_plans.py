@@ -0,0 +1,143 @@
+"""Check that the hot routes' queries are served by indexes.
+
+`check(app)` requests each hot route as a real user, captures the SELECTs
+it runs, and EXPLAINs each one with sequential scans disabled. The planner
+then only falls back to a Seq Scan when no index can serve the query at
+all, so any that remain, or index scans whose condition doesn't constrain
+the index's first column (and so read all of it), point to a missing
+index. PostgreSQL only.
+
+    flask check-query-plans
+"""
+
+import functools
+import json
+
+from sqlalchemy import event, select, text
+
+from models import db, User, Message
+
+INDEX_SCANS = ('Index Scan', 'Index Only Scan', 'Bitmap Index Scan')
+
+
+def hot_routes():
+    """Return the paths to check, for users and messages in the database."""
+
+    viewer = db.session.scalar(
+        select(User.id).order_by(User.following_count.desc(), User.id)
+        .limit(1))
+    popular = db.session.scalar(
+        select(User.id).order_by(User.followers_count.desc(), User.id)
+        .limit(1))
+    message = db.session.execute(
+        select(Message.id, Message.text).order_by(Message.id).limit(1)).first()
+
+    if viewer is None or message is None:
+        return viewer, []
+
+    username = db.session.get(User, popular).username
+    word = message.text.split()[0] if message.text.split() else 'a'
+
+    return viewer, [
+        '/',
+        f'/users/{popular}',
+        '/users',
+        f'/users?q={username[:3]}',
+        f'/users/{popular}/followers',
+        f'/users/{viewer}/following',
+        f'/users/{viewer}/likes',
+        f'/messages/{message.id}',
+        f'/messages/search?q={word}',
+    ]
+
+
+def full_scans(plan, ordered=False):
+    """Yield a description of each scan in `plan` that reads a whole table.
+
+    An index read in order to feed a LIMIT or a merge join may legitimately
+    have no condition; it stops (or is needed) anyway.
+    """
+
+    node = plan['Node Type']
+
+    if node == 'Seq Scan':
+        yield f"Seq Scan on {plan['Relation Name']}"
+    elif node in INDEX_SCANS and not ordered:
+        leading = leading_column(plan['Index Name'])
+        if leading not in plan.get('Index Cond', ''):
+            yield f"{node} on {plan['Index Name']} not using {leading}"
+
+    ordered = ordered or node in ('Limit', 'Merge Join')
+    for child in plan.get('Plans', ()):
+        yield from full_scans(child, ordered)
+
+
+@functools.lru_cache
+def leading_column(index_name):
+    """Return the first column (or expression) of index `index_name`.
+
+    A condition only narrows a B-tree scan if it constrains this.
+    """
+
+    return db.session.scalar(text(
+        "SELECT pg_get_indexdef(indexrelid, 1, true) FROM pg_index "
+        "WHERE indexrelid = CAST(:name AS regclass)"), {'name': index_name})
+
+
+def explain(statement, parameters):
+    """Return the JSON plan of `statement` with sequential scans disabled."""
+
+    with db.engine.connect() as connection:
+        connection.exec_driver_sql('SET enable_seqscan = off')
+        result = connection.exec_driver_sql(
+            f'EXPLAIN (FORMAT JSON) {statement}', parameters).scalar()
+        connection.rollback()
+
+    if isinstance(result, str):
+        result = json.loads(result)
+    return result[0]['Plan']
+
+
+def check(app, user_key, report=print):
+    """EXPLAIN every hot route's queries; return the problems found.
+
+    Routes are requested as a logged-in user, by storing their id under
+    `user_key` in the session.
+    """
+
+    if db.engine.dialect.name != 'postgresql':
+        raise RuntimeError("Query plans can only be checked on PostgreSQL.")
+
+    viewer, paths = hot_routes()
+    if not paths:
+        raise RuntimeError("The database needs users and messages to check.")
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess[user_key] = viewer
+
+    problems = []
+    for path in paths:
+        statements = {}
+
+        def capture(conn, cursor, statement, parameters, context,
+                    executemany):
+            if statement.lstrip().upper().startswith('SELECT'):
+                statements.setdefault(statement, parameters)
+
+        event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            client.get(path)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', capture)
+
+        found = [(scan, statement)
+                 for statement, parameters in statements.items()
+                 for scan in full_scans(explain(statement, parameters))]
+        report(f"{path}: {len(statements)} queries, "
+               f"{len(found)} full scans")
+        for scan, statement in found:
+            report(f"  {scan}\n    {' '.join(statement.split())}")
+            problems.append((path, scan, statement))
+
+    return problems
@@ -0,0 +1,104 @@
+"""Route read-only pages' queries to read replicas.
+
+Views decorated with `@replica_reads` send their SELECTs, on GET and HEAD
+requests, to a randomly chosen replica. Everything else, including any
+write such a view makes and anything it reads after, goes to the primary.
+
+Replicas lag the primary a little, so once a browser session has written,
+its requests stay on the primary for REPLICA_STICKY_SECONDS; people see
+their own new warbles, follows and likes straight away.
+
+Configuration:
+
+  SQLALCHEMY_BINDS         replicas are the binds named replica0, replica1..
+                           (see `binds`)
+  REPLICA_STICKY_SECONDS   how long a session stays on the primary after
+                           writing (default 5)
+"""
+
+import random
+import time
+
+from flask import g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+STICKY_KEY = 'primary_until'
+
+
+def binds(urls):
+    """Return SQLALCHEMY_BINDS entries for comma-separated replica `urls`."""
+
+    return {f'replica{i}': url.strip()
+            for i, url in enumerate(urls.split(','))
+            if url.strip()}
+
+
+def replica_reads(view):
+    """Mark `view` as only reading, so it can be served from a replica."""
+
+    view.replica_reads = True
+    return view
+
+
+class RoutingSession(Session):
+    """A session that reads from the replica chosen for this request."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = g.get('db_replica') if has_request_context() else None
+
+        if (replica is not None and bind is None and not self._flushing
+                and clause is not None and clause.is_select
+                and not g.get('db_wrote')):
+            return self._db.engines[replica]
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind,
+                                **kwargs)
+
+
+def init_app(app, db):
+    """Route `app`'s replica_reads views to its replica binds."""
+
+    app.config.setdefault('REPLICA_STICKY_SECONDS', 5)
+
+    replicas = sorted(key for key in app.config.get('SQLALCHEMY_BINDS', {})
+                      if key.startswith('replica'))
+
+    event.listen(RoutingSession, 'after_flush', _wrote)
+    event.listen(RoutingSession, 'do_orm_execute', _executed)
+
+    @app.before_request
+    def choose_database():
+        g.db_wrote = False
+        g.db_replica = None
+
+        view = app.view_functions.get(request.endpoint)
+        if (replicas and request.method in ('GET', 'HEAD')
+                and getattr(view, 'replica_reads', False)
+                and session.get(STICKY_KEY, 0) < time.time()):
+            g.db_replica = random.choice(replicas)
+
+    @app.after_request
+    def stick_to_primary(response):
+        if g.get('db_wrote'):
+            session[STICKY_KEY] = (time.time()
+                                   + app.config['REPLICA_STICKY_SECONDS'])
+        return response
+
+    @app.teardown_request
+    def end_replica_transaction(exc):
+        # Don't hold a transaction open on the replica between requests.
+        if g.get('db_replica') is not None:
+            db.session.rollback()
+
+
+def _wrote(session, flush_context):
+    if has_request_context():
+        g.db_wrote = True
+
+
+def _executed(state):
+    # Core INSERT/UPDATE/DELETE run through the session don't flush.
+    if has_request_context() and (
+            state.is_insert or state.is_update or state.is_delete):
+        g.db_wrote = True
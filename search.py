@@ -0,0 +1,393 @@
+"""Search for users (the /users page) and messages (/messages/search).
+
+User results are ranked in tiers and paged with opaque keyset cursors:
+
+  0. usernames starting with the query
+  1. other users whose username, bio or location has a word starting with
+     each of the query's words
+
+Within a tier users are ordered by lowercased username, then id.
+
+On PostgreSQL each tier is answered from an index (a byte-ordered btree on
+lower(username) and a GIN full-text index; see models.py), so a page costs
+an index scan no matter how large the users table is. Other databases
+(SQLite in development) use an inverted index built in-process on first
+use. It sees changes made through this worker at once, via `index_user`
+and `unindex_user`; it is rebuilt once it is USER_INDEX_TTL seconds old
+(default 60), so with several workers, changes made through the others
+show up within that time.
+
+Message search uses the `message_terms` table, an inverted index with one
+row per distinct word per message, kept up to date by `index_message` and
+`unindex_message`. A search walks the postings of one query word newest
+first and checks the others by primary key, so it never scans `messages`.
+"""
+
+import json
+import re
+import threading
+import time
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from bisect import bisect_left, insort
+from binascii import Error as Base64Error
+from collections import defaultdict
+
+from flask import current_app
+from sqlalchemy import and_, delete, func, insert, literal_column, not_, select
+
+from models import (
+    db, User, Message, MessageTerm, live_authors, username_sort_key,
+    user_search_vector,
+)
+from pagination import Page, paginate
+
+USERS_PER_PAGE = 30
+
+WORD_RE = re.compile(r'\w+')
+
+# Longer "words" are almost always URLs or noise; don't index them.
+MAX_TERM_LENGTH = 64
+
+REINDEX_CHUNK_SIZE = 1000
+
+
+class ResultPage:
+    """One page of users plus the cursor for the next page (or None)."""
+
+    def __init__(self, users, next=None):
+        self.users = users
+        self.next = next
+
+    def __iter__(self):
+        return iter(self.users)
+
+    def __len__(self):
+        return len(self.users)
+
+
+def search_users(query, after=None, per_page=USERS_PER_PAGE):
+    """Return a ResultPage of users matching `query`.
+
+    Raises ValueError if `after` is not a cursor from a previous page.
+    """
+
+    query = query.strip().lower()
+    start = _decode_cursor(after) if after else None
+
+    if db.engine.dialect.name == 'postgresql':
+        hits = _search_postgres(query, start, per_page + 1)
+    else:
+        index = _memory_index(current_app.config['USER_INDEX_TTL'])
+        hits = index.search(query, start, per_page + 1)
+
+    return _page(hits, per_page)
+
+
+def list_users(after=None, per_page=USERS_PER_PAGE):
+    """Return a ResultPage of all users in id order."""
+
+    start = _decode_cursor(after) if after else None
+
+    users = User.query.filter(User.deleted_at.is_(None)).order_by(User.id)
+    if start:
+        users = users.filter(User.id > start[2])
+    hits = [(0, '', user.id, user) for user in users.limit(per_page + 1)]
+
+    return _page(hits, per_page)
+
+
+def index_user(user):
+    """Bring the in-process index up to date after `user` changed."""
+
+    if _index is not None:
+        _index.add(user.id, user.username, user.bio, user.location)
+
+
+def unindex_user(user_id):
+    """Drop a deleted user from the in-process index."""
+
+    if _index is not None:
+        _index.remove(user_id)
+
+
+##############################################################################
+# PostgreSQL
+
+
+def _search_postgres(query, start, limit):
+    """Return up to `limit` (tier, sort key, id, user) hits after `start`."""
+
+    sort_key = username_sort_key(User.username)
+    prefix = sort_key.like(_escape_like(query) + '%', escape='\\')
+
+    tiers = [prefix]
+    words = WORD_RE.findall(query)
+    if words:
+        tsquery = func.to_tsquery(
+            literal_column("'simple'"),
+            ' & '.join(f"{word}:*" for word in words))
+        vector = user_search_vector(User.username, User.bio, User.location)
+        tiers.append(and_(vector.op('@@')(tsquery), not_(prefix)))
+
+    first_tier = start[0] if start else 0
+    if first_tier not in range(len(tiers)):
+        raise ValueError(f"Invalid cursor tier: {first_tier}")
+    hits = []
+    for tier in range(first_tier, len(tiers)):
+        rows = (db.session.query(User, sort_key)
+                .filter(tiers[tier])
+                .filter(User.deleted_at.is_(None)))
+        if start and tier == first_tier:
+            rows = rows.filter(
+                db.tuple_(sort_key, User.id) > (start[1], start[2]))
+        rows = rows.order_by(sort_key, User.id).limit(limit - len(hits))
+
+        hits.extend((tier, key, user.id, user) for user, key in rows)
+        if len(hits) >= limit:
+            break
+
+    return hits
+
+
+def _escape_like(text):
+    return (text.replace('\\', '\\\\')
+            .replace('%', '\\%')
+            .replace('_', '\\_'))
+
+
+##############################################################################
+# In-process fallback
+
+
+class InvertedIndex:
+    """Word-prefix inverted index over usernames, bios and locations."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.names = []                  # sorted (lowercased username, id)
+        self.docs = {}                   # id -> (lowercased username, words)
+        self.postings = defaultdict(set)  # word -> ids
+        self.vocabulary = []             # sorted words
+
+    def add(self, id, username, bio, location):
+        with self.lock:
+            self._remove(id)
+
+            name = username.lower()
+            words = set(WORD_RE.findall(
+                ' '.join(filter(None, [username, bio, location])).lower()))
+
+            self.docs[id] = (name, words)
+            insort(self.names, (name, id))
+            for word in words:
+                if not self.postings[word]:
+                    insort(self.vocabulary, word)
+                self.postings[word].add(id)
+
+    def remove(self, id):
+        with self.lock:
+            self._remove(id)
+
+    def _remove(self, id):
+        if id not in self.docs:
+            return
+
+        name, words = self.docs.pop(id)
+        del self.names[bisect_left(self.names, (name, id))]
+        for word in words:
+            self.postings[word].discard(id)
+            if not self.postings[word]:
+                del self.postings[word]
+                del self.vocabulary[bisect_left(self.vocabulary, word)]
+
+    def search(self, query, start, limit):
+        """Return up to `limit` (tier, sort key, id, user) hits after `start`."""
+
+        with self.lock:
+            prefixed = []
+            for name, id in self.names[bisect_left(self.names, (query,)):]:
+                if not name.startswith(query):
+                    break
+                prefixed.append((0, name, id))
+
+            words = WORD_RE.findall(query)
+            if start and start[0] not in range(2 if words else 1):
+                raise ValueError(f"Invalid cursor tier: {start[0]}")
+            matched = set.intersection(
+                *(self._word_prefix_ids(word) for word in words)
+            ) if words else set()
+            prefix_ids = {id for _, _, id in prefixed}
+            rest = sorted((1, self.docs[id][0], id)
+                          for id in matched - prefix_ids)
+
+        keys = prefixed + rest
+        if start:
+            keys = keys[bisect_left(keys, tuple(start)):]
+            if keys and keys[0] == tuple(start):
+                keys = keys[1:]
+        keys = keys[:limit]
+
+        users = (User.query
+                 .filter(User.id.in_([id for _, _, id in keys]))
+                 .filter(User.deleted_at.is_(None)))
+        by_id = {user.id: user for user in users}
+
+        return [(tier, key, id, by_id[id])
+                for tier, key, id in keys if id in by_id]
+
+    def _word_prefix_ids(self, prefix):
+        ids = set()
+        for word in self.vocabulary[bisect_left(self.vocabulary, prefix):]:
+            if not word.startswith(prefix):
+                break
+            ids |= self.postings[word]
+        return ids
+
+
+_index = None
+_index_built = 0.0
+_index_lock = threading.Lock()
+
+
+def _memory_index(ttl):
+    """Return this worker's inverted index, building it on first use and
+    again once it is `ttl` seconds old."""
+
+    global _index, _index_built
+
+    with _index_lock:
+        if _index is None or time.monotonic() - _index_built > ttl:
+            index = InvertedIndex()
+            rows = db.session.execute(
+                select(User.id, User.username, User.bio, User.location)
+                .execution_options(yield_per=1000))
+            for row in rows:
+                index.add(*row)
+            _index, _index_built = index, time.monotonic()
+
+    return _index
+
+
+##############################################################################
+# Message search
+
+
+def message_terms(text):
+    """Return the set of searchable words in a message's text."""
+
+    return {word for word in WORD_RE.findall(text.lower())
+            if len(word) <= MAX_TERM_LENGTH}
+
+
+def index_message(msg):
+    """Add a flushed message's words to the index. Does not commit."""
+
+    rows = [{'term': term, 'timestamp': msg.timestamp, 'message_id': msg.id}
+            for term in message_terms(msg.text)]
+    if rows:
+        db.session.execute(insert(MessageTerm), rows)
+
+
+def unindex_message(message_id):
+    """Remove a message's words from the index. Does not commit."""
+
+    db.session.execute(
+        delete(MessageTerm).where(MessageTerm.message_id == message_id))
+
+
+def search_messages(query, before=None, after=None, **kwargs):
+    """Return a pagination Page of messages containing every word in `query`.
+
+    Newest first; `before`/`after` are cursors as in pagination.paginate.
+    """
+
+    terms = sorted(message_terms(query), key=len, reverse=True)
+    if not terms:
+        return Page([])
+
+    # Walk the postings of the longest word (usually the rarest) and check
+    # each remaining word with a primary-key lookup.
+    driver, *others = terms
+    matches = live_authors(Message
+                           .query
+                           .join(MessageTerm,
+                                 MessageTerm.message_id == Message.id)
+                           .filter(MessageTerm.term == driver))
+
+    for term in others:
+        other = db.aliased(MessageTerm)
+        matches = matches.filter(
+            select(other.message_id)
+            .where(other.term == term)
+            .where(other.timestamp == MessageTerm.timestamp)
+            .where(other.message_id == MessageTerm.message_id)
+            .exists())
+
+    return paginate(matches, MessageTerm.timestamp, MessageTerm.message_id,
+                    before=before, after=after, **kwargs)
+
+
+def reindex_messages(chunk_size=REINDEX_CHUNK_SIZE):
+    """Rebuild `message_terms` from every message, in id-ordered chunks.
+
+    Returns the number of messages indexed.
+    """
+
+    db.session.execute(delete(MessageTerm))
+    db.session.commit()
+
+    indexed = 0
+    last_id = 0
+    while True:
+        chunk = (db.session.execute(
+            select(Message.id, Message.text, Message.timestamp)
+            .where(Message.id > last_id)
+            .order_by(Message.id)
+            .limit(chunk_size))
+            .all())
+        if not chunk:
+            return indexed
+
+        rows = [{'term': term, 'timestamp': timestamp, 'message_id': id}
+                for id, text, timestamp in chunk
+                for term in message_terms(text)]
+        if rows:
+            db.session.execute(insert(MessageTerm), rows)
+        db.session.commit()
+
+        indexed += len(chunk)
+        last_id = chunk[-1].id
+
+
+##############################################################################
+# Cursors
+
+
+def _page(hits, per_page):
+    """Turn per_page + 1 user hits into a ResultPage."""
+
+    next = None
+    if len(hits) > per_page:
+        tier, key, id, _ = hits[per_page - 1]
+        next = _encode_cursor(tier, key, id)
+
+    return ResultPage([user for _, _, _, user in hits[:per_page]], next=next)
+
+
+def _encode_cursor(tier, key, id):
+    raw = json.dumps([tier, key, id]).encode('UTF-8')
+    return urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        tier, key, id = json.loads(urlsafe_b64decode(padded.encode('ascii')))
+    except (Base64Error, UnicodeError, ValueError, TypeError) as exc:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from exc
+
+    if not (isinstance(tier, int) and isinstance(key, str)
+            and isinstance(id, int)):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+    return tier, key, id
@@ -1,20 +1,28 @@
-"""Seed database with sample data from CSV Files."""
+"""Seed database with sample data from CSV Files.
 
-from csv import DictReader
-from app import db
-from models import User, Message, Follows
+    python seed.py                  # load generator/*.csv from scratch
+    python seed.py --resume         # finish an interrupted load
 
+See loader.py for how the load works.
+"""
 
-db.drop_all()
-db.create_all()
+import argparse
+import sys
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
+from app import create_app
+from loader import CHUNK_SIZE, LoadError, load
 
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--dir', default='generator',
+                    help="directory holding users/messages/follows.csv")
+parser.add_argument('--resume', action='store_true',
+                    help="continue an interrupted load instead of starting over")
+parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                    help="rows per transaction")
+args = parser.parse_args()
 
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(Follows, DictReader(follows))
-
-db.session.commit()
+with create_app('production').app_context():
+    try:
+        load(args.dir, resume=args.resume, chunk_size=args.chunk_size)
+    except LoadError as exc:
+        sys.exit(str(exc))
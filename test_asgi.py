@@ -0,0 +1,179 @@
+"""Async read path tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_asgi.py
+
+
+import os
+from unittest import IsolatedAsyncioTestCase
+from urllib.parse import urlencode
+
+from models import db, Message, User, Likes, Follows, Recommendation
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import CURR_USER_KEY, identity_cache, fragment_cache
+from asgi import create_asgi_app
+import timelines
+
+asgi = create_asgi_app('production')
+app = asgi.app
+
+# The tests share one application context, so they can use db.session
+# outside requests.
+app.app_context().push()
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class AsyncReadsTestCase(IsolatedAsyncioTestCase):
+    """Test that the async views serve what the sync ones do."""
+
+    def setUp(self):
+        """A user who follows and likes an author's message."""
+
+        db.session.expunge_all()
+        db.drop_all()
+        db.create_all()
+        identity_cache.clear()
+        fragment_cache.clear()
+
+        viewer = User.signup("viewer", "viewer@test.com", "password", None)
+        author = User.signup("author", "author@test.com", "password", None)
+        db.session.commit()
+        db.session.add(Follows(user_being_followed_id=author.id,
+                               user_following_id=viewer.id))
+        msg = Message(text="Hello from the author", user_id=author.id)
+        db.session.add(msg)
+        db.session.flush()
+        timelines.fan_out(msg)
+        db.session.add(Likes(user_id=viewer.id, message_id=msg.id))
+        db.session.commit()
+
+        self.viewer_id = viewer.id
+        self.author_id = author.id
+        self.msg_id = msg.id
+
+        serializer = app.session_interface.get_signing_serializer(app)
+        self.cookie = serializer.dumps({CURR_USER_KEY: viewer.id})
+
+    async def asyncTearDown(self):
+        await asgi.dispose()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    async def request(self, path, method='GET', headers=(), form=None,
+                      logged_in=True):
+        """Send a request through the ASGI app; return (status, headers,
+        body)."""
+
+        path, _, query = path.partition('?')
+        headers = list(headers)
+        if logged_in:
+            headers.append((b'cookie', f'session={self.cookie}'.encode()))
+        body = b''
+        if form is not None:
+            body = urlencode(form).encode()
+            headers.append(
+                (b'content-type', b'application/x-www-form-urlencoded'))
+            headers.append((b'content-length', str(len(body)).encode()))
+
+        scope = {
+            'type': 'http', 'method': method, 'path': path,
+            'root_path': '', 'query_string': query.encode(),
+            'headers': headers, 'http_version': '1.1', 'scheme': 'http',
+            'server': ('localhost', 80), 'client': ('127.0.0.1', 1234),
+        }
+        sent = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            sent.append(message)
+
+        await asgi(scope, receive, send)
+
+        start, *bodies = sent
+        return (start['status'], dict(start['headers']),
+                b''.join(message.get('body', b'') for message in bodies))
+
+    async def test_pages_match_sync_views(self):
+        """Do the async views render exactly what the sync views do?"""
+
+        stranger = User.signup("stranger", "stranger@test.com", "password",
+                               None)
+        db.session.flush()
+        db.session.add(Recommendation(user_id=self.viewer_id, rank=0,
+                                      recommended_id=stranger.id, mutuals=1))
+        db.session.commit()
+
+        client = app.test_client()
+        client.set_cookie('localhost', 'session', self.cookie)
+
+        for path in ["/",
+                     f"/users/{self.author_id}",
+                     f"/users/{self.author_id}/followers",
+                     f"/users/{self.viewer_id}/following",
+                     f"/messages/{self.msg_id}"]:
+            with self.subTest(path=path):
+                status, _, body = await self.request(path)
+                resp = client.get(path)
+
+                self.assertEqual(status, 200)
+                self.assertEqual(body, resp.data)
+
+        status, _, body = await self.request("/")
+        self.assertIn(b"Hello from the author", body)
+        self.assertIn(b"@stranger", body)
+
+    async def test_anonymous(self):
+        """Do logged-out visitors get the anonymous pages?"""
+
+        status, _, body = await self.request("/", logged_in=False)
+        self.assertEqual(status, 200)
+        self.assertIn(b"Sign up", body)
+
+        status, headers, _ = await self.request(
+            f"/users/{self.author_id}/followers", logged_in=False)
+        self.assertEqual(status, 302)
+        self.assertEqual(headers[b'location'], b'/')
+        self.assertIn(b'session=', headers[b'set-cookie'])
+
+    async def test_errors(self):
+        """Are missing users and bad cursors the usual error pages?"""
+
+        status, _, body = await self.request("/users/999999")
+        self.assertEqual(status, 404)
+
+        status, _, _ = await self.request(
+            f"/users/{self.author_id}?before=nonsense")
+        self.assertEqual(status, 400)
+
+    async def test_not_modified(self):
+        """Does a matching If-None-Match get a 304?"""
+
+        path = f"/users/{self.author_id}"
+        _, headers, _ = await self.request(path)
+
+        status, _, body = await self.request(
+            path, headers=[(b'if-none-match', headers[b'etag'])])
+        self.assertEqual(status, 304)
+        self.assertEqual(body, b'')
+
+    async def test_other_routes_use_flask(self):
+        """Are writes and other pages served by the sync Flask app?"""
+
+        status, _, _ = await self.request(
+            "/messages/new", method='POST', form={'text': "Posted async"})
+        self.assertEqual(status, 302)
+        self.assertEqual(
+            Message.query.filter_by(text="Posted async").count(), 1)
+
+        status, _, body = await self.request("/login", logged_in=False)
+        self.assertEqual(status, 200)
+        self.assertIn(b"Welcome back.", body)
@@ -0,0 +1,104 @@
+"""Static asset pipeline tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_assets.py
+
+
+import gzip
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from flask import render_template_string
+
+import assets
+from models import User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import create_app
+
+# The tests share one application context, so they can use db.session
+# outside requests.
+app = create_app('production')
+app.app_context().push()
+
+
+class AssetsTestCase(TestCase):
+    """Test fingerprinting and serving of built assets."""
+
+    def setUp(self):
+        """Build a copy of the static folder in a scratch directory."""
+
+        self.static_folder = app.static_folder
+        self.tmp = tempfile.mkdtemp()
+        app.static_folder = os.path.join(self.tmp, 'static')
+        shutil.copytree(self.static_folder, app.static_folder,
+                        ignore=shutil.ignore_patterns(assets.DIST_DIR))
+
+        self.manifest = assets.build(app.static_folder)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.static_folder = self.static_folder
+        assets._manifests.clear()
+        shutil.rmtree(self.tmp)
+
+    def test_build(self):
+        """Are files fingerprinted, and stylesheet URLs rewritten?"""
+
+        css = self.manifest['stylesheets/style.css']
+        self.assertRegex(css, r'^stylesheets/style\.[0-9a-f]{12}\.css$')
+
+        with open(os.path.join(app.static_folder, 'dist', css)) as f:
+            text = f.read()
+        self.assertIn(f"/assets/{self.manifest['images/nav-bg.png']}", text)
+        self.assertNotIn("/static/images/", text)
+
+    def test_serve_compressed(self):
+        """Is the gzip variant served with immutable caching?"""
+
+        with app.test_request_context():
+            url = assets.asset_url('stylesheets/style.css')
+        self.assertTrue(url.startswith('/assets/'))
+
+        resp = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(resp.mimetype, 'text/css')
+        self.assertIn('immutable', resp.headers['Cache-Control'])
+        self.assertIn(b'/assets/images/', gzip.decompress(resp.data))
+
+        resp = self.client.get(url)
+        self.assertNotIn('Content-Encoding', resp.headers)
+
+    def test_stored_image_urls(self):
+        """Are default profile images stored as /static/ paths fingerprinted,
+        and users' own image URLs left alone?"""
+
+        default = User.image_url.default.arg
+        with app.test_request_context():
+            url = render_template_string("{{ static_url(url) }}", url=default)
+            self.assertEqual(
+                url, f"/assets/{self.manifest['images/default-pic.png']}")
+            self.assertEqual(assets.static_url("https://example.com/me.png"),
+                             "https://example.com/me.png")
+            self.assertIsNone(assets.static_url(None))
+
+        resp = self.client.get(url)
+        self.assertIn('immutable', resp.headers['Cache-Control'])
+
+    def test_fallback_to_static(self):
+        """Without a manifest, are plain /static/ URLs used?"""
+
+        shutil.rmtree(os.path.join(app.static_folder, 'dist'))
+        assets._manifests.clear()
+
+        with app.test_request_context():
+            self.assertEqual(assets.asset_url('favicon.ico'),
+                             '/static/favicon.ico')
+            self.assertEqual(
+                assets.static_url(User.image_url.default.arg),
+                User.image_url.default.arg)
@@ -0,0 +1,247 @@
+"""Account deletion tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_deletion.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import event, or_
+
+from models import db, Message, User, Likes, Follows, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import create_app, CURR_USER_KEY, identity_cache, fragment_cache
+
+# The tests share one application context, so they can use db.session
+# outside requests.
+app = create_app('production')
+app.app_context().push()
+
+import deletion
+import jobs
+import timelines
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class DeletionTestCase(TestCase):
+    """Test tombstoning and chunked deletion of accounts."""
+
+    def setUp(self):
+        """A doomed user with messages, follows and likes both ways."""
+
+        db.session.expunge_all()
+        db.drop_all()
+        db.create_all()
+        identity_cache.clear()
+        fragment_cache.clear()
+
+        doomed = User.signup("doomed", "doomed@test.com", "password", None)
+        others = [User.signup(f"other{i}", f"other{i}@test.com", "password",
+                              None)
+                  for i in range(3)]
+        db.session.commit()
+
+        for other in others:
+            db.session.add(Follows(user_being_followed_id=doomed.id,
+                                   user_following_id=other.id))
+        db.session.add(Follows(user_being_followed_id=others[0].id,
+                               user_following_id=doomed.id))
+        db.session.commit()
+
+        messages = []
+        for i in range(5):
+            msg = Message(text=f"doomed warble {i}", user_id=doomed.id)
+            db.session.add(msg)
+            db.session.flush()
+            timelines.fan_out(msg)
+            messages.append(msg)
+        kept = Message(text="kept warble", user_id=others[0].id)
+        db.session.add(kept)
+        db.session.flush()
+        timelines.fan_out(kept)
+        db.session.commit()
+
+        for msg in messages:
+            db.session.add(Likes(user_id=others[1].id, message_id=msg.id))
+        db.session.add(Likes(user_id=doomed.id, message_id=kept.id))
+        db.session.commit()
+
+        self.doomed_id = doomed.id
+        self.other_ids = [other.id for other in others]
+        self.kept_id = kept.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def counters(self, user_id):
+        db.session.expire_all()
+        user = db.session.get(User, user_id)
+        return (user.following_count, user.followers_count,
+                user.likes_count)
+
+    def test_delete_in_chunks(self):
+        """Is everything deleted, a bounded chunk at a time, with other
+        users' counters kept in step?"""
+
+        deletion.tombstone(self.doomed_id)
+        db.session.commit()
+
+        lines = []
+        totals = deletion.delete_account(self.doomed_id, chunk_size=2,
+                                         report=lines.append)
+
+        self.assertEqual(totals, {
+            'likes_given': 1,
+            'likes_received': 5,
+            'following': 1,
+            'followers': 3,
+            'timelines': 5 + 3 * 5 + 1,
+            'messages': 5,
+            'user': 1,
+        })
+        self.assertIn("likes_received: 4 deleted", lines)
+        self.assertIn("likes_received: 5 deleted", lines)
+
+        self.assertIsNone(db.session.get(User, self.doomed_id))
+        self.assertEqual(Message.query.filter_by(
+            user_id=self.doomed_id).count(), 0)
+        self.assertEqual(TimelineEntry.query.filter_by(
+            author_id=self.doomed_id).count(), 0)
+
+        first, second, third = self.other_ids
+        self.assertEqual(self.counters(first), (0, 0, 0))
+        self.assertEqual(self.counters(second), (0, 0, 0))
+        self.assertEqual(self.counters(third), (0, 0, 0))
+        self.assertIsNotNone(db.session.get(Message, self.kept_id))
+
+    def test_chunk_size(self):
+        """Does each chunk delete at most `chunk_size` rows?"""
+
+        deletion.tombstone(self.doomed_id)
+        while (chunk := deletion.delete_chunk(self.doomed_id, 2)) is not None:
+            self.assertLessEqual(chunk[1], 2)
+            db.session.commit()
+
+    def rows_left(self):
+        """Count the doomed user's rows, as another connection sees them."""
+
+        doomed = self.doomed_id
+        messages = db.select(Message.id).where(Message.user_id == doomed)
+        with db.engine.connect() as conn:
+            return sum(conn.scalar(db.select(db.func.count()).where(where))
+                       for where in [
+                           or_(Likes.user_id == doomed,
+                               Likes.message_id.in_(messages)),
+                           or_(Follows.user_following_id == doomed,
+                               Follows.user_being_followed_id == doomed),
+                           or_(TimelineEntry.user_id == doomed,
+                               TimelineEntry.author_id == doomed),
+                           Message.user_id == doomed,
+                           User.id == doomed])
+
+    def test_job_per_chunk(self):
+        """Does the delete_user job commit each chunk on its own, even
+        while another account's deletion runs in the same batch?"""
+
+        loner = User.signup("loner", "loner@test.com", "password", None)
+        db.session.commit()
+        for i in range(3):
+            msg = Message(text=f"lonely warble {i}", user_id=loner.id)
+            db.session.add(msg)
+            db.session.flush()
+            timelines.fan_out(msg)
+        db.session.commit()
+
+        for user_id in (self.doomed_id, loner.id):
+            with app.test_client() as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = user_id
+                c.post("/users/delete")
+
+        commits = []
+        left = [self.rows_left()]
+        count_commit = lambda conn: commits.append(1)
+        event.listen(db.engine, 'commit', count_commit)
+        chunk_size = app.config['DELETION_CHUNK_SIZE']
+        app.config['DELETION_CHUNK_SIZE'] = 2
+        try:
+            while True:
+                commits.clear()
+                ran, failed = jobs.work()
+                if not ran:
+                    break
+                self.assertEqual(len(commits), ran)
+                left.append(self.rows_left())
+        finally:
+            app.config['DELETION_CHUNK_SIZE'] = chunk_size
+            event.remove(db.engine, 'commit', count_commit)
+
+        # Every job removed at most a chunk, visible before the next ran.
+        self.assertEqual(left[0], 1 + 5 + 1 + 3 + 21 + 5 + 1)
+        self.assertEqual(left[-1], 0)
+        for before, after in zip(left, left[1:]):
+            self.assertLessEqual(before - after, 2)
+
+    def test_tombstone_hides_account(self):
+        """Does a deleted account vanish before its rows are gone?"""
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.doomed_id
+            c.post("/users/delete")
+
+        self.assertEqual(
+            Message.query.filter_by(user_id=self.doomed_id).count(), 5)
+        self.assertFalse(User.authenticate("doomed", "password"))
+
+        first = self.other_ids[0]
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = first
+
+            self.assertEqual(c.get(f"/users/{self.doomed_id}").status_code,
+                             404)
+            html = c.get("/").get_data(as_text=True)
+            self.assertIn("kept warble", html)
+            self.assertNotIn("doomed warble", html)
+
+            html = c.get(f"/users/{first}/followers").get_data(as_text=True)
+            self.assertNotIn("@doomed", html)
+            html = c.get("/users?q=doomed").get_data(as_text=True)
+            self.assertNotIn("@doomed", html)
+            html = c.get("/messages/search?q=warble").get_data(as_text=True)
+            self.assertNotIn("doomed warble", html)
+
+        # The deleted user's session no longer logs them in.
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.doomed_id
+            self.assertIn("Sign up", c.get("/").get_data(as_text=True))
+
+    def test_no_likes_after_tombstone(self):
+        """Are a deleted account's messages refused likes and unlikes, so
+        likers' counters can't drift from what deletion removes?"""
+
+        deletion.tombstone(self.doomed_id)
+        db.session.commit()
+        msg_id = Message.query.filter_by(user_id=self.doomed_id).first().id
+        liker, other = self.other_ids[1], self.other_ids[2]
+
+        for user_id in (liker, other):
+            with app.test_client() as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = user_id
+                resp = c.post(f"/messages/{msg_id}/add-like")
+                self.assertEqual(resp.status_code, 404)
+
+        self.assertEqual(Likes.query.filter_by(message_id=msg_id).count(), 1)
+        deletion.delete_account(self.doomed_id, report=lambda line: None)
+        self.assertEqual(self.counters(liker), (0, 0, 0))
+        self.assertEqual(self.counters(other), (0, 0, 0))
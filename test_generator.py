@@ -0,0 +1,51 @@
+"""Seed data generator tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_generator.py
+
+
+import csv
+import io
+import os
+import sys
+from unittest import TestCase
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'generator'))
+
+from create_csvs import parse_args, write_follows
+
+
+class GeneratorTestCase(TestCase):
+    """Test generating follows."""
+
+    def follows(self, *argv):
+        """Return {follower: [followed ids]} for users 1..5."""
+
+        options = parse_args(list(argv))
+        out = io.StringIO()
+        write_follows(out, options.seed, 0, 1, 6, options)
+
+        follows = {}
+        for followed, follower in csv.reader(io.StringIO(out.getvalue())):
+            follows.setdefault(int(follower), []).append(int(followed))
+        return follows
+
+    def test_steep_power_law(self):
+        """Does a steep --zipf still give everyone their distinct follows,
+        without drawing forever?"""
+
+        follows = self.follows('--users', '2000', '--follows', '800000',
+                               '--zipf', '3')
+
+        self.assertEqual(sorted(follows), [1, 2, 3, 4, 5])
+        for follower, followed in follows.items():
+            self.assertEqual(len(followed), 400)
+            self.assertEqual(len(set(followed)), 400)
+            self.assertNotIn(follower, followed)
+
+    def test_same_seed_same_follows(self):
+        """Is the output decided by the seed alone?"""
+
+        argv = ['--users', '300', '--follows', '3000', '--seed', 'fixed']
+        self.assertEqual(self.follows(*argv), self.follows(*argv))
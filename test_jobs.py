@@ -0,0 +1,241 @@
+"""Background job queue tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_jobs.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, Job, User, Follows, Message, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import create_app, CURR_USER_KEY, identity_cache
+
+# The tests share one application context, so they can use db.session
+# outside requests.
+app = create_app('production')
+app.app_context().push()
+
+import jobs
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class JobQueueTestCase(TestCase):
+    """Test queueing, running and retrying jobs."""
+
+    def setUp(self):
+        db.session.expunge_all()
+        db.drop_all()
+        db.create_all()
+        identity_cache.clear()
+
+        self.calls = []
+        jobs.HANDLERS['record'] = lambda n: self.calls.append(n)
+        jobs.HANDLERS['explode'] = self.explode
+        jobs.HANDLERS['interrupt'] = self.interrupt
+
+    def tearDown(self):
+        del jobs.HANDLERS['record']
+        del jobs.HANDLERS['explode']
+        del jobs.HANDLERS['interrupt']
+        db.session.rollback()
+
+    def explode(self):
+        raise ValueError("boom")
+
+    def interrupt(self):
+        raise KeyboardInterrupt
+
+    def test_run(self):
+        """Do queued jobs run in order, in batches, and leave the queue?"""
+
+        for n in range(5):
+            jobs.enqueue('record', {'n': n})
+        db.session.commit()
+
+        self.assertEqual(jobs.work(batch_size=2), (2, 0))
+        self.assertEqual(self.calls, [0, 1])
+        self.assertEqual(jobs.work(batch_size=10), (3, 0))
+        self.assertEqual(self.calls, [0, 1, 2, 3, 4])
+        self.assertEqual(Job.query.count(), 0)
+        self.assertEqual(jobs.work(), (0, 0))
+
+    def test_idempotency_key(self):
+        """Is a job with the key of a waiting one dropped?"""
+
+        jobs.enqueue('record', {'n': 1}, key='once')
+        jobs.enqueue('record', {'n': 2}, key='once')
+        db.session.commit()
+        jobs.enqueue('record', {'n': 3}, key='once')
+        db.session.commit()
+
+        jobs.work()
+        self.assertEqual(self.calls, [1])
+
+        # Once it has run, the key is free again.
+        jobs.enqueue('record', {'n': 4}, key='once')
+        db.session.commit()
+        jobs.work()
+        self.assertEqual(self.calls, [1, 4])
+
+    def test_retries(self):
+        """Is a failing job retried, then kept as failed, without harming
+        the rest of its batch?"""
+
+        jobs.enqueue('explode', {})
+        jobs.enqueue('record', {'n': 1})
+        db.session.commit()
+
+        self.assertEqual(jobs.work(max_attempts=2, retry_seconds=0), (2, 1))
+        self.assertEqual(self.calls, [1])
+
+        job = Job.query.one()
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNone(job.failed_at)
+        self.assertEqual(job.last_error, "ValueError: boom")
+
+        self.assertEqual(jobs.work(max_attempts=2, retry_seconds=0), (1, 1))
+        self.assertIsNotNone(Job.query.one().failed_at)
+        self.assertEqual(jobs.work(max_attempts=2, retry_seconds=0), (0, 0))
+
+        self.assertEqual(jobs.stats()['failed'], 1)
+
+    def test_commit_per_job(self):
+        """Is each job committed before the next runs, so a worker dying
+        mid-batch loses only the job it was on?"""
+
+        jobs.enqueue('record', {'n': 1})
+        jobs.enqueue('interrupt', {})
+        db.session.commit()
+
+        with self.assertRaises(KeyboardInterrupt):
+            jobs.work()
+        db.session.rollback()
+
+        self.assertEqual(self.calls, [1])
+        self.assertEqual([job.kind for job in Job.query], ['interrupt'])
+
+    def test_failed_job_frees_key(self):
+        """Can a job be queued again once one with its key has failed?"""
+
+        jobs.enqueue('explode', {}, key='retry-me')
+        db.session.commit()
+        jobs.work(max_attempts=1)
+
+        jobs.enqueue('record', {'n': 1}, key='retry-me')
+        db.session.commit()
+        jobs.work()
+        self.assertEqual(self.calls, [1])
+        self.assertEqual(jobs.stats()['failed'], 1)
+
+    def test_backoff(self):
+        """Does a failed job wait before its retry?"""
+
+        jobs.enqueue('explode', {})
+        db.session.commit()
+
+        jobs.work(retry_seconds=60)
+        self.assertEqual(jobs.work(retry_seconds=60), (0, 0))
+        self.assertEqual(jobs.stats()['scheduled'], 1)
+
+    def test_skip_locked(self):
+        """Does a worker skip jobs another worker has claimed?"""
+
+        jobs.enqueue('record', {'n': 1})
+        jobs.enqueue('record', {'n': 2})
+        db.session.commit()
+        first = db.session.scalar(db.select(Job.id).order_by(Job.id))
+        db.session.commit()
+
+        with db.engine.connect() as other:
+            other.execute(db.select(Job).where(Job.id == first)
+                          .with_for_update())
+            self.assertEqual(jobs.work(), (1, 0))
+            self.assertEqual(self.calls, [2])
+
+        jobs.work()
+        self.assertEqual(self.calls, [2, 1])
+
+    def test_stats(self):
+        """Does stats report how long the oldest due job has waited?"""
+
+        self.assertEqual(jobs.stats(), {
+            'due': 0, 'scheduled': 0, 'failed': 0, 'lag_seconds': 0.0})
+
+        jobs.enqueue('record', {'n': 1}, delay=-60)
+        jobs.enqueue('record', {'n': 2})
+        jobs.enqueue('record', {'n': 3}, delay=60)
+        db.session.commit()
+
+        stats = jobs.stats()
+        self.assertEqual((stats['due'], stats['scheduled']), (2, 1))
+        self.assertGreaterEqual(stats['lag_seconds'], 60)
+
+    def test_delete_user(self):
+        """Does deleting an account return at once and finish in jobs?"""
+
+        user = User.signup("doomed", "doomed@test.com", "password", None)
+        other = User.signup("other", "other@test.com", "password", None)
+        db.session.commit()
+        db.session.add(Follows(user_being_followed_id=user.id,
+                               user_following_id=other.id))
+        db.session.commit()
+        user_id, other_id = user.id, other.id
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            resp = c.post("/users/delete")
+            self.assertEqual(resp.status_code, 302)
+
+        # Hidden at once, and deleted a chunk per job.
+        db.session.expire_all()
+        self.assertIsNotNone(db.session.get(User, user_id).deleted_at)
+        self.assertEqual(jobs.stats()['due'], 1)
+
+        while jobs.work()[0]:
+            pass
+        db.session.expire_all()
+        self.assertIsNone(db.session.get(User, user_id))
+        self.assertEqual(db.session.get(User, other_id).following_count, 0)
+
+    def test_fan_out_in_chunks(self):
+        """Does a message reach every follower, a chunk per job?"""
+
+        author = User.signup("author", "author@test.com", "password", None)
+        followers = [User.signup(f"fan{i}", f"fan{i}@test.com", "password",
+                                 None)
+                     for i in range(5)]
+        db.session.commit()
+        for follower in followers:
+            db.session.add(Follows(user_being_followed_id=author.id,
+                                   user_following_id=follower.id))
+        msg = Message(text="Hello fans", user_id=author.id)
+        db.session.add(msg)
+        db.session.commit()
+
+        jobs.enqueue('fan_out', {'message_id': msg.id})
+        db.session.commit()
+
+        chunk_size = app.config['FAN_OUT_CHUNK_SIZE']
+        app.config['FAN_OUT_CHUNK_SIZE'] = 2
+        try:
+            copied = []
+            while jobs.work()[0]:
+                copied.append(TimelineEntry.query.filter_by(
+                    message_id=msg.id).count())
+        finally:
+            app.config['FAN_OUT_CHUNK_SIZE'] = chunk_size
+
+        # Three chunks, then one job that finds no one left.
+        self.assertEqual(copied, [2, 4, 5, 5])
+        self.assertEqual(
+            {entry.user_id for entry in TimelineEntry.query},
+            {follower.id for follower in followers})
@@ -0,0 +1,101 @@
+"""Bulk loader tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_loader.py
+
+
+import csv
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from models import db, User, Message, Follows, TimelineEntry
+from loader import LoadError, load
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import create_app
+
+# The tests share one application context, so they can use db.session
+# outside requests.
+app = create_app('production')
+app.app_context().push()
+
+
+class Interrupted(Exception):
+    pass
+
+
+class LoaderTestCase(TestCase):
+    """Test loading, and resuming, CSVs of seed data."""
+
+    def setUp(self):
+        """Write small CSVs to a scratch directory."""
+
+        self.dir = tempfile.mkdtemp()
+        self.write('users.csv', ['email', 'username', 'password', 'bio'], [
+            [f"user{i}@test.com", f"user{i}", "HASHED", ""] for i in range(5)])
+        self.write('messages.csv', ['text', 'timestamp', 'user_id'], [
+            [f"warble {i}", f"2017-01-0{i + 1} 11:04:53.522807", i % 5 + 1]
+            for i in range(7)])
+        self.write('follows.csv',
+                   ['user_being_followed_id', 'user_following_id'],
+                   [[1, 2], [1, 3], [2, 1]])
+
+    def tearDown(self):
+        db.session.rollback()
+        shutil.rmtree(self.dir)
+
+    def write(self, name, header, rows):
+        with open(os.path.join(self.dir, name), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(rows)
+
+    def assertLoaded(self):
+        self.assertEqual(User.query.count(), 5)
+        self.assertEqual(Message.query.count(), 7)
+        self.assertEqual(Follows.query.count(), 3)
+
+        user1 = db.session.get(User, 1)
+        self.assertEqual(user1.username, "user0")
+        self.assertIsNone(user1.bio)
+        self.assertEqual(user1.followers_count, 2)
+        self.assertEqual(user1.messages_count, 2)
+        self.assertEqual(
+            TimelineEntry.query.filter_by(user_id=2).count(), 2 + 2)
+
+        # New rows get ids after the loaded ones
+        user = User.signup("newuser", "new@test.com", "password", None)
+        db.session.commit()
+        self.assertEqual(user.id, 6)
+
+    def test_load(self):
+        """Are all rows and derived tables loaded?"""
+
+        load(self.dir, chunk_size=2, report=lambda line: None)
+        self.assertLoaded()
+
+    def test_resume(self):
+        """Does a resumed load finish what an interrupted one started?"""
+
+        def interrupt(line):
+            if line.startswith("messages: 4 rows"):
+                raise Interrupted
+
+        with self.assertRaises(Interrupted):
+            load(self.dir, chunk_size=2, report=interrupt)
+        db.session.rollback()
+        self.assertEqual(Message.query.count(), 4)
+
+        load(self.dir, resume=True, chunk_size=2, report=lambda line: None)
+        self.assertLoaded()
+
+    def test_resume_without_load(self):
+        """Is resuming refused when there's nothing to resume?"""
+
+        load(self.dir, report=lambda line: None)
+        with self.assertRaises(LoadError):
+            load(self.dir, resume=True, report=lambda line: None)
@@ -20,7 +20,12 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 
 # Now we can import app
 
-from app import app
+from app import create_app
+
+# The tests share one application context, so they can use db.session
+# outside requests.
+app = create_app('production')
+app.app_context().push()
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
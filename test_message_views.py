@@ -2,13 +2,15 @@
 
 # run these tests like:
 #
-#    FLASK_ENV=production python -m unittest test_message_views.py
+#    python -m unittest test_message_views.py
 
 
 import os
 from unittest import TestCase
 
-from models import db, connect_db, Message, User, Likes
+from sqlalchemy import event
+
+from models import db, connect_db, Message, User, Likes, Follows, TimelineEntry
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -20,7 +22,15 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 
 # Now we can import app
 
-from app import app, CURR_USER_KEY
+from app import create_app, CURR_USER_KEY, identity_cache, fragment_cache
+
+# The tests share one application context, so they can use db.session
+# outside requests.
+app = create_app('production')
+app.app_context().push()
+
+import jobs
+import timelines
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -41,6 +51,8 @@ class MessageViewTestCase(TestCase):
 
         User.query.delete()
         Message.query.delete()
+        identity_cache.clear()
+        fragment_cache.clear()
 
         self.client = app.test_client()
 
@@ -215,5 +227,262 @@ class MessageViewTestCase(TestCase):
             resp = c.post(f"/messages/{msg.id}/add-like", follow_redirects=True)
             
             self.assertEqual(resp.status_code, 200)
-            self.assertIn('Access unauthorized', str(resp.data))    
-            
\ No newline at end of file
+            self.assertIn('Access unauthorized', str(resp.data))
+
+    def test_like_toggle_shared_message(self):
+        """Can several users like one message, with counts kept in step?"""
+
+        msg = Message(text="Popular", user_id=self.u1.id)
+        db.session.add(msg)
+        db.session.commit()
+        msg_id = msg.id
+        db.session.add(Likes(user_id=self.u1.id, message_id=msg_id))
+        db.session.commit()
+
+        def likes_count(user_id):
+            db.session.expire_all()
+            return db.session.get(User, user_id).likes_count
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.post(f"/messages/{msg_id}/add-like")
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(
+                Likes.query.filter_by(message_id=msg_id).count(), 2)
+            self.assertEqual(likes_count(self.testuser.id), 1)
+            self.assertEqual(likes_count(self.u1.id), 1)
+
+            c.post(f"/messages/{msg_id}/add-like")
+            self.assertEqual(
+                [like.user_id for like in
+                 Likes.query.filter_by(message_id=msg_id)], [self.u1.id])
+            self.assertEqual(likes_count(self.testuser.id), 0)
+
+            resp = c.post("/messages/99999999/add-like")
+            self.assertEqual(resp.status_code, 404)
+            self.assertEqual(likes_count(self.testuser.id), 0)
+
+    def test_add_message_fans_out(self):
+        """Does a new message land in the author's and followers' timelines?"""
+
+        db.session.add(Follows(user_being_followed_id=self.testuser.id,
+                               user_following_id=self.u1.id))
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            c.post("/messages/new", data={"text": "Fanned out"})
+
+            # The author's timeline has it straight away; followers' once
+            # the queued job has run.
+            msg = Message.query.one()
+            owners = lambda: {entry.user_id for entry in
+                              TimelineEntry.query.filter_by(message_id=msg.id)}
+            self.assertEqual(owners(), {self.testuser.id})
+
+            jobs.work()
+            self.assertEqual(owners(), {self.testuser.id, self.u1.id})
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1.id
+
+            resp = c.get("/")
+            self.assertIn("Fanned out", resp.get_data(as_text=True))
+
+    def test_delete_message_removes_from_timelines(self):
+        """Does deleting a message clear it out of every timeline?"""
+
+        db.session.add(Follows(user_being_followed_id=self.testuser.id,
+                               user_following_id=self.u1.id))
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            c.post("/messages/new", data={"text": "Short lived"})
+            msg = Message.query.one()
+            c.post(f"/messages/{msg.id}/delete")
+
+            self.assertEqual(TimelineEntry.query.count(), 0)
+
+    def test_message_counters(self):
+        """Do posting, liking and deleting keep the counters in step?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+            c.post("/messages/new", data={"text": "Counted"})
+            msg = Message.query.one()
+            self.assertEqual(User.query.get(self.testuser.id).messages_count, 1)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1.id
+            c.post(f"/messages/{msg.id}/add-like")
+            self.assertEqual(User.query.get(self.u1.id).likes_count, 1)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+            c.post(f"/messages/{msg.id}/delete")
+            self.assertEqual(User.query.get(self.testuser.id).messages_count, 0)
+            self.assertEqual(User.query.get(self.u1.id).likes_count, 0)
+
+    def count_homepage_queries(self):
+        """Render the homepage as testuser, returning the statements run."""
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            # Look up the viewer's record each time, so runs are comparable.
+            identity_cache.clear()
+            event.listen(db.engine, "before_cursor_execute", record)
+            try:
+                resp = c.get("/")
+            finally:
+                event.remove(db.engine, "before_cursor_execute", record)
+
+            self.assertEqual(resp.status_code, 200)
+        return len(statements)
+
+    def test_homepage_query_count(self):
+        """Does rendering the timeline cost the same for 2 or 8 messages?"""
+
+        authors = [self.u1]
+        for i in range(3):
+            authors.append(User.signup(f"author{i}", f"author{i}@test.com",
+                                       "password", None))
+        db.session.commit()
+        for author in authors:
+            db.session.add(Follows(user_being_followed_id=author.id,
+                                   user_following_id=self.testuser.id))
+        db.session.commit()
+
+        def post(n):
+            for i in range(n):
+                author = authors[i % len(authors)]
+                msg = Message(text=f"warble {i}", user_id=author.id)
+                db.session.add(msg)
+                db.session.flush()
+                timelines.fan_out(msg)
+                db.session.add(Likes(user_id=self.testuser.id, message_id=msg.id))
+            db.session.commit()
+
+        post(2)
+        few = self.count_homepage_queries()
+        post(6)
+        many = self.count_homepage_queries()
+
+        self.assertEqual(few, many)
+
+    def test_message_search(self):
+        """Does /messages/search find messages containing every word?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            c.post("/messages/new", data={"text": "Warbling about the sunny weather"})
+            c.post("/messages/new", data={"text": "Rainy weather again"})
+            c.post("/messages/new", data={"text": "Nothing to see here"})
+
+            html = c.get("/messages/search?q=WEATHER").get_data(as_text=True)
+            self.assertIn("sunny weather", html)
+            self.assertIn("Rainy weather", html)
+            self.assertNotIn("Nothing to see", html)
+
+            html = c.get("/messages/search?q=sunny+weather").get_data(as_text=True)
+            self.assertIn("sunny weather", html)
+            self.assertNotIn("Rainy weather", html)
+
+            msg = Message.query.filter_by(text="Rainy weather again").one()
+            c.post(f"/messages/{msg.id}/delete")
+            html = c.get("/messages/search?q=weather").get_data(as_text=True)
+            self.assertNotIn("Rainy weather", html)
+
+            resp = c.get("/messages/search?q=weather&before=bogus")
+            self.assertEqual(resp.status_code, 400)
+
+    def test_message_fragments(self):
+        """Are rendered messages reused, and dropped when deleted?"""
+
+        msg = Message(text="cached warble", user_id=self.testuser.id)
+        db.session.add(msg)
+        db.session.commit()
+        key = (msg.id, msg.timestamp, 0, None)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            c.get(f"/users/{self.testuser.id}")
+            self.assertIn("cached warble", fragment_cache.get(key))
+
+            hits = fragment_cache.hits
+            resp = c.get(f"/users/{self.testuser.id}")
+            self.assertIn("cached warble", resp.get_data(as_text=True))
+            self.assertEqual(fragment_cache.hits, hits + 1)
+
+            c.post(f"/messages/{msg.id}/delete")
+            self.assertIsNone(fragment_cache.get(key))
+
+    def test_message_fragment_id_reused(self):
+        """Is a new message that reuses a deleted one's id never shown as
+        the old one, even if this worker didn't see the deletion?"""
+
+        msg = Message(text="old warble", user_id=self.testuser.id)
+        db.session.add(msg)
+        db.session.commit()
+        msg_id = msg.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            html = c.get(f"/users/{self.testuser.id}").get_data(as_text=True)
+            self.assertIn("old warble", html)
+
+            # Deleted through another worker, whose cache this isn't.
+            db.session.delete(msg)
+            db.session.commit()
+            db.session.add(Message(id=msg_id, text="new warble",
+                                   user_id=self.testuser.id))
+            db.session.commit()
+
+            html = c.get(f"/users/{self.testuser.id}").get_data(as_text=True)
+            self.assertIn("new warble", html)
+            self.assertNotIn("old warble", html)
+
+    def test_sql_instrumentation(self):
+        """Are SQL statistics reported, and repeated statements flagged?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            with self.assertLogs('warbler.sql', level='INFO') as logs:
+                resp = c.get("/")
+            self.assertRegex(resp.headers['Server-Timing'],
+                             r'db;dur=[\d.]+;desc="\d+ statements, \d+ rows"')
+            self.assertIn('"endpoint": "warbler.homepage"', logs.output[0])
+            self.assertFalse(any('N+1' in line for line in logs.output))
+
+            app.config['SQL_REPEAT_THRESHOLD'] = 0
+            try:
+                with self.assertLogs('warbler.sql', level='WARNING') as logs:
+                    c.get("/")
+            finally:
+                app.config['SQL_REPEAT_THRESHOLD'] = 5
+            self.assertIn('Possible N+1 in warbler.homepage', logs.output[0])
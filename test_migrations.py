@@ -0,0 +1,125 @@
+"""Schema migration and query plan tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_migrations.py
+
+
+import os
+from unittest import TestCase
+
+import flask_migrate
+from sqlalchemy import inspect, text
+
+from models import db, User, Message, Follows, Likes
+import counters
+import query_plans
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import create_app, CURR_USER_KEY
+
+# The tests share one application context, so they can use db.session
+# outside requests.
+app = create_app('production')
+app.app_context().push()
+
+
+class MigrationTestCase(TestCase):
+    """Test that migrations build the models' schema."""
+
+    def setUp(self):
+        """Start from an empty database."""
+
+        db.session.remove()
+        db.drop_all()
+        db.session.execute(text("DROP TABLE IF EXISTS alembic_version"))
+        db.session.commit()
+
+        flask_migrate.upgrade()
+
+    def tearDown(self):
+        db.session.remove()
+        flask_migrate.downgrade(revision='base')
+        db.create_all()
+
+    def test_upgrade_matches_models(self):
+        """Does upgrading to head give the schema models.py describes?"""
+
+        # Raises if autogenerate would write a new migration.
+        flask_migrate.check()
+
+    def test_downgrade(self):
+        """Does downgrading remove the tables again?"""
+
+        flask_migrate.downgrade(revision='base')
+        self.assertEqual(
+            set(inspect(db.engine).get_table_names()), {'alembic_version'})
+        flask_migrate.upgrade()
+
+    def test_upgrade_initial_schema(self):
+        """Does a database made by the original models upgrade to head,
+        keeping its rows?"""
+
+        flask_migrate.downgrade(revision='base')
+        flask_migrate.upgrade(revision='0001')
+        db.session.execute(text(
+            "INSERT INTO users (id, email, username, password) VALUES "
+            "(1, 'ann@test.com', 'ann', 'x'), (2, 'bob@test.com', 'bob', 'x')"))
+        db.session.execute(text(
+            "INSERT INTO messages (id, text, timestamp, user_id) VALUES "
+            "(1, 'hello', '2023-01-01', 2)"))
+        db.session.execute(text(
+            "INSERT INTO follows (user_being_followed_id, user_following_id) "
+            "VALUES (2, 1)"))
+        db.session.execute(text(
+            "INSERT INTO likes (user_id, message_id) VALUES "
+            "(1, 1), (NULL, NULL)"))
+        db.session.commit()
+
+        flask_migrate.upgrade()
+        flask_migrate.check()
+
+        like = Likes.query.one()
+        self.assertEqual((like.user_id, like.message_id), (1, 1))
+        self.assertIsNotNone(like.created_at)
+
+        counters.reconcile()
+        ann, bob = db.session.get(User, 1), db.session.get(User, 2)
+        self.assertEqual((ann.following_count, ann.likes_count), (1, 1))
+        self.assertEqual((bob.followers_count, bob.messages_count), (1, 1))
+
+    def test_query_plans(self):
+        """Are the hot routes' queries indexed, and is a missing index found?"""
+
+        users = [User.signup(f"user{i}", f"user{i}@test.com", "password", None)
+                 for i in range(3)]
+        db.session.commit()
+        msg = Message(text="hello there", user_id=users[1].id)
+        db.session.add(msg)
+        db.session.add_all([
+            Follows(user_being_followed_id=users[1].id,
+                    user_following_id=users[0].id),
+            Follows(user_being_followed_id=users[2].id,
+                    user_following_id=users[0].id),
+        ])
+        db.session.commit()
+        db.session.add(Likes(user_id=users[0].id, message_id=msg.id))
+        db.session.commit()
+
+        report = lambda line: None
+        self.assertEqual(query_plans.check(app, CURR_USER_KEY, report), [])
+
+        # Without the index migration 0003 adds, listing whom a user
+        # follows has to read the whole primary key.
+        index = next(index for index in Follows.__table__.indexes
+                     if index.name == 'ix_follows_user_following_id')
+        db.session.remove()
+        index.drop(db.engine)
+        try:
+            problems = query_plans.check(app, CURR_USER_KEY, report)
+        finally:
+            db.session.remove()
+            index.create(db.engine)
+        self.assertEqual([path for path, _, _ in problems],
+                         [f'/users/{users[0].id}/following'])
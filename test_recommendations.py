@@ -0,0 +1,136 @@
+"""Follow recommendation tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_recommendations.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Follows, Recommendation
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import create_app, CURR_USER_KEY, identity_cache, fragment_cache
+
+# The tests share one application context, so they can use db.session
+# outside requests.
+app = create_app('production')
+app.app_context().push()
+
+import deletion
+import recommendations
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class RecommendationsTestCase(TestCase):
+    """Test computing and showing "who to follow"."""
+
+    def setUp(self):
+        """Ann follows Bob and Cat; they follow Dan, Eve and each other."""
+
+        db.session.expunge_all()
+        db.drop_all()
+        db.create_all()
+        identity_cache.clear()
+        fragment_cache.clear()
+
+        names = ["ann", "bob", "cat", "dan", "eve", "fay"]
+        users = {name: User.signup(name, f"{name}@test.com", "password", None)
+                 for name in names}
+        db.session.commit()
+        self.ids = {name: user.id for name, user in users.items()}
+
+        for follower, followed in [
+                ("ann", "bob"), ("ann", "cat"),
+                ("bob", "cat"), ("cat", "bob"),
+                ("bob", "dan"), ("cat", "dan"),
+                ("cat", "eve"), ("fay", "eve"),
+                ("bob", "ann"),
+        ]:
+            db.session.add(Follows(user_following_id=self.ids[follower],
+                                   user_being_followed_id=self.ids[followed]))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def recommended(self, name):
+        rows = db.session.execute(
+            db.select(User.username, Recommendation.mutuals)
+            .join(User, User.id == Recommendation.recommended_id)
+            .where(Recommendation.user_id == self.ids[name])
+            .order_by(Recommendation.rank))
+        return [tuple(row) for row in rows]
+
+    def test_recommend(self):
+        """Are friends-of-friends ranked by mutuals, without accounts the
+        user follows already or the user themself?"""
+
+        lines = []
+        written = recommendations.recommend(report=lines.append)
+
+        self.assertEqual(self.recommended("ann"), [("dan", 2), ("eve", 1)])
+        self.assertEqual(self.recommended("bob"), [("eve", 1)])
+        self.assertEqual(self.recommended("cat"), [("ann", 1)])
+        self.assertEqual(self.recommended("fay"), [])
+        self.assertEqual(written, 4)
+        self.assertIn("graph: 9 follows", lines)
+
+    def test_count(self):
+        """Are only the best `count` kept, and replaced on a rerun?"""
+
+        recommendations.recommend(count=1)
+        self.assertEqual(self.recommended("ann"), [("dan", 2)])
+
+        recommendations.recommend(count=1, block_size=2)
+        self.assertEqual(self.recommended("ann"), [("dan", 2)])
+        self.assertEqual(Recommendation.query.count(), 3)
+
+    def test_max_degree(self):
+        """Are accounts following too many others not walked through?"""
+
+        # Ann's candidates all come through Bob and Cat, who follow three.
+        self.assertEqual(recommendations.recommend(max_degree=2), 0)
+        self.assertEqual(self.recommended("ann"), [])
+
+    def test_deleted_users(self):
+        """Are deleted accounts neither recommended nor mutuals?"""
+
+        deletion.tombstone(self.ids["cat"])
+        db.session.commit()
+
+        recommendations.recommend()
+        self.assertEqual(self.recommended("ann"), [("dan", 1)])
+
+        deletion.delete_account(self.ids["dan"], report=lambda line: None)
+        self.assertEqual(self.recommended("ann"), [])
+
+    def test_sidebar(self):
+        """Does the homepage show recommendations not followed since?"""
+
+        recommendations.recommend()
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.ids["ann"]
+
+            html = c.get("/").get_data(as_text=True)
+            self.assertIn("Who to follow", html)
+            self.assertLess(html.index("@dan"), html.index("@eve"))
+
+            c.post(f"/users/follow/{self.ids['dan']}")
+            html = c.get("/").get_data(as_text=True)
+            self.assertNotIn("@dan", html)
+            self.assertIn("@eve", html)
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.ids["fay"]
+
+            html = c.get("/").get_data(as_text=True)
+            self.assertNotIn("Who to follow", html)
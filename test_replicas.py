@@ -0,0 +1,115 @@
+"""Read replica routing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_replicas.py
+
+
+import os
+from datetime import datetime
+from unittest import TestCase
+
+from models import db, Message, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import create_app, CURR_USER_KEY, identity_cache, fragment_cache
+from config import PROFILES
+from replicas import STICKY_KEY
+
+
+class ReplicaConfig(PROFILES['production']):
+    DATABASE_REPLICA_URLS = "postgresql:///warbler-test-replica"
+
+
+# The tests share one application context, so they can use db.session
+# outside requests.
+app = create_app(ReplicaConfig)
+app.app_context().push()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ReplicaTestCase(TestCase):
+    """Test that read-only pages read from the replica until a write."""
+
+    def setUp(self):
+        """Give both databases the same user, and each its own message."""
+
+        self.replica = db.engines['replica0']
+
+        db.session.expunge_all()
+        db.drop_all()
+        db.create_all()
+        db.metadata.drop_all(self.replica)
+        db.metadata.create_all(self.replica)
+        identity_cache.clear()
+        fragment_cache.clear()
+
+        user = User.signup("testuser", "test@test.com", "password", None)
+        db.session.add(Message(text="On the primary", user=user))
+        db.session.commit()
+        self.user_id = user.id
+
+        users = User.__table__
+        row = db.session.execute(users.select()).mappings().one()
+        db.session.commit()
+        with self.replica.begin() as connection:
+            connection.execute(users.insert(), dict(row))
+            connection.execute(Message.__table__.insert(), {
+                'id': 1000, 'text': "On the replica", 'user_id': self.user_id,
+                'timestamp': datetime.utcnow()})
+
+        self.client = app.test_client()
+
+    def get_profile(self, c):
+        db.session.expunge_all()
+        fragment_cache.clear()
+        return c.get(f"/users/{self.user_id}").get_data(as_text=True)
+
+    def test_reads_from_replica(self):
+        """Are read-only pages served from the replica?"""
+
+        with self.client as c:
+            html = self.get_profile(c)
+            self.assertIn("On the replica", html)
+            self.assertNotIn("On the primary", html)
+
+    def test_writes_go_to_primary(self):
+        """Do writes, and reads right after them, use the primary?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            resp = c.post("/messages/new", data={"text": "Just posted"})
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(
+                Message.query.filter_by(text="Just posted").count(), 1)
+
+            html = self.get_profile(c)
+            self.assertIn("Just posted", html)
+            self.assertNotIn("On the replica", html)
+
+            with c.session_transaction() as sess:
+                sess[STICKY_KEY] = 0
+
+            html = self.get_profile(c)
+            self.assertIn("On the replica", html)
+            self.assertNotIn("Just posted", html)
+
+    def test_replica_queries_instrumented(self):
+        """Are replica queries counted in Server-Timing and /metrics?"""
+
+        with self.client as c:
+            db.session.expunge_all()
+            fragment_cache.clear()
+            resp = c.get(f"/users/{self.user_id}")
+            self.assertIn("On the replica", resp.get_data(as_text=True))
+            self.assertRegex(resp.headers['Server-Timing'],
+                             r'desc="[1-9]\d* statements')
+
+            text = c.get("/metrics").get_data(as_text=True)
+            self.assertIn(
+                'warbler_db_pool_connections_in_use{database="replica0"}',
+                text)
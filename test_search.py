@@ -0,0 +1,216 @@
+"""User and message search tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_search.py
+
+
+import os
+from unittest import TestCase
+
+from datetime import datetime
+
+from models import db, User, Message, MessageTerm
+import search
+from search import (
+    InvertedIndex, search_users, search_messages, reindex_messages,
+    _encode_cursor,
+)
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import create_app
+
+# The tests share one application context, so they can use db.session
+# outside requests.
+app = create_app('production')
+app.app_context().push()
+
+db.create_all()
+
+
+class UserSearchTestCase(TestCase):
+    """Test ranked, paginated user search."""
+
+    def setUp(self):
+        """Create users with searchable usernames, bios and locations."""
+
+        db.drop_all()
+        db.create_all()
+
+        self.users = {}
+        for username, bio, location in [
+            ("sparrow", "Small brown bird", "Oakland"),
+            ("sparrowhawk", "Hunts sparrows", "Denver"),
+            ("birdwatcher", "I love every sparrow", "Oakland"),
+            ("robin", "Early bird", "Springfield"),
+        ]:
+            user = User.signup(username, f"{username}@test.com", "password", None)
+            user.bio = bio
+            user.location = location
+            self.users[username] = user
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def usernames(self, page):
+        return [user.username for user in page]
+
+    def test_prefix_matches_rank_first(self):
+        """Do username prefix matches come before bio/location matches?"""
+
+        page = search_users("sparrow")
+        self.assertEqual(self.usernames(page),
+                         ["sparrow", "sparrowhawk", "birdwatcher"])
+
+    def test_location_and_bio_words(self):
+        """Does every query word have to match a word in the profile?"""
+
+        self.assertEqual(self.usernames(search_users("oakland")),
+                         ["birdwatcher", "sparrow"])
+        self.assertEqual(self.usernames(search_users("early bird")), ["robin"])
+        self.assertEqual(self.usernames(search_users("pelican")), [])
+
+    def test_pagination(self):
+        """Do cursors walk through results across ranking tiers?"""
+
+        first = search_users("sparrow", per_page=2)
+        self.assertEqual(self.usernames(first), ["sparrow", "sparrowhawk"])
+
+        second = search_users("sparrow", after=first.next, per_page=2)
+        self.assertEqual(self.usernames(second), ["birdwatcher"])
+        self.assertIsNone(second.next)
+
+        with self.assertRaises(ValueError):
+            search_users("sparrow", after="garbage")
+
+    def test_cursor_tier_out_of_range(self):
+        """Is a cursor naming a tier the query doesn't have rejected?"""
+
+        index = InvertedIndex()
+        for user in self.users.values():
+            index.add(user.id, user.username, user.bio, user.location)
+
+        for tier in [-3, -1, 2]:
+            cursor = _encode_cursor(tier, "sparrow", 1)
+            with self.subTest(tier=tier):
+                with self.assertRaises(ValueError):
+                    search_users("sparrow", after=cursor)
+                with self.assertRaises(ValueError):
+                    index.search("sparrow", (tier, "sparrow", 1), 10)
+
+        # A query with no words has only the username prefix tier.
+        with self.assertRaises(ValueError):
+            search_users("-", after=_encode_cursor(1, "-", 1))
+
+        with app.test_client() as c:
+            resp = c.get(f"/users?q=sparrow&after={_encode_cursor(-3, '', 1)}")
+            self.assertEqual(resp.status_code, 400)
+
+    def test_inverted_index(self):
+        """Does the in-process fallback rank and page like the database?"""
+
+        index = InvertedIndex()
+        for user in self.users.values():
+            index.add(user.id, user.username, user.bio, user.location)
+
+        hits = index.search("sparrow", None, 10)
+        self.assertEqual([hit[3].username for hit in hits],
+                         ["sparrow", "sparrowhawk", "birdwatcher"])
+
+        rest = index.search("sparrow", hits[0][:3], 10)
+        self.assertEqual([hit[3].username for hit in rest],
+                         ["sparrowhawk", "birdwatcher"])
+
+        index.remove(self.users["sparrow"].id)
+        hits = index.search("sparrow", None, 10)
+        self.assertEqual([hit[3].username for hit in hits],
+                         ["sparrowhawk", "birdwatcher"])
+
+
+    def test_memory_index_expires(self):
+        """Does the in-process index see users added by other workers once
+        it is older than its TTL?"""
+
+        def found(index):
+            return [hit[3].username for hit in index.search("wren", None, 10)]
+
+        search._index = None
+        try:
+            index = search._memory_index(60)
+
+            # Signed up elsewhere, so not added to this worker's index
+            User.signup("wren", "wren@test.com", "password", None)
+            db.session.commit()
+
+            self.assertIs(search._memory_index(60), index)
+            self.assertEqual(found(index), [])
+            self.assertEqual(found(search._memory_index(0)), ["wren"])
+        finally:
+            search._index = None
+
+
+class MessageReindexTestCase(TestCase):
+    """Test rebuilding the message search index."""
+
+    def setUp(self):
+        """Messages inserted directly, so none of them are indexed."""
+
+        db.drop_all()
+        db.create_all()
+
+        user = User.signup("writer", "writer@test.com", "password", None)
+        db.session.commit()
+
+        self.ids = {}
+        for day, text in enumerate(["Sunny weather today",
+                                    "Rainy weather again",
+                                    "Nothing to see here"], start=1):
+            self.ids[text] = db.session.execute(
+                Message.__table__.insert().returning(Message.id),
+                {'text': text, 'user_id': user.id,
+                 'timestamp': datetime(2023, 1, day)}).scalar_one()
+
+        # A stale term, for a word no message has, is dropped.
+        db.session.add(MessageTerm(
+            term="stale", timestamp=datetime(2023, 1, 1),
+            message_id=self.ids["Sunny weather today"]))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def texts(self, query):
+        return [msg.text for msg in search_messages(query).items]
+
+    def test_reindex(self):
+        """Does a rebuild, a chunk of messages at a time, make every
+        message findable, newest first?"""
+
+        self.assertEqual(self.texts("weather"), [])
+
+        self.assertEqual(reindex_messages(chunk_size=2), 3)
+
+        self.assertEqual(self.texts("weather"),
+                         ["Rainy weather again", "Sunny weather today"])
+        self.assertEqual(self.texts("sunny WEATHER"), ["Sunny weather today"])
+        self.assertEqual(self.texts("stale"), [])
+        self.assertEqual(MessageTerm.query.count(), 3 + 3 + 4)
+
+    def test_reindex_command(self):
+        """Does `flask reindex-messages` rebuild and report?"""
+
+        result = app.test_cli_runner().invoke(args=['reindex-messages'])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Indexed 3 messages.", result.output)
+        self.assertEqual(self.texts("nothing"), ["Nothing to see here"])
@@ -0,0 +1,108 @@
+"""Home timeline rebuild tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_timelines.py
+
+
+import os
+from datetime import datetime
+from unittest import TestCase
+
+from models import db, User, Message, Follows, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import create_app
+
+# The tests share one application context, so they can use db.session
+# outside requests.
+app = create_app('production')
+app.app_context().push()
+
+import timelines
+
+db.create_all()
+
+
+class BackfillTestCase(TestCase):
+    """Test rebuilding timelines from raw messages and follows."""
+
+    def setUp(self):
+        """Ann, Bob and Cat, with messages and follows inserted directly,
+        so nothing is fanned out."""
+
+        db.session.expunge_all()
+        db.drop_all()
+        db.create_all()
+
+        users = {name: User.signup(name, f"{name}@test.com", "password", None)
+                 for name in ["ann", "bob", "cat"]}
+        db.session.commit()
+        self.ids = {name: user.id for name, user in users.items()}
+
+        # Bob follows Ann; Cat follows both, and also Cat, which must not
+        # put Cat's messages in Cat's timeline twice.
+        db.session.execute(Follows.__table__.insert(), [
+            {'user_following_id': self.ids[follower],
+             'user_being_followed_id': self.ids[followed]}
+            for follower, followed in [("bob", "ann"), ("cat", "ann"),
+                                       ("cat", "bob"), ("cat", "cat")]])
+
+        self.messages = {}
+        for day, (text, author) in enumerate([
+                ("ann first", "ann"), ("bob first", "bob"),
+                ("ann second", "ann"), ("cat first", "cat")], start=1):
+            self.messages[text] = db.session.execute(
+                Message.__table__.insert().returning(Message.id),
+                {'text': text, 'user_id': self.ids[author],
+                 'timestamp': datetime(2023, 1, day)}).scalar_one()
+
+        # A stale entry, for a message Bob can't see, is dropped.
+        db.session.add(TimelineEntry(
+            user_id=self.ids["bob"], message_id=self.messages["cat first"],
+            author_id=self.ids["cat"], timestamp=datetime(2023, 1, 4)))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def timeline(self, name):
+        """Return (text, author, timestamp) of a user's entries, newest
+        first, as the homepage reads them."""
+
+        rows = db.session.execute(
+            db.select(Message.text, User.username, TimelineEntry.timestamp)
+            .join(Message, Message.id == TimelineEntry.message_id)
+            .join(User, User.id == TimelineEntry.author_id)
+            .where(TimelineEntry.user_id == self.ids[name])
+            .order_by(TimelineEntry.timestamp.desc(),
+                      TimelineEntry.message_id.desc()))
+        return [tuple(row) for row in rows]
+
+    def test_backfill(self):
+        """Does every user get their own and followed users' messages,
+        newest first, a chunk of users at a time?"""
+
+        written = timelines.backfill(chunk_size=1)
+        self.assertEqual(written, 9)
+
+        ann_second = ("ann second", "ann", datetime(2023, 1, 3))
+        bob_first = ("bob first", "bob", datetime(2023, 1, 2))
+        ann_first = ("ann first", "ann", datetime(2023, 1, 1))
+        cat_first = ("cat first", "cat", datetime(2023, 1, 4))
+
+        self.assertEqual(self.timeline("ann"), [ann_second, ann_first])
+        self.assertEqual(self.timeline("bob"),
+                         [ann_second, bob_first, ann_first])
+        self.assertEqual(self.timeline("cat"),
+                         [cat_first, ann_second, bob_first, ann_first])
+
+    def test_backfill_command(self):
+        """Does `flask backfill-timelines` rebuild and report?"""
+
+        result = app.test_cli_runner().invoke(args=['backfill-timelines'])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Wrote 9 timeline entries.", result.output)
+        self.assertEqual(TimelineEntry.query.count(), 9)
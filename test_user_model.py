@@ -6,9 +6,12 @@
 
 
 import os
+import signal
 from unittest import TestCase
 from sqlalchemy.exc import IntegrityError
-from models import db, User
+from models import db, User, Message, Follows
+from counters import reconcile
+from passwords import hasher, hash_rounds, PoolBusy
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -20,7 +23,12 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 
 # Now we can import app
 
-from app import app
+from app import create_app
+
+# The tests share one application context, so they can use db.session
+# outside requests.
+app = create_app('production')
+app.app_context().push()
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -194,5 +202,70 @@ class UserModelTestCase(TestCase):
         self.assertIsNotNone(u)
         self.assertEqual(u.id, self.u1.id)
 
+    def test_reconcile_counters(self):
+        """Does reconcile recompute counters from the underlying tables?"""
+
+        db.session.execute(Follows.__table__.insert().values(
+            user_being_followed_id=self.u2.id, user_following_id=self.u1.id))
+        db.session.execute(Message.__table__.insert().values(
+            text="raw warble", user_id=self.u1.id))
+        db.session.commit()
+        self.assertEqual(self.u1.messages_count, 0)
+
+        self.assertEqual(reconcile(), 2)
+        self.assertEqual(self.u1.messages_count, 1)
+        self.assertEqual(self.u1.following_count, 1)
+        self.assertEqual(self.u2.followers_count, 1)
+        self.assertEqual(reconcile(), 0)
 
+    def test_following_ids(self):
+        """Does following_ids answer for a batch of users at once?"""
 
+        u3 = User.signup('user3', 'user3@example.com', 'password3', None)
+        db.session.commit()
+        self.u1.following.append(self.u2)
+        db.session.commit()
+
+        self.assertEqual(self.u1.following_ids([self.u2.id, u3.id]), {self.u2.id})
+        self.assertEqual(self.u2.following_ids([self.u1.id, u3.id]), set())
+        self.assertEqual(self.u1.following_ids([]), set())
+
+    def test_rehash_on_login(self):
+        """Is a hash with an old work factor replaced on login?"""
+
+        old_rounds = hasher.rounds
+        hasher.rounds = 4
+        try:
+            u = User.authenticate('user1', 'password1')
+            db.session.commit()
+            self.assertEqual(hash_rounds(u.password), 4)
+            self.assertTrue(User.authenticate('user1', 'password1'))
+        finally:
+            hasher.rounds = old_rounds
+
+    def test_password_pool_busy(self):
+        """Does hashing refuse work when the queue is full?"""
+
+        old_wait = hasher.wait
+        hasher.wait = 0
+        for _ in range(hasher.max_queue):
+            hasher.slots.acquire()
+        try:
+            with self.assertRaises(PoolBusy):
+                User.authenticate('user1', 'password1')
+        finally:
+            for _ in range(hasher.max_queue):
+                hasher.slots.release()
+            hasher.wait = old_wait
+
+    def test_password_pool_process_killed(self):
+        """Are passwords still checked after a pool process dies?"""
+
+        self.assertTrue(User.authenticate('user1', 'password1'))
+
+        process = next(iter(hasher.executor._processes.values()))
+        os.kill(process.pid, signal.SIGKILL)
+        process.join()
+
+        self.assertTrue(User.authenticate('user1', 'password1'))
+        self.assertTrue(User.authenticate('user1', 'password1'))
@@ -2,14 +2,18 @@
 
 # run these tests like:
 #
-#    FLASK_ENV=production python -m unittest test_user_views.py
+#    python -m unittest test_user_views.py
 
 
+import gc
 import os
+import weakref
+from datetime import datetime
 from unittest import TestCase
 
-from models import db, connect_db, Message, User, Likes, Follows
+from models import db, connect_db, Message, User, Likes, Follows, TimelineEntry
 from bs4 import BeautifulSoup
+from prometheus_client import REGISTRY
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -21,7 +25,14 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 
 # Now we can import app
 
-from app import app, CURR_USER_KEY
+from app import create_app, CURR_USER_KEY, identity_cache, fragment_cache
+
+# The tests share one application context, so they can use db.session
+# outside requests.
+app = create_app('production')
+app.app_context().push()
+
+import jobs
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -40,8 +51,11 @@ class UserViewTestCase(TestCase):
     def setUp(self):
         """Create test client, add sample data."""
 
+        db.session.expunge_all()
         db.drop_all()
         db.create_all()
+        identity_cache.clear()
+        fragment_cache.clear()
 
         self.client = app.test_client()
 
@@ -224,3 +238,200 @@ class UserViewTestCase(TestCase):
            
             self.assertEqual(resp.status_code, 200)
             self.assertIn('Access unauthorized', str(resp.data))    
+
+    def test_follow_fills_timeline(self):
+        """Do a followed user's existing messages show up on the homepage?"""
+
+        db.session.add(Message(text="Posted before the follow", user_id=self.u4.id))
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            c.post(f"/users/follow/{self.u4.id}")
+            resp = c.get("/")
+            self.assertIn("Posted before the follow", resp.get_data(as_text=True))
+
+    def test_stop_following_clears_timeline(self):
+        """Does unfollowing drop that user's messages from the homepage?"""
+
+        self.setup_followers()
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1.id
+            c.post("/messages/new", data={"text": "Soon to be unfollowed"})
+        jobs.work()   # fan the message out to followers
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.get("/")
+            self.assertIn("Soon to be unfollowed", resp.get_data(as_text=True))
+
+            c.post(f"/users/stop-following/{self.u1.id}")
+            resp = c.get("/")
+            self.assertNotIn("Soon to be unfollowed", resp.get_data(as_text=True))
+            self.assertEqual(
+                TimelineEntry.query.filter_by(user_id=self.testuser.id).count(), 0)
+
+    def test_user_profile_pagination(self):
+        """Do older/newer cursors walk through a user's messages?"""
+
+        for i in range(5):
+            db.session.add(Message(text=f"warble number {i}",
+                                   timestamp=datetime(2023, 1, 1 + i),
+                                   user_id=self.u1.id))
+        db.session.commit()
+        app.config['MESSAGES_PER_PAGE'] = 2
+
+        try:
+            with self.client as c:
+                html = c.get(f"/users/{self.u1.id}").get_data(as_text=True)
+                self.assertIn("warble number 4", html)
+                self.assertIn("warble number 3", html)
+                self.assertNotIn("warble number 2", html)
+                self.assertNotIn(">Newer<", html)
+
+                older = BeautifulSoup(html, 'html.parser').find('a', string='Older')['href']
+                html = c.get(older).get_data(as_text=True)
+                self.assertIn("warble number 2", html)
+                self.assertIn("warble number 1", html)
+                self.assertNotIn("warble number 3", html)
+
+                newer = BeautifulSoup(html, 'html.parser').find('a', string='Newer')['href']
+                html = c.get(newer).get_data(as_text=True)
+                self.assertIn("warble number 4", html)
+                self.assertIn("warble number 3", html)
+
+                resp = c.get(f"/users/{self.u1.id}?before=not-a-cursor")
+                self.assertEqual(resp.status_code, 400)
+        finally:
+            app.config['MESSAGES_PER_PAGE'] = 100
+
+    def test_follow_counters(self):
+        """Do follow/unfollow keep both users' counters in step?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            c.post(f"/users/follow/{self.u4.id}")
+            self.assertEqual(User.query.get(self.testuser.id).following_count, 1)
+            self.assertEqual(User.query.get(self.u4.id).followers_count, 1)
+
+            c.post(f"/users/stop-following/{self.u4.id}")
+            self.assertEqual(User.query.get(self.testuser.id).following_count, 0)
+            self.assertEqual(User.query.get(self.u4.id).followers_count, 0)
+
+    def test_users_view_follow_buttons(self):
+        """Does the /users grid mark who the viewer already follows?"""
+
+        self.setup_followers()
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            soup = BeautifulSoup(c.get("/users").get_data(as_text=True), 'html.parser')
+            unfollow = {form['action'] for form in soup.find_all('form')
+                        if form.get('action', '').startswith('/users/stop-following/')}
+            self.assertEqual(unfollow, {f"/users/stop-following/{self.u1.id}",
+                                        f"/users/stop-following/{self.u2.id}"})
+
+    def test_identity_cache(self):
+        """Is the logged-in user's record cached, and refreshed on edit?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            c.get(f"/users/{self.u1.id}")
+            before = c.get("/_stats").get_json()['identity_cache']
+            c.get(f"/users/{self.u1.id}")
+            after = c.get("/_stats").get_json()['identity_cache']
+            self.assertEqual(after['hits'] - before['hits'], 2)
+            self.assertEqual(after['misses'], before['misses'])
+
+            resp = c.post("/users/profile", data={"username": "renamed",
+                                                  "email": "test@test.com",
+                                                  "password": "testuser"})
+            self.assertEqual(resp.status_code, 302)
+            resp = c.get("/users/profile")
+            self.assertIn("renamed", resp.get_data(as_text=True))
+
+    def test_users_show_conditional_get(self):
+        """Does the profile page answer 304 until something on it changes?"""
+
+        with self.client as c:
+            resp = c.get(f"/users/{self.u1.id}")
+            self.assertIn('public', resp.headers['Cache-Control'])
+            etag = resp.headers['ETag']
+
+            resp = c.get(f"/users/{self.u1.id}", headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.data, b'')
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.get(f"/users/{self.u1.id}", headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('private', resp.headers['Cache-Control'])
+            etag = resp.headers['ETag']
+
+            c.post(f"/users/follow/{self.u1.id}")
+            resp = c.get(f"/users/{self.u1.id}", headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('Unfollow', resp.get_data(as_text=True))
+
+    def test_uncacheable_pages(self):
+        """Are pages without validators marked no-store?"""
+
+        with self.client as c:
+            resp = c.get("/signup")
+            self.assertIn('no-store', resp.headers['Cache-Control'])
+
+    def test_metrics(self):
+        """Does /metrics export per-endpoint latency and response counts?"""
+
+        with self.client as c:
+            c.get(f"/users/{self.u1.id}")
+            resp = c.get("/metrics")
+            self.assertEqual(resp.status_code, 200)
+            text = resp.get_data(as_text=True)
+            self.assertIn('warbler_request_duration_seconds_count'
+                          '{endpoint="warbler.users_show",method="GET"}', text)
+            self.assertIn('warbler_responses_total'
+                          '{endpoint="warbler.users_show",status="200"}', text)
+            self.assertIn('warbler_db_pool_checkout_wait_seconds_count', text)
+
+    def test_password_timed_once(self):
+        """Is a password check observed once, however many apps exist?"""
+
+        create_app('production')
+        db.app = app
+
+        def checks():
+            return REGISTRY.get_sample_value(
+                'warbler_password_seconds_count',
+                {'operation': 'check_password'}) or 0
+
+        before = checks()
+        User.authenticate("testuser", "testuser")
+        self.assertEqual(checks(), before + 1)
+
+    def test_create_app_releases_engines(self):
+        """Is an app that is created and dropped freed, engine and all?"""
+
+        other = create_app('production')
+        with other.app_context():
+            engine = weakref.ref(db.engine)
+
+        # connect_db keeps the newest app as db.app; make it this module's.
+        del other
+        db.app = app
+        while gc.collect():
+            pass
+
+        self.assertIsNone(engine())
@@ -0,0 +1,181 @@
+"""Materialized home timelines for Warbler.
+
+Every message is copied into the `timelines` table once for its author and
+once for each of the author's followers when it is posted. The homepage then
+only has to read the newest rows for one user, no matter how many accounts
+that user follows.
+
+None of these functions commit; callers commit along with the change that
+caused the timeline update so both land in the same transaction.
+"""
+
+from sqlalchemy import (
+    delete, exists, func, insert, literal, select, union_all,
+)
+
+from models import db, Follows, Message, TimelineEntry
+
+TIMELINE_COLUMNS = ['user_id', 'message_id', 'author_id', 'timestamp']
+
+# How many of a user's latest messages are copied into a new follower's
+# timeline when the follow happens.
+FOLLOW_BACKFILL_LIMIT = 100
+
+BACKFILL_CHUNK_SIZE = 1000
+
+
+def fan_out(msg):
+    """Copy `msg` into the timelines of its author and all their followers.
+
+    `msg` must already be flushed so it has an id and timestamp.
+    """
+
+    fan_out_to_author(msg)
+    fan_out_to_followers(msg.id)
+
+
+def fan_out_to_author(msg):
+    """Copy `msg` into its author's own timeline.
+
+    Posting does this straight away, so authors see their message, and
+    queues `fan_out_to_followers` for everyone else (see jobs.py).
+    """
+
+    db.session.execute(insert(TimelineEntry).values(
+        user_id=msg.user_id,
+        message_id=msg.id,
+        author_id=msg.user_id,
+        timestamp=msg.timestamp,
+    ))
+
+
+def fan_out_to_followers(message_id, after=0, limit=None):
+    """Copy a message into the timelines of its author's followers.
+
+    Covers the followers with ids above `after`, in id order, at most
+    `limit` of them (all when None), so a popular author's message can be
+    copied a chunk per transaction. Returns the id of the last follower
+    covered, or None once none are left.
+
+    Safe to run late or twice: a message deleted meanwhile copies nowhere,
+    and timelines that already have it (say, from a follow made since) are
+    skipped.
+    """
+
+    author_id = select(Message.user_id).where(Message.id == message_id)
+    chunk = (select(Follows.user_following_id)
+             .where(Follows.user_being_followed_id == author_id
+                    .scalar_subquery())
+             .where(Follows.user_following_id > after)
+             .order_by(Follows.user_following_id)
+             .limit(limit)
+             .subquery())
+    last = db.session.scalar(select(func.max(chunk.c.user_following_id)))
+    if last is None:
+        return None
+
+    followers = (select(
+        Follows.user_following_id,
+        Message.id,
+        Message.user_id,
+        Message.timestamp,
+    )
+        .join(Message, Message.user_id == Follows.user_being_followed_id)
+        .where(Message.id == message_id)
+        .where(Follows.user_following_id > after)
+        .where(Follows.user_following_id <= last)
+        .where(Follows.user_following_id != Message.user_id)
+        .where(~exists().where(
+            TimelineEntry.user_id == Follows.user_following_id,
+            TimelineEntry.message_id == Message.id,
+        )))
+
+    db.session.execute(
+        insert(TimelineEntry).from_select(TIMELINE_COLUMNS, followers))
+
+    return last
+
+
+def add_follow(follower_id, followed_id):
+    """Copy the latest messages of `followed_id` into `follower_id`'s timeline."""
+
+    if follower_id == followed_id:
+        return
+
+    recent = (select(
+        literal(follower_id),
+        Message.id,
+        Message.user_id,
+        Message.timestamp,
+    )
+        .where(Message.user_id == followed_id)
+        .order_by(Message.timestamp.desc())
+        .limit(FOLLOW_BACKFILL_LIMIT))
+
+    db.session.execute(
+        insert(TimelineEntry).from_select(TIMELINE_COLUMNS, recent))
+
+
+def remove_follow(follower_id, followed_id):
+    """Drop every message by `followed_id` from `follower_id`'s timeline."""
+
+    if follower_id == followed_id:
+        return
+
+    db.session.execute(
+        delete(TimelineEntry)
+        .where(TimelineEntry.user_id == follower_id)
+        .where(TimelineEntry.author_id == followed_id))
+
+
+def remove_message(message_id):
+    """Drop a message from every timeline it was fanned out to."""
+
+    db.session.execute(
+        delete(TimelineEntry).where(TimelineEntry.message_id == message_id))
+
+
+def backfill(chunk_size=BACKFILL_CHUNK_SIZE):
+    """Rebuild all timelines from the `messages` and `follows` tables.
+
+    Works through users in id ranges of `chunk_size`, committing after each
+    range so a large rebuild never holds one giant transaction open.
+    Returns the number of timeline rows written.
+    """
+
+    db.session.execute(delete(TimelineEntry))
+    db.session.commit()
+
+    max_id = db.session.scalar(select(db.func.max(Message.user_id)))
+    max_follower_id = db.session.scalar(
+        select(db.func.max(Follows.user_following_id)))
+    last_id = max(max_id or 0, max_follower_id or 0)
+
+    written = 0
+    for start in range(1, last_id + 1, chunk_size):
+        end = start + chunk_size - 1
+
+        own = (select(
+            Message.user_id,
+            Message.id,
+            Message.user_id,
+            Message.timestamp,
+        )
+            .where(Message.user_id.between(start, end)))
+        followed = (select(
+            Follows.user_following_id,
+            Message.id,
+            Message.user_id,
+            Message.timestamp,
+        )
+            .join(Message, Message.user_id == Follows.user_being_followed_id)
+            .where(Follows.user_following_id.between(start, end))
+            .where(Follows.user_following_id != Follows.user_being_followed_id))
+
+        result = db.session.execute(
+            insert(TimelineEntry)
+            .from_select(TIMELINE_COLUMNS, union_all(own, followed)))
+        db.session.commit()
+        written += max(result.rowcount, 0)
+
+    return written